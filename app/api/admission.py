@@ -0,0 +1,309 @@
+"""
+准入控制: 按搜索模式(search / deep-research)分别限制并发数和排队长度,
+队列已满时快速失败,并根据最近的完成速率估算 Retry-After。
+"""
+import asyncio
+import math
+from pathlib import Path
+import sys
+import time
+from collections import deque
+from threading import Event, Lock
+from typing import Iterator, Optional
+
+# 将项目根目录添加到sys.path
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from app.utils.metrics import Gauge
+from config import base_config as config
+from config.logging_config import logger
+
+DRAIN_WINDOW = 300  # 统计完成速率的时间窗口(秒)
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 600
+SPARE_SERVER_THREADS = 4  # 留给 /metrics、/ready、设置页等不经过准入控制的请求
+UNLIMITED_SERVER_THREADS = 64
+
+
+class AdmissionRejected(Exception):
+    """请求被准入控制拒绝"""
+
+    def __init__(self, mode_name: str, retry_after: int):
+        super().__init__(f"{mode_name} 请求过多,请在 {retry_after} 秒后重试")
+        self.mode_name = mode_name
+        self.retry_after = retry_after
+
+
+class Admission:
+    """一个请求占用的执行名额,请求结束后 release;重复 release 只生效一次"""
+
+    def __init__(self, limiter: "ModeLimiter"):
+        self.limiter = limiter
+        self.started = time.time()
+
+    def release(self) -> None:
+        self.limiter.release(self)
+
+
+class _Waiter:
+    """在线程中排队的请求(waitress 模式)"""
+
+    def __init__(self):
+        self.admission: Optional[Admission] = None
+        self._event = Event()
+
+    def grant(self, admission: Admission) -> bool:
+        self.admission = admission
+        self._event.set()
+        return True
+
+    def wait(self, timeout: float) -> None:
+        self._event.wait(timeout)
+
+
+class _AsyncWaiter:
+    """在事件循环中排队的请求(ASGI 模式),等待期间不占用线程"""
+
+    def __init__(self):
+        self.admission: Optional[Admission] = None
+        self._loop = asyncio.get_running_loop()
+        self._future = self._loop.create_future()
+
+    def grant(self, admission: Admission) -> bool:
+        try:
+            self._loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            # 事件循环已关闭,名额交给下一个排队的请求
+            return False
+        self.admission = admission
+        return True
+
+    def _wake(self) -> None:
+        if not self._future.done():
+            self._future.set_result(None)
+
+    async def wait(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(asyncio.shield(self._future), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class ModeLimiter:
+    """单个模式的并发上限 + 有界等待队列,排队的请求按先后顺序获得名额"""
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency  # 0 表示不限制
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._lock = Lock()
+        self._running: set[Admission] = set()
+        self._waiters: deque = deque()
+        self._finished = deque()  # 最近请求的完成时间
+
+    @property
+    def active(self) -> int:
+        return len(self._running)
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def configure(self, max_concurrency: int, max_queue: int, queue_timeout: float) -> None:
+        """修改限制,正在执行与排队的请求保留;上限提高后排队的请求立即获得名额"""
+        with self._lock:
+            self.max_concurrency, self.max_queue, self.queue_timeout = max_concurrency, max_queue, queue_timeout
+            self._grant()
+
+    def _has_capacity(self) -> bool:
+        return not self.max_concurrency or len(self._running) < self.max_concurrency
+
+    def _trim(self, now: float) -> None:
+        while self._finished and now - self._finished[0] > DRAIN_WINDOW:
+            self._finished.popleft()
+
+    def _retry_after(self) -> int:
+        """根据队列排空速率估算客户端需要等待的秒数,需持有 _lock"""
+        now = time.time()
+        self._trim(now)
+        ahead = len(self._waiters) + 1
+        if len(self._finished) >= 2:
+            span = max(now - self._finished[0], 1e-3)
+            rate = len(self._finished) / span
+            estimate = ahead / rate
+        elif self._running:
+            # 还没有足够的完成记录时,用当前最早的请求已运行时长粗略估计
+            estimate = now - min(admission.started for admission in self._running)
+        else:
+            estimate = self.queue_timeout
+        return int(min(max(math.ceil(estimate), MIN_RETRY_AFTER), MAX_RETRY_AFTER))
+
+    def _enter(self) -> Admission:
+        admission = Admission(self)
+        self._running.add(admission)
+        return admission
+
+    def _grant(self) -> None:
+        """把空出的名额按顺序交给排队的请求,需持有 _lock"""
+        while self._waiters and self._has_capacity():
+            admission = self._enter()
+            if not self._waiters.popleft().grant(admission):
+                self._running.discard(admission)
+
+    def _enqueue(self, waiter) -> Optional[Admission]:
+        """有空闲名额且无人排队时直接返回名额,否则排队;队列已满抛出 AdmissionRejected"""
+        with self._lock:
+            if self._has_capacity() and not self._waiters:
+                return self._enter()
+            if len(self._waiters) >= self.max_queue:
+                raise AdmissionRejected(self.name, self._retry_after())
+            self._waiters.append(waiter)
+            return None
+
+    def _give_up(self, waiter) -> Optional[Admission]:
+        """停止排队: 已分配到名额时返回名额,否则移出队列并返回 None"""
+        with self._lock:
+            if waiter.admission is None and waiter in self._waiters:
+                self._waiters.remove(waiter)
+            return waiter.admission
+
+    def _timed_out(self, waiter) -> Admission:
+        admission = self._give_up(waiter)
+        if admission is None:
+            with self._lock:
+                raise AdmissionRejected(self.name, self._retry_after())
+        return admission
+
+    def acquire(self) -> Admission:
+        """获取执行名额,必要时在当前线程中排队等待;队列满或等待超时抛出 AdmissionRejected"""
+        waiter = _Waiter()
+        admission = self._enqueue(waiter)
+        if admission is not None:
+            return admission
+        waiter.wait(self.queue_timeout)
+        return self._timed_out(waiter)
+
+    async def acquire_async(self) -> Admission:
+        """acquire 的异步版本,排队时不占用线程;客户端断开(任务被取消)时退出队列或归还名额"""
+        waiter = _AsyncWaiter()
+        admission = self._enqueue(waiter)
+        if admission is not None:
+            return admission
+        try:
+            await waiter.wait(self.queue_timeout)
+        except BaseException:
+            admission = self._give_up(waiter)
+            if admission is not None:
+                admission.release()
+            raise
+        return self._timed_out(waiter)
+
+    def release(self, admission: Admission) -> None:
+        with self._lock:
+            if admission not in self._running:
+                return
+            self._running.discard(admission)
+            now = time.time()
+            self._finished.append(now)
+            self._trim(now)
+            self._grant()
+
+
+_LIMITERS: dict[int, ModeLimiter] = {}
+_LIMITERS_LOCK = Lock()
+
+
+def _mode_settings(search_mode: int) -> tuple:
+    if search_mode == 2:
+        return ("deep-research", config.DEEPRESEARCH_MAX_CONCURRENCY,
+                config.DEEPRESEARCH_MAX_QUEUE, config.ADMISSION_QUEUE_TIMEOUT)
+    return ("search", config.SEARCH_MAX_CONCURRENCY, config.SEARCH_MAX_QUEUE, config.ADMISSION_QUEUE_TIMEOUT)
+
+
+def get_limiter(search_mode: int) -> ModeLimiter:
+    """获取搜索模式对应的限流器,配置变化后原地修改限制,正在执行的请求仍计入并发数"""
+    name, *limits = _mode_settings(search_mode)
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(search_mode)
+        if limiter is None:
+            limiter = _LIMITERS[search_mode] = ModeLimiter(name, *limits)
+        elif [limiter.max_concurrency, limiter.max_queue, limiter.queue_timeout] != limits:
+            logger.info(f"{name} 准入配置已变更: 并发 {limits[0]},队列 {limits[1]},排队超时 {limits[2]} 秒")
+            limiter.configure(*limits)
+        return limiter
+
+
+def server_threads() -> int:
+    """
+    waitress 的工作线程数。流式响应全程占用一个线程,排队的请求同样在线程中等待,
+    线程数不足时请求会先在 waitress 中无声排队,准入控制的上限与 429 都不会生效。
+    因此按两种模式的并发上限与队列长度之和,再留出 /metrics、/ready 等接口使用的线程;
+    不限制并发时使用 UNLIMITED_SERVER_THREADS。
+    """
+    limits = [_mode_settings(mode) for mode in (1, 2)]
+    if any(not max_concurrency for _, max_concurrency, _, _ in limits):
+        return UNLIMITED_SERVER_THREADS
+    return sum(max_concurrency + max_queue for _, max_concurrency, max_queue, _ in limits) + SPARE_SERVER_THREADS
+
+
+def admitted_concurrency() -> int:
+    """两种模式的并发上限之和,即同时执行的请求数上限;任一模式不限制并发时返回 0"""
+    limits = [_mode_settings(mode) for mode in (1, 2)]
+    if any(not max_concurrency for _, max_concurrency, _, _ in limits):
+        return 0
+    return sum(max_concurrency for _, max_concurrency, _, _ in limits)
+
+
+def _limiter_stats(attr: str) -> dict:
+    with _LIMITERS_LOCK:
+        limiters = list(_LIMITERS.values())
+    return {(limiter.name,): getattr(limiter, attr) for limiter in limiters}
+
+
+Gauge("requests_in_flight", "正在执行的请求数", ("mode",), callback=lambda: _limiter_stats("active"))
+Gauge("requests_queued", "准入队列中等待的请求数", ("mode",), callback=lambda: _limiter_stats("waiting"))
+
+
+def admit(search_mode: int) -> Admission:
+    """为请求获取执行名额,返回的名额需要在请求结束后 release"""
+    return get_limiter(search_mode).acquire()
+
+
+async def admit_async(search_mode: int) -> Admission:
+    """admit 的异步版本,ASGI 模式中排队时不占用线程"""
+    return await get_limiter(search_mode).acquire_async()
+
+
+class ReleaseOnClose:
+    """
+    包装流式响应,在迭代结束或被关闭(客户端断开)时释放名额。
+    使用类而不是生成器,保证流从未被迭代就被关闭时也能释放,且只释放一次。
+    """
+
+    def __init__(self, gen: Iterator, admission: Admission):
+        self._gen = gen
+        self._admission = admission
+        self._released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._gen)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        try:
+            if hasattr(self._gen, "close"):
+                self._gen.close()
+        finally:
+            self._admission.release()
@@ -0,0 +1,296 @@
+"""
+ASGI 入口: 在事件循环上处理 /v1/chat/completions、/v1/models、/v1/jobs 与 /v1/traces,
+流式响应为异步生成器,其余路径(如 /setting 配置页)转交给 Flask 应用。
+"""
+import asyncio
+import json
+from pathlib import Path
+import sys
+from typing import Optional
+from urllib.parse import parse_qs
+
+# 将项目根目录添加到sys.path
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from app.api.admission import AdmissionRejected, admit_async
+from app.api.jobs import JOBS
+from app.api.routes import (build_chat_messages, build_completion_payload,
+                            build_models_payload, build_rejected_payload,
+                            get_search_mode, is_authorized, resolve_job_resume,
+                            use_detached_job)
+from app.api.response_cache import CACHED_USAGE, RESPONSE_CACHE, cache_key
+from app.api.sse_add_heartbeat import STREAM_SCHEDULER, heartbeat_stream_async
+from app.chat.functions import process_messages, process_messages_stream
+from app.utils.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, render_metrics
+from app.utils.warmup import is_ready, readiness
+from app.utils.request_context import RequestContext
+from app.utils.tracing import TRACES
+from config import base_config as config
+from config.logging_config import logger
+
+
+async def _read_body(receive) -> bytes:
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return b""
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+async def _send_json(send, status: int, payload: dict, headers: Optional[list] = None) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ] + (headers or []),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _wait_disconnect(receive) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def _send_stream(send, receive, stream, headers: Optional[list] = None) -> None:
+    """逐条发送 SSE 数据,同时监听客户端断开,断开后立即停止流"""
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+        ] + (headers or []),
+    })
+
+    async def pump():
+        async for data in stream:
+            await send({"type": "http.response.body", "body": data.encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    pump_task = asyncio.ensure_future(pump())
+    disconnect_task = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        done, _ = await asyncio.wait({pump_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+        if disconnect_task in done:
+            logger.info("客户端已断开连接，停止推送")
+        else:
+            pump_task.result()
+    finally:
+        for task in (pump_task, disconnect_task):
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(pump_task, disconnect_task, return_exceptions=True)
+        await stream.aclose()
+
+
+async def _aiter(frames):
+    """把内存中的数据包装为异步生成器,供 _send_stream 使用"""
+    for data in frames:
+        yield data
+
+
+def _get_header(scope, name: bytes) -> str:
+    for key, value in scope.get("headers", []):
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return ""
+
+
+def create_asgi_app(wsgi_app=None):
+    """
+    创建 ASGI 应用。
+
+    Args:
+        wsgi_app: 可选的 Flask 应用,未被 ASGI 路由处理的请求会转交给它
+    """
+    fallback = None
+    if wsgi_app is not None:
+        from a2wsgi import WSGIMiddleware
+        fallback = WSGIMiddleware(wsgi_app)
+
+    async def resume_job_stream(scope, receive, send, last_event_id: str, job_id: str = ""):
+        job, seq = resolve_job_resume(last_event_id, job_id)
+        if job is None:
+            await _send_json(send, 404, {"error": "任务不存在或已过期"})
+            return
+        await _send_stream(send, receive, job.aiter_events(seq),
+                           headers=[(b"x-job-id", job.id.encode())])
+
+    async def chat_completions(scope, receive, send):
+        auth = _get_header(scope, b"authorization")
+        if not is_authorized(auth):
+            await _send_json(send, 401, {"error": f"Invalid API Key {auth}"})
+            return
+        # 断线重连: 根据 Last-Event-ID 从后台任务的事件日志继续推送
+        last_event_id = _get_header(scope, b"last-event-id")
+        if last_event_id:
+            await resume_job_stream(scope, receive, send, last_event_id)
+            return
+        try:
+            data = json.loads(await _read_body(receive) or b"null")
+        except json.JSONDecodeError:
+            data = None
+        if not data or "messages" not in data:
+            await _send_json(send, 400, {"error": "传入数据有问题!"})
+            return
+        search_mode = get_search_mode(data.get("model"))
+        stream_mode = data.get("stream", False)
+
+        # 命中响应缓存时直接返回,不占用准入名额
+        key = cache_key(data["messages"], data.get("model"), search_mode, stream_mode)
+        cached = RESPONSE_CACHE.get(key)
+        if cached is not None:
+            logger.info("命中响应缓存")
+            if stream_mode:
+                await _send_stream(send, receive, _aiter(RESPONSE_CACHE.replay(cached)),
+                                   headers=[(b"x-cache", b"HIT")])
+            else:
+                await _send_json(send, 200, build_completion_payload(cached, CACHED_USAGE),
+                                 headers=[(b"x-cache", b"HIT")])
+            return
+
+        messages = build_chat_messages(data)
+
+        try:
+            # 排队等待在事件循环中进行,不占用线程
+            admission = await admit_async(search_mode)
+        except AdmissionRejected as e:
+            await _send_json(send, 429, build_rejected_payload(e),
+                             headers=[(b"retry-after", str(e.retry_after).encode())])
+            return
+
+        ctx = RequestContext()
+        if use_detached_job(search_mode, stream_mode):
+            job = JOBS.start(RESPONSE_CACHE.record(key, process_messages_stream(messages, search_mode, ctx)), search_mode,
+                             on_finish=admission.release, ctx=ctx)
+            await _send_stream(send, receive, job.aiter_events(),
+                               headers=[(b"x-job-id", job.id.encode()), (b"x-request-id", ctx.request_id.encode())])
+        elif stream_mode:
+            stream = heartbeat_stream_async(
+                RESPONSE_CACHE.record(key, process_messages_stream(messages, search_mode, ctx)), ctx)
+            try:
+                await _send_stream(send, receive, stream, headers=[(b"x-request-id", ctx.request_id.encode())])
+            finally:
+                admission.release()
+        else:
+            task = asyncio.wrap_future(STREAM_SCHEDULER.submit(process_messages, messages, search_mode, ctx))
+            disconnect_task = asyncio.ensure_future(_wait_disconnect(receive))
+            try:
+                await asyncio.wait({task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+                if not task.done():
+                    # 客户端已断开,取消请求并等待流水线停下后再释放名额
+                    logger.info("客户端已断开连接，取消请求")
+                    ctx.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    return
+                assistant_message = task.result()
+            finally:
+                disconnect_task.cancel()
+                admission.release()
+            RESPONSE_CACHE.put_message(key, assistant_message)
+            await _send_json(send, 200, build_completion_payload(assistant_message, ctx.usage_dict()),
+                             headers=[(b"x-request-id", ctx.request_id.encode())])
+
+    async def models(scope, receive, send):
+        auth = _get_header(scope, b"authorization")
+        if not is_authorized(auth):
+            await _send_json(send, 401, {"error": f"Invalid API Key {auth}"})
+            return
+        await _send_json(send, 200, build_models_payload())
+
+    async def metrics(scope, receive, send):
+        if not config.METRICS_ENABLED:
+            await _send_json(send, 404, {"error": "Not Found"})
+            return
+        body = render_metrics().encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", METRICS_CONTENT_TYPE.encode()),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def ready(scope, receive, send):
+        await _send_json(send, 200 if is_ready() else 503, readiness())
+
+    async def traces(scope, receive, send):
+        auth = _get_header(scope, b"authorization")
+        if not is_authorized(auth):
+            await _send_json(send, 401, {"error": f"Invalid API Key {auth}"})
+            return
+        trace = TRACES.get(scope["path"][len("/v1/traces/"):].strip("/"))
+        if trace is None or scope["method"] != "GET":
+            await _send_json(send, 404, {"error": "trace 不存在或已过期"})
+            return
+        await _send_json(send, 200, trace.to_dict())
+
+    async def jobs(scope, receive, send):
+        auth = _get_header(scope, b"authorization")
+        if not is_authorized(auth):
+            await _send_json(send, 401, {"error": f"Invalid API Key {auth}"})
+            return
+        parts = scope["path"][len("/v1/jobs/"):].strip("/").split("/")
+        job_id = parts[0]
+        if len(parts) == 2 and parts[1] == "events" and scope["method"] == "GET":
+            query = parse_qs(scope.get("query_string", b"").decode())
+            last_event_id = _get_header(scope, b"last-event-id") or query.get("last_event_id", [""])[0]
+            await resume_job_stream(scope, receive, send, last_event_id, job_id=job_id)
+            return
+        if len(parts) != 1 or scope["method"] not in ("GET", "DELETE"):
+            await _send_json(send, 404, {"error": "Not Found"})
+            return
+        job = JOBS.get(job_id)
+        if job is None:
+            await _send_json(send, 404, {"error": "任务不存在或已过期"})
+            return
+        if scope["method"] == "DELETE":
+            job.cancel()
+        await _send_json(send, 200, job.to_dict())
+
+    routes = {
+        ("POST", "/v1/chat/completions"): chat_completions,
+        ("GET", "/v1/models"): models,
+        ("GET", "/metrics"): metrics,
+        ("GET", "/ready"): ready,
+    }
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+
+        handler = routes.get((scope["method"], scope["path"]))
+        if handler is None and scope["path"].startswith("/v1/jobs/"):
+            handler = jobs
+        elif handler is None and scope["path"].startswith("/v1/traces/"):
+            handler = traces
+        if handler is not None:
+            await handler(scope, receive, send)
+        elif fallback is not None:
+            await fallback(scope, receive, send)
+        else:
+            await _send_json(send, 404, {"error": "Not Found"})
+
+    return app
@@ -0,0 +1,209 @@
+"""
+后台研究任务: 深度研究在服务端独立运行,输出写入只追加的事件日志。
+客户端断开不会中止任务,重连时通过 Last-Event-ID 从断点继续接收。
+"""
+import asyncio
+from pathlib import Path
+import sys
+import time
+import uuid
+from threading import Condition, Event, Lock
+from typing import AsyncGenerator, Callable, Generator, Optional, Tuple
+
+# 将项目根目录添加到sys.path
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from app.api.sse_add_heartbeat import HEARTBEAT_FRAME, STREAM_SCHEDULER
+from app.utils.request_context import RequestContext
+from config import base_config as config
+from config.logging_config import logger
+
+
+class ResearchJob:
+    """一个后台研究任务及其事件日志"""
+
+    def __init__(self, job_id: str, search_mode: int, ctx: Optional[RequestContext] = None):
+        self.id = job_id
+        self.search_mode = search_mode
+        self.ctx = ctx
+        self.status = "running"  # running / done / error / cancelled
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._events: list[str] = []
+        self._cond = Condition()
+        self._async_waiters: set = set()
+        self._cancel_event = Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self) -> None:
+        """取消任务;客户端断开不会调用,只有删除任务时才会中止进行中的工作"""
+        self._cancel_event.set()
+        if self.ctx is not None:
+            self.ctx.cancel()
+
+    def append(self, data: str) -> None:
+        with self._cond:
+            self._events.append(data)
+            self._cond.notify_all()
+        self._wake_async_waiters()
+
+    def finish(self, status: str) -> None:
+        with self._cond:
+            self.status = status
+            self.finished_at = time.time()
+            self._cond.notify_all()
+        self._wake_async_waiters()
+
+    def _wake_async_waiters(self) -> None:
+        with self._cond:
+            waiters = list(self._async_waiters)
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(waiter.set)
+
+    def _frame(self, seq: int, data: str) -> str:
+        """为事件加上 SSE id,seq 从 1 开始计数"""
+        return f"id: {self.id}-{seq}\n{data}"
+
+    def to_dict(self) -> dict:
+        with self._cond:
+            events = len(self._events)
+        return {
+            "id": self.id,
+            "object": "research.job",
+            "status": self.status,
+            "search_mode": self.search_mode,
+            "created": int(self.created_at),
+            "finished": int(self.finished_at) if self.finished_at else None,
+            "events": events,
+            "request_id": self.ctx.request_id if self.ctx is not None else None,
+        }
+
+    def iter_events(self, after: int = 0) -> Generator[str, None, None]:
+        """从第 after 个事件之后开始回放,并持续等待新事件直到任务结束"""
+        seq = after
+        while True:
+            with self._cond:
+                if seq >= len(self._events) and not self.finished:
+                    self._cond.wait(timeout=config.HEARTBEAT_TIMEOUT)
+                batch = self._events[seq:]
+                done = self.finished
+            if not batch:
+                if done:
+                    return
+                # 超时，发送心跳以保持连接
+                yield HEARTBEAT_FRAME
+                continue
+            for data in batch:
+                seq += 1
+                yield self._frame(seq, data)
+
+    async def aiter_events(self, after: int = 0) -> AsyncGenerator[str, None]:
+        """iter_events 的异步版本,等待期间不占用线程"""
+        loop = asyncio.get_running_loop()
+        seq = after
+        while True:
+            waiter = asyncio.Event()
+            with self._cond:
+                batch = self._events[seq:]
+                done = self.finished
+                if not batch and not done:
+                    self._async_waiters.add((loop, waiter))
+            if batch:
+                for data in batch:
+                    seq += 1
+                    yield self._frame(seq, data)
+                continue
+            if done:
+                return
+            try:
+                await asyncio.wait_for(waiter.wait(), timeout=config.HEARTBEAT_TIMEOUT)
+            except asyncio.TimeoutError:
+                yield HEARTBEAT_FRAME
+            finally:
+                with self._cond:
+                    self._async_waiters.discard((loop, waiter))
+
+
+def parse_last_event_id(last_event_id: str) -> Tuple[str, int]:
+    """解析 Last-Event-ID,格式为 <job_id>-<seq>;只有任务id时从头回放"""
+    job_id, sep, seq = last_event_id.strip().rpartition("-")
+    if not sep:
+        return seq, 0
+    try:
+        return job_id, int(seq)
+    except ValueError:
+        return last_event_id.strip(), 0
+
+
+class JobManager:
+    """保存运行中和最近结束的任务,结束超过 JOB_TTL 秒的任务会被清理"""
+
+    def __init__(self):
+        self._jobs: dict[str, ResearchJob] = {}
+        self._lock = Lock()
+
+    def start(self, gen: Generator, search_mode: int,
+              on_finish: Optional[Callable[[], None]] = None,
+              ctx: Optional[RequestContext] = None) -> ResearchJob:
+        self._cleanup()
+        job = ResearchJob(uuid.uuid4().hex, search_mode, ctx)
+        with self._lock:
+            self._jobs[job.id] = job
+        # 与流式响应一样由共享调度器逐步驱动,步骤之间不占用线程
+        def on_item(data: str) -> bool:
+            if job.cancelled:
+                return False
+            job.append(data)
+            return True
+
+        def on_end(error: Optional[BaseException]) -> None:
+            self._finish(job, gen, error, on_finish)
+
+        STREAM_SCHEDULER.drive(gen, on_item, on_end)
+        logger.info(f"后台研究任务 {job.id} 已启动")
+        return job
+
+    @staticmethod
+    def _finish(job: ResearchJob, gen: Generator, error: Optional[BaseException],
+                on_finish: Optional[Callable[[], None]]) -> None:
+        status = "done"
+        if error is not None:
+            logger.error(f"后台研究任务 {job.id} 出现问题: {error}")
+            status = "error"
+        try:
+            gen.close()
+        except Exception as e:
+            logger.warning(f"关闭后台研究任务 {job.id} 的生成器时出现问题: {e}")
+        finally:
+            if job.cancelled:
+                logger.info(f"后台研究任务 {job.id} 已被取消")
+                status = "cancelled"
+            job.finish(status)
+            logger.info(f"后台研究任务 {job.id} 结束, 状态: {status}")
+            if on_finish:
+                on_finish()
+
+    def get(self, job_id: str) -> Optional[ResearchJob]:
+        self._cleanup()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _cleanup(self) -> None:
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished and now - job.finished_at > config.JOB_TTL]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+
+JOBS = JobManager()
@@ -0,0 +1,126 @@
+"""
+响应缓存: 消息、模型与搜索模式都相同的请求,在有效期内直接返回上次的结果。
+流式请求记录完整的 SSE 数据(思考过程与最终回复),命中时按原样回放;默认关闭。
+"""
+from collections import OrderedDict
+import hashlib
+import json
+from pathlib import Path
+import sys
+import time
+from threading import Lock
+from typing import Any, Generator, Optional
+
+# 将项目根目录添加到sys.path
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from app.utils.i18n import i18n
+from app.utils.tools import sse_create_openai_usage_data
+from config import base_config as config
+from config.logging_config import logger
+
+DONE_FRAME = "data: [DONE]\n\n"
+USAGE_FRAME_PREFIX = 'data: {"usage"'
+TRACE_FRAME_PREFIX = "event: trace"
+# 命中缓存时返回的 usage,本次请求没有消耗 token
+CACHED_USAGE = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached": True}
+
+
+def _normalize_content(content: Any) -> Any:
+    if isinstance(content, str):
+        return " ".join(content.split())
+    return content
+
+
+def cache_key(messages: list, model: str, search_mode: int, stream: bool) -> str:
+    """
+    根据客户端传入的消息计算缓存键。
+    system 消息会被替换为带当前时间的系统提示词,不参与计算;空白字符统一处理。
+    """
+    normalized = [
+        {"role": msg.get("role"), "content": _normalize_content(msg.get("content"))}
+        for msg in messages if msg.get("role") != "system"
+    ]
+    raw = json.dumps([normalized, model or "", search_mode, bool(stream)], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """带有效期的 LRU 缓存,值为非流式的回复消息或流式的 SSE 数据列表"""
+
+    def __init__(self):
+        self._items: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return config.RESPONSE_CACHE_TTL > 0
+
+    def get(self, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._items[key] = (time.time() + config.RESPONSE_CACHE_TTL, value)
+            self._items.move_to_end(key)
+            while len(self._items) > max(config.RESPONSE_CACHE_SIZE, 1):
+                self._items.popitem(last=False)
+
+    def put_message(self, key: str, assistant_message: dict) -> None:
+        """缓存非流式回复,请求失败的结果不缓存"""
+        if assistant_message.get("content") in (i18n('request_failed'), 'error', None):
+            return
+        self.put(key, assistant_message)
+
+    def record(self, key: str, gen: Generator[str, None, None]) -> Generator[str, None, None]:
+        """
+        包装流式生成器,原样转发数据的同时记录下来。
+        只有完整结束且没有出错的流才会写入缓存,客户端中途断开时不缓存。
+        """
+        if not self.enabled:
+            yield from gen
+            return
+        frames = []
+        complete = errored = False
+        failed = i18n('request_failed')
+        try:
+            for data in gen:
+                if data == DONE_FRAME:
+                    complete = True
+                elif data.startswith((USAGE_FRAME_PREFIX, TRACE_FRAME_PREFIX)):
+                    pass  # usage 与 trace 只对本次请求有意义,不缓存
+                elif not data.startswith("data: ") or failed in data:
+                    errored = True  # 非 SSE 格式的数据说明流程中出现了错误
+                else:
+                    frames.append(data)
+                yield data
+        finally:
+            gen.close()
+        if complete and not errored:
+            self.put(key, frames)
+            logger.info(f"响应已缓存, 共 {len(frames)} 条数据")
+
+    @staticmethod
+    def replay(frames: list) -> Generator[str, None, None]:
+        """回放缓存的 SSE 数据,usage 中标记为缓存命中"""
+        yield from frames
+        yield sse_create_openai_usage_data(CACHED_USAGE)
+        yield DONE_FRAME
+
+
+RESPONSE_CACHE = ResponseCache()
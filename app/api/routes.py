@@ -1,6 +1,7 @@
 from pathlib import Path
 import sys
 import time
+from typing import Optional
 from flask import redirect, request, jsonify, make_response, Response, stream_with_context
 
 # 将项目根目录添加到sys.path
@@ -8,79 +9,217 @@ ROOT_DIR = Path(__file__).resolve().parent.parent.parent
 if str(ROOT_DIR) not in sys.path:
     sys.path.append(str(ROOT_DIR))
 
-from app.api.sse_add_heartbeat import process_messages_stream_heartbeat
+from app.api.admission import AdmissionRejected, ReleaseOnClose, admit
+from app.api.jobs import JOBS, parse_last_event_id
+from app.api.response_cache import CACHED_USAGE, RESPONSE_CACHE, cache_key
+from app.api.sse_add_heartbeat import heartbeat_stream
+from app.utils.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, render_metrics
+from app.utils.warmup import is_ready, readiness
 from app.utils.prompt import SYS_PROMPT
+from app.utils.request_context import RequestContext
+from app.utils.tracing import TRACES
 from app.utils.tools import get_time
 from app.chat.functions import process_messages,process_messages_stream
 from config import base_config as config
+from config.logging_config import logger
 
 SHOW_MODEL = "search-llm"
 
+
+def is_authorized(auth: str) -> bool:
+    """校验请求头中的 API key"""
+    return auth == f"Bearer {config.API_KEY}"
+
+
+def get_search_mode(model: str) -> int:
+    """根据模型名称判断搜索模式: 1 普通搜索, 2 深度研究"""
+    if model and "deep-research" in model:
+        return 2
+    return 1
+
+
+def build_chat_messages(data: dict) -> list:
+    """去掉客户端传入的 system 消息,替换为本项目的系统提示词"""
+    messages = [msg for msg in data["messages"] if msg.get('role') != 'system']
+    return [{'role': 'system', 'content': SYS_PROMPT.substitute(current_time=get_time())}] + messages
+
+
+def build_completion_payload(assistant_message: dict, usage: Optional[dict] = None) -> dict:
+    """构造 OpenAI 格式的非流式返回内容,usage 为请求上下文统计的各阶段消耗"""
+    return {
+        "id": "chatcmpl-123",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": SHOW_MODEL,
+        "choices": [
+            {
+                "index": 0,
+                "message": assistant_message,
+                "finish_reason": "stop"
+            }
+        ],
+        "usage": usage or {
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0
+        }
+    }
+
+
+def build_rejected_payload(e: AdmissionRejected) -> dict:
+    return {"error": {"message": str(e), "type": "rate_limit_exceeded", "retry_after": e.retry_after}}
+
+
+def use_detached_job(search_mode: int, stream: bool) -> bool:
+    """深度研究的流式请求作为后台任务运行"""
+    return stream and search_mode == 2 and config.DETACHED_RESEARCH_JOBS
+
+
+def resolve_job_resume(last_event_id: str, job_id: str = ""):
+    """根据 Last-Event-ID (及可选的任务id) 找到要续传的任务和起始位置"""
+    event_job_id, seq = parse_last_event_id(last_event_id) if last_event_id else (job_id, 0)
+    if job_id and event_job_id != job_id:
+        seq = 0
+    return JOBS.get(job_id or event_job_id), seq
+
+
+def build_models_payload() -> dict:
+    return {
+        "data": [
+            {"id": f"{config.SUMMARY_MODEL}-search", "object": "model", "owned_by": "cat3399"},
+            {"id": f"{config.SUMMARY_MODEL}-deep-research", "object": "model", "owned_by": "cat3399"},
+        ]
+    }
+
+
 def register_routes(app):
     @app.route("/", methods=["GET"])
     def index():
         return redirect("/setting")
     @app.route("/v1/chat/completions", methods=["POST"])
     def chat_completions_api():
-        search_mode = 1
         # 校验 API key
         auth = request.headers.get("Authorization", "")
-        if auth != f"Bearer {config.API_KEY}":
+        if not is_authorized(auth):
             return make_response(jsonify({"error": f"Invalid API Key {auth}"}), 401)
-        
+
+        # 断线重连: 根据 Last-Event-ID 从后台任务的事件日志继续推送
+        last_event_id = request.headers.get("Last-Event-ID")
+        if last_event_id:
+            return _resume_job_stream(last_event_id)
+
         data = request.get_json()
-        if "deep-research" in data.get("model"):
-            search_mode = 2
         if not data or "messages" not in data:
             return make_response(jsonify({"error": "传入数据有问题!"}), 400)
-        
-        messages = [msg for msg in data["messages"] if msg.get('role') != 'system']
-        messages = [{'role': 'system', 'content': SYS_PROMPT.substitute(current_time=get_time())}] + messages
+        search_mode = get_search_mode(data.get("model"))
         # 检查 stream 参数
         STREAM_MODE = data.get("stream", False)
-        if STREAM_MODE:
-            rsp_stream = process_messages_stream_heartbeat(messages,search_mode=search_mode)
+
+        # 命中响应缓存时直接返回,不占用准入名额
+        key = cache_key(data["messages"], data.get("model"), search_mode, STREAM_MODE)
+        cached = RESPONSE_CACHE.get(key)
+        if cached is not None:
+            logger.info("命中响应缓存")
+            if STREAM_MODE:
+                return Response(stream_with_context(RESPONSE_CACHE.replay(cached)), mimetype='text/event-stream', headers={
+                    'Cache-Control': 'no-cache',
+                    'X-Cache': 'HIT'
+                })
+            rsp = jsonify(build_completion_payload(cached, CACHED_USAGE))
+            rsp.headers['X-Cache'] = 'HIT'
+            return rsp
+
+        messages = build_chat_messages(data)
+        try:
+            admission = admit(search_mode)
+        except AdmissionRejected as e:
+            rsp = make_response(jsonify(build_rejected_payload(e)), 429)
+            rsp.headers['Retry-After'] = str(e.retry_after)
+            return rsp
+        ctx = RequestContext()
+        if use_detached_job(search_mode, STREAM_MODE):
+            job = JOBS.start(RESPONSE_CACHE.record(key, process_messages_stream(messages, search_mode, ctx)), search_mode,
+                             on_finish=admission.release, ctx=ctx)
+            return Response(stream_with_context(job.iter_events()), mimetype='text/event-stream', headers={
+                'Cache-Control': 'no-cache',
+                'X-Job-Id': job.id,
+                'X-Request-Id': ctx.request_id
+            })
+        elif STREAM_MODE:
+            rsp_stream = ReleaseOnClose(
+                heartbeat_stream(RESPONSE_CACHE.record(key, process_messages_stream(messages, search_mode, ctx)), ctx),
+                admission)
             return Response(stream_with_context(rsp_stream), mimetype='text/event-stream', headers={
-                'Cache-Control': 'no-cache'
+                'Cache-Control': 'no-cache',
+                'X-Request-Id': ctx.request_id
             })
         else:
-            # 以第一个role为用户角色的消息为用户输入
-            # print(messages)
-            assistant_message = process_messages(messages)
-            # print("--------------------------------")
-            # print(assistant_message)
+            try:
+                # 以第一个role为用户角色的消息为用户输入
+                assistant_message = process_messages(messages, search_mode=search_mode, ctx=ctx)
+            finally:
+                admission.release()
+            RESPONSE_CACHE.put_message(key, assistant_message)
             # 构造 OpenAI 格式返回内容
-            response_payload = {
-                "id": "chatcmpl-123",
-                "object": "chat.completion",
-                "created": int(time.time()),
-                "model": SHOW_MODEL,
-                "choices": [
-                    {
-                        "index": 0,
-                        "message": assistant_message,
-                        "finish_reason": "stop"
-                    }
-                ],
-                "usage": {
-                    "prompt_tokens": 0,
-                    "completion_tokens": 0,
-                    "total_tokens": 0
-                }
-            }
-            return jsonify(response_payload)
+            rsp = jsonify(build_completion_payload(assistant_message, ctx.usage_dict()))
+            rsp.headers['X-Request-Id'] = ctx.request_id
+            return rsp
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics_api():
+        if not config.METRICS_ENABLED:
+            return make_response(jsonify({"error": "Not Found"}), 404)
+        return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+    @app.route("/ready", methods=["GET"])
+    def ready_api():
+        # 就绪探针,预热完成前返回 503,无需 API key
+        return make_response(jsonify(readiness()), 200 if is_ready() else 503)
 
     @app.route("/v1/models", methods=["GET"])
     def models_api():
         # 校验 API key
         auth = request.headers.get("Authorization", "")
-        if auth != f"Bearer {config.API_KEY}":
+        if not is_authorized(auth):
             return make_response(jsonify({"error": f"Invalid API Key {auth}"}), 401)
-        
-        models = {
-            "data": [
-                {"id": f"{config.SUMMARY_MODEL}-search", "object": "model", "owned_by": "cat3399"},
-                {"id": f"{config.SUMMARY_MODEL}-deep-research", "object": "model", "owned_by": "cat3399"},
-            ]
-        }
-        return jsonify(models)
\ No newline at end of file
+
+        return jsonify(build_models_payload())
+
+    def _resume_job_stream(last_event_id: str, job_id: str = ""):
+        job, seq = resolve_job_resume(last_event_id, job_id)
+        if job is None:
+            return make_response(jsonify({"error": "任务不存在或已过期"}), 404)
+        return Response(stream_with_context(job.iter_events(seq)), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Job-Id': job.id
+        })
+
+    @app.route("/v1/traces/<request_id>", methods=["GET"])
+    def trace_api(request_id):
+        auth = request.headers.get("Authorization", "")
+        if not is_authorized(auth):
+            return make_response(jsonify({"error": f"Invalid API Key {auth}"}), 401)
+        trace = TRACES.get(request_id)
+        if trace is None:
+            return make_response(jsonify({"error": "trace 不存在或已过期"}), 404)
+        return jsonify(trace.to_dict())
+
+    @app.route("/v1/jobs/<job_id>", methods=["GET", "DELETE"])
+    def job_api(job_id):
+        auth = request.headers.get("Authorization", "")
+        if not is_authorized(auth):
+            return make_response(jsonify({"error": f"Invalid API Key {auth}"}), 401)
+        job = JOBS.get(job_id)
+        if job is None:
+            return make_response(jsonify({"error": "任务不存在或已过期"}), 404)
+        if request.method == "DELETE":
+            job.cancel()
+        return jsonify(job.to_dict())
+
+    @app.route("/v1/jobs/<job_id>/events", methods=["GET"])
+    def job_events_api(job_id):
+        auth = request.headers.get("Authorization", "")
+        if not is_authorized(auth):
+            return make_response(jsonify({"error": f"Invalid API Key {auth}"}), 401)
+        last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id", "")
+        return _resume_job_stream(last_event_id, job_id=job_id)
@@ -1,62 +1,295 @@
+import asyncio
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 import sys
-from typing import Generator
-from threading import Event, Thread
-from queue import Empty, Queue
+import time
+from typing import AsyncGenerator, Callable, Generator, Optional
+from threading import Condition, Lock
 
 # 将项目根目录添加到sys.path
 ROOT_DIR = Path(__file__).resolve().parent.parent.parent
 if str(ROOT_DIR) not in sys.path:
     sys.path.append(str(ROOT_DIR))
 
+from app.api.admission import admitted_concurrency
 from app.chat.functions import process_messages_stream
+from app.utils.metrics import Gauge
+from app.utils.request_context import RequestContext
 from config.logging_config import logger
 from config import base_config as config
 
-def add_work(gen: Generator, q: Queue, stop_event: Event):
+HEARTBEAT_FRAME = ":heartbeat\n\n"
+END_OF_STREAM = object()
+
+
+class ScheduledStream:
     """
-    一个可以被外部事件停止的工作函数。
+    由共享调度器驱动的一条流。
+    生产者每次只在共享线程池中执行一步(next),结果放入有界缓冲区;
+    缓冲区满时暂停调度,直到读者取走数据,慢速读者不会让内存无限增长,也不占用线程。
     """
-    try:
-        for data in gen:
-            # 在每次循环前检查是否需要停止
-            if stop_event.is_set():
-                logger.info("检测到停止信号，后台工作线程退出。")
-                break
-            logger.debug(data)
-            q.put(data)
-    except Exception as e:
-        logger.error(f"后台工作线程出现问题: {e}")
-    finally:
-        # 确保队列的消费者（主线程）知道数据已结束
-        q.put("no data")
+
+    def __init__(self, gen: Generator, scheduler: "StreamScheduler", buffer_size: int):
+        self._gen = gen
+        self._scheduler = scheduler
+        self._buffer = deque()
+        self._buffer_size = max(buffer_size, 1)
+        self._cond = Condition()
+        self._async_waiters: set = set()
+        self._running = False  # 是否有生产步骤已提交或正在执行
+        self._finished = False
+        self._closed = False
+
+    def _schedule_step(self) -> None:
+        """在持有锁时调用: 条件允许则提交下一步"""
+        if self._running or self._finished or self._closed or len(self._buffer) >= self._buffer_size:
+            return
+        self._running = True
+        self._scheduler.submit(self._step)
+
+    def _step(self) -> None:
+        failed = False
+        try:
+            data = next(self._gen, END_OF_STREAM)
+        except Exception as e:
+            logger.error(f"后台生产步骤出现问题: {e}")
+            data, failed = END_OF_STREAM, True
+        except BaseException as e:
+            # 如请求被取消(RequestCancelled): 同样结束这条流,否则读者会一直等待
+            logger.info(f"后台生产步骤已停止: {e!r}")
+            data, failed = END_OF_STREAM, True
+        with self._cond:
+            self._running = False
+            if data is END_OF_STREAM:
+                self._finished = True
+            elif not self._closed:
+                logger.debug(data)
+                self._buffer.append(data)
+            close_now = self._closed or failed
+            self._schedule_step()
+            self._cond.notify_all()
+        self._wake_async_waiters()
+        if close_now:
+            self._close_gen()
+
+    def _take(self):
+        """在持有锁时调用: 取出一条数据,没有数据返回 None"""
+        if self._buffer:
+            data = self._buffer.popleft()
+            self._schedule_step()
+            return data
+        if self._finished:
+            return END_OF_STREAM
+        return None
+
+    def get(self, timeout: float):
+        """取下一条数据;超时返回 None,流结束返回 END_OF_STREAM"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                data = self._take()
+                if data is not None:
+                    return data
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(timeout=remaining)
+
+    async def aget(self, timeout: float):
+        """get 的异步版本,等待期间不占用线程"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            waiter = asyncio.Event()
+            with self._cond:
+                data = self._take()
+                if data is not None:
+                    return data
+                self._async_waiters.add((loop, waiter))
+            remaining = deadline - loop.time()
+            try:
+                if remaining <= 0:
+                    return None
+                await asyncio.wait_for(waiter.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                with self._cond:
+                    self._async_waiters.discard((loop, waiter))
+
+    def _wake_async_waiters(self) -> None:
+        with self._cond:
+            waiters = list(self._async_waiters)
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(waiter.set)
+
+    def close(self) -> None:
+        """读者退出时调用;若生产步骤仍在执行,由该步骤结束后关闭生成器"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._buffer.clear()
+            close_now = not self._running
+        if close_now:
+            self._close_gen()
+
+    def _close_gen(self) -> None:
+        try:
+            self._gen.close()
+        except Exception as e:
+            logger.warning(f"关闭后台生成器时出现问题: {e}")
+
+
+class StreamScheduler:
+    """
+    所有流共享的调度器: 线程池负责执行各条流的生产步骤。
+    每个被准入的请求执行步骤时都要占用一个线程,因此线程数不少于两种模式的并发上限之和,
+    否则在设置页调高上限后,已准入的请求会在线程池中无声排队;上限变化后线程池随之重建。
+    """
+
+    def __init__(self):
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._size = 0
+        self._lock = Lock()
+        self._submitted = 0
+        self._started = 0
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            return self._current_executor()
+
+    def _current_executor(self) -> ThreadPoolExecutor:
+        """在持有锁时调用: 按当前配置返回线程池,大小变化时重建"""
+        size = max(config.STREAM_WORKER_NUM, admitted_concurrency(), 1)
+        if self._executor is None or self._size != size:
+            if self._executor is not None:
+                logger.info(f"流式响应线程池大小调整为 {size}")
+                # 已提交的步骤仍在旧线程池中执行完毕,之后旧线程退出
+                self._executor.shutdown(wait=False)
+            self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="stream-worker")
+            self._size = size
+        return self._executor
+
+    def submit(self, fn, *args) -> Future:
+        """提交一个步骤,统计已提交与已开始的任务数"""
+        started = False
+
+        def mark_started(*_):
+            # 任务被取消时不会执行 run,在完成回调中补上
+            nonlocal started
+            with self._lock:
+                if not started:
+                    started = True
+                    self._started += 1
+
+        def run():
+            mark_started()
+            return fn(*args)
+
+        with self._lock:
+            # 在锁内提交,线程池重建时不会提交到已关闭的旧线程池
+            future = self._current_executor().submit(run)
+            self._submitted += 1
+        future.add_done_callback(mark_started)
+        return future
+
+    def queue_depth(self) -> int:
+        """线程池中已提交但尚未开始执行的任务数"""
+        with self._lock:
+            return self._submitted - self._started
+
+    def drive(self, gen: Generator, on_item: Callable[[str], bool],
+              on_end: Callable[[Optional[BaseException]], None]) -> None:
+        """
+        逐步运行没有读者的生成器(如后台研究任务): 每一步在线程池中执行一次 next 并把结果交给 on_item,
+        步骤之间不占用线程,与各条流公平地共用线程池。on_item 返回 False 时停止;
+        生成器结束、停止或出错时调用一次 on_end,参数为出错时的异常。
+        """
+        def step():
+            try:
+                data = next(gen, END_OF_STREAM)
+                if data is not END_OF_STREAM and on_item(data) is not False:
+                    self.submit(step)
+                    return
+                error = None
+            except BaseException as e:
+                error = e
+            on_end(error)
+
+        self.submit(step)
+
+    def open(self, gen: Generator) -> ScheduledStream:
+        stream = ScheduledStream(gen, self, config.STREAM_BUFFER_SIZE)
+        with stream._cond:
+            stream._schedule_step()
+        return stream
+
+
+STREAM_SCHEDULER = StreamScheduler()
+
+Gauge("executor_queue_depth", "共享线程池中等待执行的任务数", ("executor",),
+      callback=lambda: {("stream",): STREAM_SCHEDULER.queue_depth()})
+
 
 def process_messages_stream_heartbeat(messages, search_mode):
-    data_queue = Queue()
-    stop_event = Event()  # <-- 1. 创建事件对象，作为线程间的通信信号
-    gen = process_messages_stream(messages, search_mode)
-    
-    # <-- 2. 将事件对象传递给后台线程
-    t = Thread(target=add_work, args=(gen, data_queue, stop_event))
-    t.start()
-    
+    ctx = RequestContext()
+    return heartbeat_stream(process_messages_stream(messages, search_mode, ctx), ctx)
+
+
+def heartbeat_stream(gen: Generator, ctx: Optional[RequestContext] = None):
+    """
+    在共享调度器上运行生成器,等待超时则发送心跳。
+    读者在流结束前退出(客户端断开)时取消 ctx,停止进行中的搜索、抓取与总结。
+    """
+    stream = STREAM_SCHEDULER.open(gen)
+    finished = False
     try:
         while True:
-            try:
-                data = data_queue.get(timeout=config.HEARTBEAT_TIMEOUT)
-                if data == "no data":
-                    break  # 正常结束
-                
-                yield data
-            except Empty:
+            data = stream.get(timeout=config.HEARTBEAT_TIMEOUT)
+            if data is None:
                 # 超时，发送心跳以保持连接
-                yield ":heartbeat\n\n"
+                yield HEARTBEAT_FRAME
+                continue
+            if data is END_OF_STREAM:
+                finished = True
+                break  # 正常结束
+            yield data
     finally:
         # 无论是因为正常结束、出错还是客户端断开连接，finally 块都会被执行
-        logger.info("主生成器即将退出，正在通知后台线程停止...")
-        stop_event.set()  # 设置停止信号
-        
-        # 等待后台线程执行完毕，可以设置一个超时以防万一
-        t.join(timeout=5) 
-        if t.is_alive():
-            logger.warning("后台线程在5秒内未能正常停止。")
+        logger.info("主生成器即将退出，正在通知后台停止...")
+        if ctx is not None and not finished:
+            ctx.cancel()
+        stream.close()
+
+
+def process_messages_stream_heartbeat_async(messages, search_mode) -> AsyncGenerator[str, None]:
+    ctx = RequestContext()
+    return heartbeat_stream_async(process_messages_stream(messages, search_mode, ctx), ctx)
+
+
+async def heartbeat_stream_async(gen: Generator, ctx: Optional[RequestContext] = None) -> AsyncGenerator[str, None]:
+    """
+    heartbeat_stream 的异步版本。
+    在事件循环上等待下一条数据,超时则发送心跳,不再为每个连接单独创建线程和队列。
+    """
+    stream = STREAM_SCHEDULER.open(gen)
+    finished = False
+    try:
+        while True:
+            data = await stream.aget(timeout=config.HEARTBEAT_TIMEOUT)
+            if data is None:
+                # 超时，发送心跳以保持连接
+                yield HEARTBEAT_FRAME
+                continue
+            if data is END_OF_STREAM:
+                finished = True
+                break  # 正常结束
+            yield data
+    finally:
+        logger.info("异步流即将退出，正在通知后台停止...")
+        if ctx is not None and not finished:
+            ctx.cancel()
+        stream.close()
@@ -1,29 +1,25 @@
 import json
 import random
-from openai import OpenAI
 import time
 from pathlib import Path
 import sys
 
-import requests
-
 # 将项目根目录添加到sys.path
 ROOT_DIR = Path(__file__).resolve().parent.parent.parent
 if str(ROOT_DIR) not in sys.path:
     sys.path.append(str(ROOT_DIR))
 
 from app.utils.tools import sse_create_openai_data, sse_gemini2openai_data
+from app.utils.http_client import get_session
 from app.utils.i18n import i18n
+from app.utils.key_pool import use_key
+from app.utils.llm_client import get_openai_client
+from app.utils.request_context import is_cancelled, raise_if_cancelled, record_usage, timeout_for
+from app.utils.metrics import RETRIES, SUMMARY_LATENCY, SUMMARY_TTFT
+from app.utils.resilience import BackendUnavailable, backoff, guarded
 from config import base_config as config
 from config.logging_config import logger
 
-
-if config.SUMMARY_API_TYPE != "GEMINI":
-    client = OpenAI(
-        api_key = config.SUMMARY_API_KEY,
-        base_url = config.SUMMARY_API_URL,
-    )
-
 MAX_RETRIES = 3
 def openai_stream_no(messages:list[dict], model:str = config.SUMMARY_MODEL):
     retry_count = 0
@@ -31,16 +27,21 @@ def openai_stream_no(messages:list[dict], model:str = config.SUMMARY_MODEL):
         try:
             start_time = time.time()
             # print(messages)
-            completion = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                # temperature=0.1
-            )
+            with guarded(model), use_key("summary", config.SUMMARY_API_KEYS) as lease:
+                client = get_openai_client(config.SUMMARY_API_URL, lease.key)
+                completion = client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    timeout=timeout_for(120),
+                    # temperature=0.1
+                )
             response_data = completion.choices[0].message.content
             # print(completion)
             processing_time = time.time() - start_time
+            record_usage("summary", completion.usage, processing_time)
+            SUMMARY_LATENCY.observe(processing_time, backend="openai", model=model)
             # print(completion)
-            reason_content = completion.choices[0].message.reasoning_content
+            reason_content = getattr(completion.choices[0].message, 'reasoning_content', None)
             messages.append({"role": "assistant", "content": response_data})
             logger.info(f"token消耗: {completion.usage.total_tokens}")
             logger.info(f"{model}处理耗时: {processing_time:.2f}秒")
@@ -49,6 +50,9 @@ def openai_stream_no(messages:list[dict], model:str = config.SUMMARY_MODEL):
             )
             return response_data,reason_content
 
+        except BackendUnavailable as e:
+            logger.error(f"{model}请求失败: {str(e)}")
+            return i18n('request_failed')
         except Exception as e:
             retry_count += 1
             if retry_count >= MAX_RETRIES:
@@ -56,42 +60,68 @@ def openai_stream_no(messages:list[dict], model:str = config.SUMMARY_MODEL):
                 logger.error(f"{model}请求失败: {str(e)}")
                 return i18n('request_failed')
             else:
+                RETRIES.inc(stage="summary", backend="openai", model=model)
                 logger.warning(f"{model}请求失败: {str(e)} 正在重试{retry_count}")
+                backoff(retry_count - 1)
 
 def openai_stream_yes(messages: list[dict], model: str = config.SUMMARY_MODEL):
     retry_count = 0
     while retry_count < MAX_RETRIES:
         try:
-            completion = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                stream=True,
-                # temperature=0.1,
-                stream_options={"include_usage": True}
-            )
-            for chunk in completion:
-                try:
-                    chunk_reasoning_content = chunk.choices[0].delta.reasoning_content
-                    # print(chunk_reasoning_content)
-                    if chunk_reasoning_content is not None:
-                        yield sse_create_openai_data(reasoning_content=chunk_reasoning_content)
-                except:
-                    pass
-                try:
-                    chunk_content = chunk.choices[0].delta.content
-                    # print(chunk_content)
-                    if chunk_content is not None:
-                        yield sse_create_openai_data(content=chunk_content)
-                except:
-                    pass
+            start_time = time.time()
+            with guarded(model), use_key("summary", config.SUMMARY_API_KEYS) as lease:
+                client = get_openai_client(config.SUMMARY_API_URL, lease.key)
+                completion = client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    # temperature=0.1,
+                    stream_options={"include_usage": True},
+                    # 流式响应中为两个块之间的最长等待,不超过剩余时间预算
+                    timeout=timeout_for(120),
+                )
+                # 在 with 块内读完整个流: 读取中途出错同样计入熔断器,读完后才归还密钥
+                usage = None
+                first_token = True
+                for chunk in completion:
+                    if is_cancelled():
+                        completion.close()
+                        raise_if_cancelled()
+                    if getattr(chunk, "usage", None):
+                        usage = chunk.usage
+                    if first_token and chunk.choices:
+                        delta = chunk.choices[0].delta
+                        if getattr(delta, "content", None) or getattr(delta, "reasoning_content", None):
+                            first_token = False
+                            SUMMARY_TTFT.observe(time.time() - start_time, backend="openai", model=model)
+                    try:
+                        chunk_reasoning_content = chunk.choices[0].delta.reasoning_content
+                        # print(chunk_reasoning_content)
+                        if chunk_reasoning_content is not None:
+                            yield sse_create_openai_data(reasoning_content=chunk_reasoning_content)
+                    except:
+                        pass
+                    try:
+                        chunk_content = chunk.choices[0].delta.content
+                        # print(chunk_content)
+                        if chunk_content is not None:
+                            yield sse_create_openai_data(content=chunk_content)
+                    except:
+                        pass
             yield sse_create_openai_data(content="")
+            record_usage("summary", usage, time.time() - start_time)
+            SUMMARY_LATENCY.observe(time.time() - start_time, backend="openai", model=model)
             try:
-                logger.info("总结模型花费token: %s", chunk.usage.total_tokens)
+                logger.info("总结模型花费token: %s", usage.total_tokens)
             except Exception:
                 pass
             
             return 
 
+        except BackendUnavailable as e:
+            logger.error(f"{model}请求失败: {str(e)}")
+            yield i18n('request_failed')
+            return
         except Exception as e:
             retry_count += 1
             if retry_count >= MAX_RETRIES:
@@ -99,17 +129,19 @@ def openai_stream_yes(messages: list[dict], model: str = config.SUMMARY_MODEL):
                 yield i18n('request_failed')
                 return
             else:
+                RETRIES.inc(stage="summary", backend="openai", model=model)
                 logger.warning(f"{model}请求失败: {str(e)} 正在重试{retry_count}")
+                backoff(retry_count - 1)
 
 def gemini_stream_no(messages: list[str],model:str = config.SUMMARY_MODEL) -> str:
     retry_count = 0
+    res = res_data = None
     while retry_count < MAX_RETRIES:
         try:
             start_time = time.time()
-            api_key = config.SUMMARY_API_KEY
             # print(messages)
             # Gemini API URL
-            api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
+            api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
 
             messages_tmp = [{**msg,'role':'model'} if msg['role'] == "assistant" else msg for msg in messages]
             for msg in messages_tmp:
@@ -133,8 +165,12 @@ def gemini_stream_no(messages: list[str],model:str = config.SUMMARY_MODEL) -> st
                 }
             }  
             # print(json.dumps(payload))
-            res = requests.post(url=api_url,headers=headers,data=json.dumps(payload))
+            with guarded(model), use_key("summary", config.SUMMARY_API_KEYS) as lease:
+                res = lease.check(get_session().post(url=f"{api_url}?key={lease.key}",headers=headers,data=json.dumps(payload),
+                                                     timeout=timeout_for(120)))
             res_data = res.json()
+            record_usage("summary", res_data.get('usageMetadata'), time.time() - start_time)
+            SUMMARY_LATENCY.observe(time.time() - start_time, backend="gemini", model=model)
             try:
                 cost_chat_token = res_data['usageMetadata']['candidatesTokenCount']
                 cost_totle_token = res_data['usageMetadata']['totalTokenCount']
@@ -145,6 +181,9 @@ def gemini_stream_no(messages: list[str],model:str = config.SUMMARY_MODEL) -> st
                 logger.debug(res_data['usageMetadata'])
                 logger.error(f"获取token输出速度失败 {e}")
             return res_data['candidates'][0]['content']['parts'][0]['text']
+        except BackendUnavailable as e:
+            logger.error(f"gemini回复出现问题!!! {e}")
+            return 'error'
         except Exception as e:
             retry_count += 1
             logger.debug(res_data)
@@ -153,16 +192,16 @@ def gemini_stream_no(messages: list[str],model:str = config.SUMMARY_MODEL) -> st
                 logger.error(f"gemini回复出现问题!!! {e}\n 正在重试{retry_count}")
                 return 'error'
             else:
+                RETRIES.inc(stage="summary", backend="gemini", model=model)
                 logger.warning(f"gemini回复出现问题!!! {e}\n 正在重试{retry_count}")
+                backoff(retry_count - 1)
 
 def gemini_stream_yes(messages: list[str],model:str = config.SUMMARY_MODEL):
-    retry_count = 0
+    res = None
     try:
-        api_key = config.SUMMARY_API_KEY
-
         # print(messages)
         # Gemini API URL
-        api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent?alt=sse&key={api_key}"
+        api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent?alt=sse"
 
         messages_tmp = [{**msg,'role':'model'} if msg['role'] == "assistant" else msg for msg in messages]
         for msg in messages_tmp:
@@ -186,44 +225,66 @@ def gemini_stream_yes(messages: list[str],model:str = config.SUMMARY_MODEL):
             }
         }  
         # print(json.dumps(payload))
-        res = requests.post(url=api_url,headers=headers,data=json.dumps(payload),stream=True)
-        return res
+        start_time = time.time()
+        usage_metadata = None
+        first_token = True
+        with guarded(model), use_key("summary", config.SUMMARY_API_KEYS) as lease:
+            res = lease.check(get_session().post(url=f"{api_url}&key={lease.key}",headers=headers,data=json.dumps(payload),
+                                                 stream=True, timeout=timeout_for(120)))
+            # 在 with 块内读完整个流: 读取中途出错同样计入熔断器,读完后才归还密钥
+            with res:
+                res.raise_for_status()
+                for line in res.iter_lines():
+                    raise_if_cancelled()
+                    if line:
+                        if first_token:
+                            first_token = False
+                            SUMMARY_TTFT.observe(time.time() - start_time, backend="gemini", model=model)
+                        if line.startswith(b"data: ") and b"usageMetadata" in line:
+                            try:
+                                usage_metadata = json.loads(line[6:]).get("usageMetadata") or usage_metadata
+                            except ValueError:
+                                pass
+                        yield sse_gemini2openai_data(line)
+        record_usage("summary", usage_metadata, time.time() - start_time)
+        SUMMARY_LATENCY.observe(time.time() - start_time, backend="gemini", model=model)
 
     except Exception as e:
-        retry_count += 1
         logger.debug(res)
-        if retry_count >= MAX_RETRIES:
-            logger.error(f"gemini回复出现问题!!! {e}\n 正在重试{retry_count}")
-            return sse_create_openai_data(content=f'Gemini出现问题{e}')
-        else:
-            logger.warning(f"gemini回复出现问题!!! {e}\n 正在重试{retry_count}")
+        logger.error(f"gemini回复出现问题!!! {e}")
+        yield sse_create_openai_data(content=f'Gemini出现问题{e}')
 
 def summary(messages:list[dict], model:str = config.SUMMARY_MODEL, stream:bool =False):
     """
-    与deepseek API 进行文字对话 (非流式)。
+    调用总结模型生成最终回复。
 
     Args:
         model: 要使用的模型名称 (例如 "qwen-max-lastest")
         messages: 一个消息列表,每个消息是一个字典,包含 "role" (user 或 assistant) 和 "content"
         stream: 是否使用流式传输
     Returns:
-        模型回复的文本内容
+        stream 为 True 时返回 OpenAI 格式 SSE 数据的生成器;
+        否则返回 (回复内容, 思考内容) 元组
     """
-    
+    if stream:
+        return _summary_stream(messages, model)
+
+    raise_if_cancelled()
+    if config.SUMMARY_API_TYPE == "GEMINI":
+        return gemini_stream_no(messages, model), ""
+    result = openai_stream_no(messages, model)
+    if isinstance(result, tuple):
+        content, reason_content = result
+        return content, reason_content or ""
+    return result, ""
+
+
+def _summary_stream(messages:list[dict], model:str):
+    raise_if_cancelled()
     if config.SUMMARY_API_TYPE == "GEMINI":
-        if stream:
-            rsp_stream = gemini_stream_yes(messages,model)
-            for line in rsp_stream.iter_lines():
-                if line:
-                    # print(line)
-                    yield sse_gemini2openai_data(line)
-        else:
-            return gemini_stream_no(messages,model)
+        yield from gemini_stream_yes(messages,model)
     else:
-        if stream:
-            yield from openai_stream_yes(messages,model)
-        else:
-            return openai_stream_no(messages,model)
+        yield from openai_stream_yes(messages,model)
 
 # 使用示例
 if __name__ == "__main__":
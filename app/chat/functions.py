@@ -1,10 +1,8 @@
 import json
 from pathlib import Path
 import sys
-import time
 import ast
-from typing import Dict, Any, Callable
-from openai import OpenAI
+from typing import Dict, Any, Callable, Optional
 from concurrent.futures import ThreadPoolExecutor
 
 # 将项目根目录添加到sys.path
@@ -12,7 +10,7 @@ ROOT_DIR = Path(__file__).resolve().parent.parent.parent
 if str(ROOT_DIR) not in sys.path:
     sys.path.append(str(ROOT_DIR))
 
-from app.utils.tools import sse_create_openai_data, get_time
+from app.utils.tools import sse_create_openai_data, sse_create_openai_usage_data, sse_create_trace_data, get_time
 from app.utils.i18n import i18n
 from app.utils.url2txt import url_to_markdown
 from config import base_config as config
@@ -21,12 +19,10 @@ from app.utils.prompt import DATA_ADD_PROMPT
 from app.search.fc_search import search_tool
 from app.search.fc_deepresearch import deepresearch_tool
 from app.chat.chat_summary import summary
-
-# 创建客户端
-CLIENT = OpenAI(
-    api_key=config.BASE_CHAT_API_KEY,
-    base_url=config.BASE_CHAT_API_URL
-)
+from app.utils.key_pool import use_key
+from app.utils.llm_client import get_openai_client
+from app.utils.request_context import (RequestCancelled, RequestContext, cancel_pending_futures,
+                                       raise_if_cancelled, record_usage, span, timeout_for)
 
 class FunctionRegistry:
     def __init__(self):
@@ -81,7 +77,7 @@ registry = FunctionRegistry()
 # }})
 def get_url_content(urls: list[str]) -> str:
     content_dict = {}
-    with ThreadPoolExecutor(max_workers=4) as executor:
+    with ThreadPoolExecutor(max_workers=4) as executor, cancel_pending_futures(executor):
         future_results = executor.map(url_to_markdown,urls)
         content_dict = dict(zip(urls,future_results))
 
@@ -90,27 +86,30 @@ def get_url_content(urls: list[str]) -> str:
     #     return '获取网页内容失败'
     return str(content_dict)
 
-def chat_completion(messages: list, chat_model=config.BASE_CHAT_MODEL, client=CLIENT, use_tools=False, stream :bool = False) -> Any:
-    start_time = time.time()
-    
+def chat_completion(messages: list, chat_model=None, client=None, use_tools=False, stream :bool = False) -> Any:
+    # 默认值在调用时读取,配置重新加载后立即生效
+    chat_model = chat_model or config.BASE_CHAT_MODEL
     # 记录请求数据
     request_data = {
         "model": chat_model,
         "messages": messages,
         "temperature": 0.1,
         "stream": stream,
-        # 'stream_options':
-        #     {"include_usage": True}
+        "timeout": timeout_for(120),
     }
+    if stream:
+        # 流式响应只有要求时才在最后一个块中返回 usage
+        request_data["stream_options"] = {"include_usage": True}
     if use_tools:
         request_data["tools"] = registry.tools
-        response = client.chat.completions.create(**request_data)
-    else:
-        response = client.chat.completions.create(**request_data)
+    with span("chat_completion", model=chat_model, stream=stream) as call_span, \
+            use_key("chat", config.BASE_CHAT_API_KEYS) as lease:
+        response = (client or get_openai_client(config.BASE_CHAT_API_URL, lease.key)).chat.completions.create(**request_data)
     
     if not stream:
         # 打印响应信息
-        processing_time = time.time() - start_time
+        processing_time = call_span.duration
+        record_usage("chat", response.usage, processing_time)
         logger.info(f"token消耗: {response.usage.total_tokens}")
         logger.info(f"处理时间: {processing_time} s")
         logger.info(
@@ -120,110 +119,158 @@ def chat_completion(messages: list, chat_model=config.BASE_CHAT_MODEL, client=CL
     else:
         return response
 
-def process_messages_stream(messages: list, search_mode: int = 1):
-    assistant_rsp = chat_completion(messages, use_tools=True, stream=True)
-    content_result = ' '
-    tool_calls = None
-    for chunk in assistant_rsp:
-        try:
-            delta = chunk.choices[0].delta
-        except Exception:
-            logger.warning(f"delta读取失败 {chunk} ")
-            delta = None
+def tool_messages(function_name: str, messages: list) -> list:
+    """搜索工具与总结模型不需要本项目的系统提示词"""
+    if function_name == 'search_tool' and messages and messages[0]['role'] == 'system':
+        return messages[1:]
+    return messages
+
+
+def run_tool_call(function_name: str, function_args: str, messages: list, search_mode: int = 1):
+    """
+    执行模型选择的工具,逐条产出进度文本(非SSE格式),
+    工具结果直接追加到 messages 最后一条消息中,供总结模型使用。
+    """
+    if function_name == 'search_tool':
+        if search_mode == 2:
+            function_output = deepresearch_tool(str(messages))
+        else:
+            function_output = search_tool(str(messages))
+        for line in function_output:
+            if line.startswith("results"):
+                search_result = str(line[7:])
+                messages[-1]['content'] = messages[-1]['content'] + DATA_ADD_PROMPT.substitute(current_time=get_time(),search_result=search_result)
+            elif line:
+                yield line
+
+    if function_name == 'get_url_content':
+        json_args = json.loads(function_args)
+        for url in json_args['urls']:
+            yield i18n('fetching_url', url=url)
+        function_output = registry.call(function_name, function_args)
+        messages[-1]['content'] = messages[-1]['content'] + f"现在的时间是{get_time()} 这是网页的内容 \n {function_output[:40000:]}"
+
+
+def run_tool_calls(tool_calls, messages: list, search_mode: int = 1, frame: Callable[[str], Any] = str):
+    """
+    依次执行模型选择的全部工具调用,流式与非流式处理共用,每次调用前检查请求是否已取消。
+    进度文本经 frame 转换后逐条产出(流式时转为 SSE 数据);
+    返回追加了工具结果、供总结模型使用的 messages,全部工具执行完后只总结一次。
+    """
+    for tool_call in tool_calls:
+        raise_if_cancelled()
+        function_name = tool_call.function.name
+        if function_name not in ('search_tool', 'get_url_content'):
             continue
-        try:
-            if delta.reasoning_content is not None:
-                yield sse_create_openai_data(reasoning_content=delta.reasoning_content)
-        except Exception:
-            pass
+        messages = tool_messages(function_name, messages)
+        with span("tool_call", tool=function_name):
+            for line in run_tool_call(function_name, tool_call.function.arguments, messages, search_mode):
+                yield frame(line)
+    raise_if_cancelled()
+    return messages
 
-        try:
-            if delta.content and delta.tool_calls is None:
-                content_result += delta.content
-                yield sse_create_openai_data(reasoning_content=delta.content)
-        except Exception:
-            pass 
 
-        try:
-            if tool_calls is None:
-                tool_calls = delta.tool_calls
-            else:
-                tool_calls[0].function.arguments += delta.tool_calls[0].function.arguments
-        except Exception:
-            pass
+def process_messages_stream(messages: list, search_mode: int = 1, ctx: Optional[RequestContext] = None):
+    """
+    流式处理,结束前发送一条包含各阶段消耗的 usage 数据。
+    调用方可在客户端断开时调用 ctx.cancel() 中止整个流程。
+    """
+    ctx = ctx or RequestContext()
+    try:
+        with ctx.root_span():
+            yield from ctx.bind(_process_messages_stream(messages, search_mode))
+    except RequestCancelled:
+        logger.info("请求已取消,流式处理结束")
+        return
+    yield sse_create_openai_usage_data(ctx.usage_dict())
+    if config.TRACE_SSE:
+        yield sse_create_trace_data(ctx.trace.to_dict())
+    yield "data: [DONE]\n\n"
 
-    yield sse_create_openai_data(reasoning_content="\n\n")
-    if tool_calls:
-        for tool_call in tool_calls:
-            function_name = tool_call.function.name
-            function_args = tool_call.function.arguments
-            if function_name == 'search_tool':
-                if messages[0]['role'] == 'system':
-                    messages = messages[1:]
-                search_result = ""
-                if search_mode == 2:
-                    function_output = deepresearch_tool(str(messages))
+
+def _process_messages_stream(messages: list, search_mode: int = 1):
+    with span("tool_decision") as decision_span:
+        assistant_rsp = chat_completion(messages, use_tools=True, stream=True)
+        content_result = ' '
+        tool_calls = None
+        usage = None
+        for chunk in assistant_rsp:
+            if getattr(chunk, 'usage', None):
+                usage = chunk.usage
+            if not chunk.choices:
+                # 只包含 usage 的最后一个块
+                continue
+            try:
+                delta = chunk.choices[0].delta
+            except Exception:
+                logger.warning(f"delta读取失败 {chunk} ")
+                delta = None
+                continue
+            try:
+                if delta.reasoning_content is not None:
+                    yield sse_create_openai_data(reasoning_content=delta.reasoning_content)
+            except Exception:
+                pass
+
+            try:
+                if delta.content and delta.tool_calls is None:
+                    content_result += delta.content
+                    yield sse_create_openai_data(reasoning_content=delta.content)
+            except Exception:
+                pass 
+
+            try:
+                if tool_calls is None:
+                    tool_calls = delta.tool_calls
                 else:
-                    function_output = search_tool(str(messages))
-                for line in function_output:
-                    if line.startswith("results"):
-                        search_result = str(line[7:])
-                        messages[-1]['content'] = messages[-1]['content'] + DATA_ADD_PROMPT.substitute(current_time=get_time(),search_result=search_result)
-                    elif line:
-                        yield sse_create_openai_data(reasoning_content=line)
-                rsp_stream = summary(messages, stream=True)
-                for line in rsp_stream:
-                    yield line
-                # yield sse_create_openai_data(content=search_result)
-
-            if function_name == 'get_url_content':
-                json_args = json.loads(function_args)
-                for url in json_args['urls']:
-                    yield sse_create_openai_data(reasoning_content=i18n('fetching_url', url=url))
-                function_output = registry.call(function_name, function_args)
-                messages[-1]['content'] = messages[-1]['content'] + f"现在的时间是{get_time()} 这是网页的内容 \n {function_output[:40000:]}"
-
-                # rsp_stream = summary(messages,stream=True)
-                # for line in rsp_stream:
-                #     yield line
-                #     yield sse_create_openai_data('')
-                yield from summary(messages,stream=True)
+                    tool_calls[0].function.arguments += delta.tool_calls[0].function.arguments
+            except Exception:
+                pass
 
+    record_usage("chat", usage, decision_span.duration)
+
+    yield sse_create_openai_data(reasoning_content="\n\n")
+    if tool_calls:
+        messages = yield from run_tool_calls(tool_calls, messages, search_mode,
+                                             frame=lambda line: sse_create_openai_data(reasoning_content=line))
+        with span("summary", model=config.SUMMARY_MODEL, stream=True):
+            yield from summary(messages, stream=True)
 
     else:
-        # assistant_message = {'role': 'assistant', 'content': assistant_rsp.content}
-        # messages.append(assistant_message)
         yield sse_create_openai_data(content=content_result)
-    yield "data: [DONE]\n\n"
 
-def process_messages(messages: list, stream: bool = False, search_mode: int = 1):
+def process_messages(messages: list, search_mode: int = 1, ctx: Optional[RequestContext] = None) -> dict:
+    """
+    非流式处理: 与 process_messages_stream 使用相同的工具调用、搜索与深度研究流程,
+    进度信息与总结结果在服务端汇总后一次性返回,不构造SSE数据。
+    各阶段消耗记录在 ctx 中。
+    """
+    ctx = ctx or RequestContext()
+    with ctx.activate(), ctx.root_span():
+        return _process_messages(messages, search_mode)
+
+
+def _process_messages(messages: list, search_mode: int = 1) -> dict:
     logger.info("非流模式")
-    assistant_reply = chat_completion(messages, use_tools=False)
-    # 未完善,非流暂时只支持简单对话,用于测试
-    # tool_calls = getattr(assistant_reply, 'tool_calls', None)
-    # if tool_calls:
-    #     print(tool_calls)
-    #     for tool_call in tool_calls:
-    #         function_name = tool_call.function.name
-    #         function_args = tool_call.function.arguments
-    #         function_output = registry.call(function_name, function_args)
-    #         if function_name == 'search_tool':
-    #             messages[-1]['content'] = messages[-1]['content'] + f"现在的时间是{get_time()} 这是一些网络搜索的的资料 请注意,这些资料均为网上收集获取的,并且不一定与主题相关,需要注意辨别真伪,忽略掉他人的总结类型信息,最好根据官方资料/权威资料（如果有）进行总结,如果用户问题需要时间控制,请分析资料的时间是否满足要求 \n{function_output}"
-    #             gemini_response = summary(messages)
-    #             assistant_message = {'role': 'assistant', 'content': gemini_response + ' by Gemini'}
-    #             assistant_message['content'] = assistant_message['content']+ "\n" +function_output
-
-    #         if function_name == 'get_url_content':
-    #             messages[-1]['content'] = messages[-1]['content'] + f"这是网页的内容 \n {function_output[:40000:]}"
-    #             deepseek_response, reason_response = summary(messages)
-    #             assistant_message = {'role': 'assistant', 'content': f"<thinking>{reason_response}</thinking>" + deepseek_response + ' by DeepSeek'}
-    #             assistant_message['content'] = assistant_message['content'] + "\n" +function_output
-    #             assistant_message['reasoning_content'] = reason_response
-    #         messages.append(assistant_message)
-
-    # else:
-    #     assistant_message = {'role': 'assistant', 'content': assistant_reply.content}
-    #     messages.append(assistant_message)
-    assistant_message = {'role': 'assistant', 'content': assistant_reply.content}
-
-    return assistant_message
\ No newline at end of file
+    with span("tool_decision"):
+        assistant_reply = chat_completion(messages, use_tools=True)
+    tool_calls = getattr(assistant_reply, 'tool_calls', None)
+    if not tool_calls:
+        return {'role': 'assistant', 'content': assistant_reply.content}
+
+    progress = []
+    tools = run_tool_calls(tool_calls, messages, search_mode)
+    while True:
+        try:
+            progress.append(next(tools))
+        except StopIteration as stop:
+            messages = stop.value
+            break
+
+    with span("summary", model=config.SUMMARY_MODEL, stream=False):
+        content, reasoning_content = summary(messages)
+    return {
+        'role': 'assistant',
+        'content': content,
+        'reasoning_content': "".join(progress) + "\n\n" + (reasoning_content or ""),
+    }
@@ -0,0 +1,228 @@
+"""
+搜索后端注册表: 每个后端声明自己支持的能力(时间范围过滤、语言、网页正文、单次结果数)与单次调用成本,
+并统计近期的延迟与成功率。搜索时按 SEARCH_ROUTING 在具备所需能力的可用后端中选择:
+priority 按注册顺序,cheapest 选成本最低的,fastest 选近期延迟最低的。
+内置的 SearXNG 与 Tavily 后端在 search_searxng_api.py 中注册;FileBackend 从本地文件返回固定结果,
+可通过 SEARCH_FILE_BACKENDS 注册,用于离线压测或调试。
+"""
+import asyncio
+import json
+from pathlib import Path
+import sys
+import time
+from threading import Lock
+from typing import Optional
+
+# 将项目根目录添加到sys.path
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from app.search.search_cache import normalize_query
+from app.utils.metrics import Gauge
+from app.utils.resilience import is_available
+from config import base_config as config
+from config.logging_config import logger
+
+EWMA_ALPHA = 0.2
+
+
+class BackendStats:
+    """后端近期的延迟(指数加权平均)与调用结果,线程安全"""
+
+    def __init__(self):
+        self.calls = 0
+        self.successes = 0
+        self.ewma = 0.0
+        self._lock = Lock()
+
+    def record(self, seconds: float, success: bool) -> None:
+        with self._lock:
+            self.calls += 1
+            self.successes += success
+            self.ewma = seconds if not self.ewma else EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * self.ewma
+
+    def success_rate(self) -> float:
+        with self._lock:
+            return self.successes / self.calls if self.calls else 1.0
+
+
+class SearchBackend:
+    """
+    搜索后端接口。子类实现 search,需要时覆盖 search_async(默认在线程中调用 search)。
+
+    Attributes:
+        name: 后端名称,用于熔断器、速率限制、缓存与指标
+        cost: 单次调用的相对成本,如付费接口的额度,cheapest 路由时使用
+        time_filter: 是否支持按 time_page 过滤时间范围
+        languages: 支持的语言代码,None 表示不限
+        raw_content: 是否能返回网页正文
+        page_size: 单次搜索大约返回的结果数
+    """
+    name = ""
+    cost = 0.0
+    time_filter = False
+    languages: Optional[frozenset] = None
+    raw_content = False
+    page_size = 10
+
+    def __init__(self):
+        self.stats = BackendStats()
+
+    def configured(self) -> bool:
+        """配置是否齐全,未配置的后端不参与路由"""
+        return True
+
+    def available(self) -> bool:
+        """是否可以调用,默认看同名熔断器"""
+        return is_available(self.name)
+
+    def supports(self, language: str, time_page) -> bool:
+        if any(time_page or ()) and not self.time_filter:
+            return False
+        return self.languages is None or language in ("all", "") or language in self.languages
+
+    def search(self, query: str, language: str, time_page) -> list:
+        raise NotImplementedError
+
+    async def search_async(self, query: str, language: str, time_page) -> list:
+        return await asyncio.to_thread(self.search, query, language, time_page)
+
+
+class FileBackend(SearchBackend):
+    """
+    从本地 JSON 文件返回固定结果的后端,不访问网络。文件内容为 {查询词: [结果, ...]},
+    查询词忽略大小写与多余空白;找不到的查询返回空列表。latency 为模拟的每次调用耗时(秒)。
+    """
+
+    def __init__(self, name: str, path, latency: float = 0.0):
+        super().__init__()
+        self.name = name
+        self.path = Path(path)
+        self.latency = latency
+        self._results: Optional[dict] = None
+        self._lock = Lock()
+
+    def _load(self) -> dict:
+        with self._lock:
+            if self._results is None:
+                try:
+                    data = json.loads(self.path.read_text(encoding="utf-8"))
+                    self._results = {normalize_query(query): results for query, results in data.items()}
+                    logger.info(f"搜索后端 {self.name} 从 {self.path} 加载了 {len(self._results)} 个查询")
+                except (OSError, ValueError, AttributeError) as e:
+                    logger.error(f"搜索后端 {self.name} 无法读取 {self.path}: {e}")
+                    self._results = {}
+            return self._results
+
+    def search(self, query: str, language: str, time_page) -> list:
+        if self.latency:
+            time.sleep(self.latency)
+        return list(self._load().get(normalize_query(query), []))
+
+    async def search_async(self, query: str, language: str, time_page) -> list:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return list(self._load().get(normalize_query(query), []))
+
+
+_BACKENDS: dict[str, SearchBackend] = {}
+_BACKENDS_LOCK = Lock()
+_CONFIGURED_FILES: dict[str, str] = {}  # 由 SEARCH_FILE_BACKENDS 注册的后端: 名称 -> 文件路径
+
+
+def register_backend(backend: SearchBackend) -> SearchBackend:
+    """注册后端,同名的会被替换;注册顺序即 priority 路由的优先级"""
+    with _BACKENDS_LOCK:
+        _BACKENDS[backend.name] = backend
+    return backend
+
+
+def unregister_backend(name: str) -> None:
+    with _BACKENDS_LOCK:
+        _BACKENDS.pop(name, None)
+
+
+def parse_file_backends(raw: str) -> dict[str, str]:
+    """解析 SEARCH_FILE_BACKENDS,格式为 名称=文件路径,多个用逗号分隔"""
+    backends = {}
+    for item in raw.split(","):
+        name, sep, path = item.strip().partition("=")
+        if sep and name.strip() and path.strip():
+            backends[name.strip()] = path.strip()
+        elif item.strip():
+            logger.warning(f"SEARCH_FILE_BACKENDS 中的 {item.strip()} 格式有误,已忽略")
+    return backends
+
+
+def _sync_file_backends() -> None:
+    """按 SEARCH_FILE_BACKENDS 注册或移除 FileBackend,配置重新加载后生效"""
+    wanted = parse_file_backends(config.SEARCH_FILE_BACKENDS)
+    with _BACKENDS_LOCK:
+        for name, path in list(_CONFIGURED_FILES.items()):
+            if wanted.get(name) != path:
+                del _CONFIGURED_FILES[name]
+                _BACKENDS.pop(name, None)
+        for name, path in wanted.items():
+            if name not in _CONFIGURED_FILES:
+                if name in _BACKENDS:
+                    logger.warning(f"SEARCH_FILE_BACKENDS 中的 {name} 与已注册的搜索后端重名,已忽略")
+                    continue
+                _CONFIGURED_FILES[name] = path
+                _BACKENDS[name] = FileBackend(name, path)
+
+
+def configured_backends() -> list[SearchBackend]:
+    _sync_file_backends()
+    with _BACKENDS_LOCK:
+        backends = list(_BACKENDS.values())
+    return [backend for backend in backends if backend.configured()]
+
+
+def route(query: str, language: str, time_page) -> list[SearchBackend]:
+    """
+    具备所需能力的可用后端,按 SEARCH_ROUTING 排列,最合适的在最前;都不可用时为空列表。
+    没有后端具备所需能力时退而使用全部可用后端(如不支持时间过滤的后端仍可搜索,只是结果不限时间)。
+    """
+    backends = configured_backends()
+    available = []
+    for backend in backends:
+        if backend.available():
+            available.append(backend)
+        else:
+            logger.info(f"{backend.name} 暂时不可用,跳过")
+    if backends and not available:
+        logger.warning(f"所有搜索后端都暂时不可用,跳过搜索: '{query}'")
+    capable = [backend for backend in available if backend.supports(language, time_page)]
+    if available and not capable:
+        logger.info(f"没有搜索后端支持语言 {language}、时间页 {time_page},忽略这些条件: '{query}'")
+    candidates = capable or available
+
+    order = {backend.name: i for i, backend in enumerate(candidates)}
+    if config.SEARCH_ROUTING == "cheapest":
+        preference = lambda backend: (backend.cost, order[backend.name])
+    elif config.SEARCH_ROUTING == "fastest":
+        # 成功率低的后端即使响应快也往往没有结果,按成功率折算延迟
+        preference = lambda backend: (backend.stats.ewma / max(backend.stats.success_rate(), 0.1),
+                                      order[backend.name])
+    else:
+        preference = lambda backend: order[backend.name]
+    return sorted(candidates, key=preference)
+
+
+def _called_backends() -> list[SearchBackend]:
+    with _BACKENDS_LOCK:
+        return [backend for backend in _BACKENDS.values() if backend.stats.calls]
+
+
+def _latencies() -> dict:
+    return {(backend.name,): round(backend.stats.ewma, 4) for backend in _called_backends()}
+
+
+def _success_rates() -> dict:
+    return {(backend.name,): round(backend.stats.success_rate(), 4) for backend in _called_backends()}
+
+
+Gauge("search_backend_latency_ewma_seconds", "各搜索后端近期延迟的指数加权平均,fastest 路由依据", ("backend",),
+      callback=_latencies)
+Gauge("search_backend_success_ratio", "各搜索后端返回了结果的调用比例", ("backend",), callback=_success_rates)
@@ -1,12 +1,8 @@
 import json
 import sys
-import time
 import traceback
-from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-from openai import OpenAI
-
 # 将 ROOT_DIR 的解析和路径追加放在模块导入的更前面，以确保路径设置尽早生效
 ROOT_DIR = Path(__file__).resolve().parent.parent.parent
 if str(ROOT_DIR) not in sys.path:
@@ -14,18 +10,20 @@ if str(ROOT_DIR) not in sys.path:
 
 from app.search.fc_search import search_core
 from app.search.models import SearchRequest, SearchResult, SearchResults
-from app.search.search_after_ai import deepscan, is_duplicate
-from app.search.search_searxng_api import search_api_worker
+from app.search.search_after_ai import deepscan, search_queries
 from app.utils.black_url import URL_BLACKLIST
 from config import base_config as config
 from app.utils.i18n import i18n
+from app.utils.key_pool import use_key
+from app.utils.llm_client import get_openai_client
+from app.utils.rate_limit import throttle
+from app.utils.request_context import out_of_time, raise_if_cancelled, record_usage, span, timeout_for, traced
 from config.logging_config import logger
 from app.utils.prompt import (DEEPRESEARCH_FIRST_PROMPT,
                               DEEPRESEARCH_NEXT_PROMPT, GET_VALUE_URL_PROMPT)
 from app.utils.tools import (format_search_plan, format_urls, get_time,
                              json2SearchRequests, response2json)
 
-client = OpenAI(api_key=config.SEARCH_KEYWORD_API_KEY, base_url=config.SEARCH_KEYWORD_API_URL)
 # 日志配置在 config/logging_config.py 中统一管理
 
 
@@ -35,8 +33,6 @@ def _search_valuable_results(
     if excluded_urls is None:
         excluded_urls = [""]  # 保持原有默认行为
 
-    start_time = time.time()
-    new_results = []
     if not search_request:
         logger.warning("搜索请求列表为空。")
         return SearchResults()
@@ -45,30 +41,9 @@ def _search_valuable_results(
     time_page = search_request.time_page
     logger.info(f"开始搜索 - 目的: {search_purpose}")
 
-    with ThreadPoolExecutor(
-        max_workers=config.SEARCH_API_LIMIT
-    ) as executor:
-        futures = []
-        for data in search_request.query_keys:
-            query = data.key
-            language = data.language
-            logger.info(
-                f"搜索关键词: {query}, 语言: {language}, 时间范围: {time_page}"
-            )
-            if query and language:
-                futures.append(
-                    executor.submit(search_api_worker, query, language, time_page)
-                )
-
-        for future in futures:
-            try:
-                results = future.result()
-                for result in results:
-                    if not is_duplicate(result, new_results):
-                        new_results.append(result)
-            except Exception as e:
-                logger.error(f"处理搜索结果时出错: {str(e)}")
-                logger.error(traceback.format_exc())
+    with span("search_api_calls", queries=len(search_request.query_keys)) as search_span:
+        new_results = search_queries(search_request.query_keys, time_page)
+    record_usage("search", seconds=search_span.duration)
 
     if URL_BLACKLIST:
         unique_results = [
@@ -108,6 +83,7 @@ def _search_valuable_results(
     )
 
 
+@traced("generate_search_plan")
 def generate_search_plan(messages: list[dict], web_reference: str = "", previous_plan: str = "", previous_results: str = "", max_remaining_steps: int = 8) -> list:
     """
     生成搜索计划
@@ -140,13 +116,21 @@ def generate_search_plan(messages: list[dict], web_reference: str = "", previous
         )
     # print(prompt)
         # print("previous_plan",previous_plan)
+    raise_if_cancelled()
     try:
-        llm_rsp = client.chat.completions.create(
-            model=config.SEARCH_KEYWORD_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.1,
-            stream=False,
-        )
+        reservation = throttle(config.SEARCH_KEYWORD_MODEL, prompt)
+        with span("plan", model=config.SEARCH_KEYWORD_MODEL) as call_span, \
+                use_key("keyword", config.SEARCH_KEYWORD_API_KEYS) as lease:
+            client = get_openai_client(config.SEARCH_KEYWORD_API_URL, lease.key)
+            llm_rsp = client.chat.completions.create(
+                model=config.SEARCH_KEYWORD_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.1,
+                stream=False,
+                timeout=timeout_for(120),
+            )
+        reservation.settle(llm_rsp.usage)
+        record_usage("plan", llm_rsp.usage, call_span.duration)
         llm_rsp_content = llm_rsp.choices[0].message.content
         
         try:
@@ -165,6 +149,7 @@ def generate_search_plan(messages: list[dict], web_reference: str = "", previous
         return []
 
 
+@traced("execute_search_plan")
 def _execute_search_plan(search_plan_step: dict, excluded_urls: list[str] = None) -> SearchResults:
     """
     执行单个搜索计划步骤
@@ -202,13 +187,19 @@ def _execute_search_plan(search_plan_step: dict, excluded_urls: list[str] = None
     )
     # print("value_url_prompt: ",value_url_prompt)
     try:
-        client = OpenAI(api_key=config.EVALUATE_API_KEY, base_url=config.EVALUATE_API_URL)
-        llm_rsp_value = client.chat.completions.create(
-            model=config.EVALUATE_MODEL,
-            messages=[{"role": "user", "content": value_url_prompt}],
-            temperature=0.1,
-            stream=False,
-        )
+        reservation = throttle(config.EVALUATE_MODEL, value_url_prompt)
+        with span("value_urls", model=config.EVALUATE_MODEL) as call_span, \
+                use_key("evaluate", config.EVALUATE_API_KEYS) as lease:
+            client = get_openai_client(config.EVALUATE_API_URL, lease.key)
+            llm_rsp_value = client.chat.completions.create(
+                model=config.EVALUATE_MODEL,
+                messages=[{"role": "user", "content": value_url_prompt}],
+                temperature=0.1,
+                stream=False,
+                timeout=timeout_for(120),
+            )
+        reservation.settle(llm_rsp_value.usage)
+        record_usage("evaluate", llm_rsp_value.usage, call_span.duration)
 
         try:
             completion_tokens_val = llm_rsp_value.usage.completion_tokens
@@ -293,6 +284,10 @@ def deepresearch_tool(messages: list[dict]):
     # 继续生成和执行后续搜索计划
     try:
         while len(executed_search_plans) < max_plan_iterations:
+            raise_if_cancelled()
+            if out_of_time():
+                yield i18n('deadline_reached')
+                break
             yield i18n('plans_executed', num=len(executed_search_plans), max=max_plan_iterations)
             # 生成下一个搜索计划
             yield i18n('next_plan', num=plan_counter)
@@ -330,7 +325,7 @@ def deepresearch_tool(messages: list[dict]):
             yield i18n('deep_finished')
 
         yield i18n('deep_search_done')
-    except:
+    except Exception:
         traceback.print_exc()
         yield i18n('deep_error')
     
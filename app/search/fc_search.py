@@ -2,8 +2,6 @@ import sys
 import json
 from pathlib import Path
 
-from openai import OpenAI
-
 ROOT_DIR = Path(__file__).resolve().parent.parent.parent
 if str(ROOT_DIR) not in sys.path:
     sys.path.append(str(ROOT_DIR))
@@ -14,19 +12,28 @@ from app.utils.tools import format_urls, response2json, get_time, json2SearchReq
 from app.utils.i18n import i18n
 from app.utils.prompt import SEARCH_PROMPT
 from app.search.search_after_ai import search_ai
+from app.utils.key_pool import use_key
+from app.utils.llm_client import get_openai_client
+from app.utils.rate_limit import throttle
+from app.utils.request_context import raise_if_cancelled, record_usage, span, timeout_for, traced
 
+@traced("search_core")
 def search_core(messages: str, deep: bool = True):
     messages = [{'role': 'user', 'content': SEARCH_PROMPT.substitute(messages=messages,current_time=get_time())}] 
-    client = OpenAI(
-        api_key=config.SEARCH_KEYWORD_API_KEY,
-        base_url=config.SEARCH_KEYWORD_API_URL
-    )
-    llm_rsp = client.chat.completions.create(
-        model=config.SEARCH_KEYWORD_MODEL,
-        messages=messages,
-        temperature=0.1,
-        stream=False
-    )
+    raise_if_cancelled()
+    reservation = throttle(config.SEARCH_KEYWORD_MODEL, messages[0]['content'])
+    with span("keyword", model=config.SEARCH_KEYWORD_MODEL) as call_span, \
+            use_key("keyword", config.SEARCH_KEYWORD_API_KEYS) as lease:
+        client = get_openai_client(config.SEARCH_KEYWORD_API_URL, lease.key)
+        llm_rsp = client.chat.completions.create(
+            model=config.SEARCH_KEYWORD_MODEL,
+            messages=messages,
+            temperature=0.1,
+            stream=False,
+            timeout=timeout_for(120),
+        )
+    reservation.settle(llm_rsp.usage)
+    record_usage("keyword", llm_rsp.usage, call_span.duration)
     results = response2json(llm_rsp.choices[0].message.content)
     # print(f"搜索关键词生成结果: {json.dumps(results,indent=4,ensure_ascii=False)}")
 
@@ -42,17 +49,21 @@ def search_tool(messages: str):
     yield i18n('search_start')
     messages = [{'role': 'user', 'content': SEARCH_PROMPT.substitute(messages=messages, current_time=get_time())}]
     logger.info("调用搜索工具")
-    client = OpenAI(
-        api_key=config.SEARCH_KEYWORD_API_KEY,
-        base_url=config.SEARCH_KEYWORD_API_URL
-    )
     
-    llm_rsp = client.chat.completions.create(
-        model=config.SEARCH_KEYWORD_MODEL,
-        messages=messages,
-        temperature=0.1,
-        stream=False
-    )
+    raise_if_cancelled()
+    reservation = throttle(config.SEARCH_KEYWORD_MODEL, messages[0]['content'])
+    with span("keyword", model=config.SEARCH_KEYWORD_MODEL) as call_span, \
+            use_key("keyword", config.SEARCH_KEYWORD_API_KEYS) as lease:
+        client = get_openai_client(config.SEARCH_KEYWORD_API_URL, lease.key)
+        llm_rsp = client.chat.completions.create(
+            model=config.SEARCH_KEYWORD_MODEL,
+            messages=messages,
+            temperature=0.1,
+            stream=False,
+            timeout=timeout_for(120),
+        )
+    reservation.settle(llm_rsp.usage)
+    record_usage("keyword", llm_rsp.usage, call_span.duration)
     
     results = response2json(llm_rsp.choices[0].message.content)
     logger.info(
@@ -72,7 +83,7 @@ def search_tool(messages: str):
         yield from format_urls(search_results.get_urls())
 
     yield i18n('search_done')
-    yield f"results{search_results.to_str()}"
+    yield f"results{search_results.to_str() if search_results else ''}"
 
 
 
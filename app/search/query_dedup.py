@@ -0,0 +1,120 @@
+"""
+搜索关键词去重: 模型生成的关键词经常只有大小写、标点或词序不同,同一个搜索计划内、
+深度研究的不同步骤之间都会重复出现。关键词先规范化为词集合(中日韩文字按相邻两字切分),
+与本次请求中已发出的搜索比较,完全相同或 Jaccard 相似度达到 QUERY_DEDUP_SIMILARITY 的
+直接使用已有结果,不再访问搜索后端。
+"""
+from pathlib import Path
+import re
+import sys
+import unicodedata
+from threading import Lock
+from typing import Optional
+from weakref import WeakKeyDictionary
+
+# 将项目根目录添加到sys.path
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from app.utils.metrics import Counter
+from app.utils.request_context import current_context
+from config import base_config as config
+from config.logging_config import logger
+
+_CJK = re.compile("[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+")
+
+
+def _strip_punctuation(text: str) -> str:
+    return "".join(" " if unicodedata.category(char)[0] in "PS" else char for char in text)
+
+
+def query_tokens(query: str) -> frozenset:
+    """
+    关键词规范化后的词集合: 统一大小写与全角半角,去掉标点,忽略词序。
+    中日韩文字没有空格分词,按相邻两字切分(单字保留原样)。
+    """
+    text = _strip_punctuation(unicodedata.normalize("NFKC", str(query)).casefold())
+    tokens = set()
+    for word in text.split():
+        rest = _CJK.sub(" ", word).split()
+        tokens.update(rest)
+        for run in _CJK.findall(word):
+            tokens.update(run[i:i + 2] for i in range(max(len(run) - 1, 1)))
+    return frozenset(tokens)
+
+
+def similarity(a: frozenset, b: frozenset) -> float:
+    """两个词集合的 Jaccard 相似度"""
+    if not a or not b:
+        return 1.0 if a == b else 0.0
+    return len(a & b) / len(a | b)
+
+
+def is_near_duplicate(a: frozenset, b: frozenset) -> bool:
+    if config.QUERY_DEDUP_SIMILARITY <= 0:
+        return False
+    return a == b or similarity(a, b) >= config.QUERY_DEDUP_SIMILARITY
+
+
+def dedupe_queries(queries: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    """去掉同一批关键词中与前面某个关键词(语言相同)重复或近似重复的,保持原有顺序"""
+    kept: list[tuple[str, str, frozenset]] = []
+    for query, language in queries:
+        tokens = query_tokens(query)
+        duplicate = next((item for item in kept if item[1] == language and is_near_duplicate(item[2], tokens)), None)
+        if duplicate is not None:
+            QUERY_DEDUP.inc(scope="plan")
+            logger.info(f"关键词 '{query}' 与 '{duplicate[0]}' 重复,跳过")
+            continue
+        kept.append((query, language, tokens))
+    return [(query, language) for query, language, _ in kept]
+
+
+class QueryRegistry:
+    """一次请求中已完成的搜索及其结果,按语言与时间范围区分,线程安全"""
+
+    def __init__(self):
+        self._entries: list[tuple[str, str, tuple, frozenset, list]] = []
+        self._lock = Lock()
+
+    def lookup(self, query: str, language: str, time_page) -> Optional[list]:
+        """查找重复或近似重复的已完成搜索,返回其结果;没有时返回 None"""
+        tokens = query_tokens(query)
+        time_page = tuple(time_page or ())
+        with self._lock:
+            entries = list(self._entries)
+        for issued, issued_language, issued_time_page, issued_tokens, results in entries:
+            if issued_language == language and issued_time_page == time_page \
+                    and is_near_duplicate(issued_tokens, tokens):
+                QUERY_DEDUP.inc(scope="session")
+                logger.info(f"关键词 '{query}' 与之前搜索过的 '{issued}' 重复,直接使用其结果")
+                return results
+        return None
+
+    def record(self, query: str, language: str, time_page, results) -> None:
+        """记录一次成功的搜索,空结果不记录,之后仍可重新搜索"""
+        if not results or not isinstance(results, list):
+            return
+        with self._lock:
+            self._entries.append((query, language, tuple(time_page or ()), query_tokens(query), results))
+
+
+_REGISTRIES: "WeakKeyDictionary" = WeakKeyDictionary()
+_REGISTRIES_LOCK = Lock()
+
+
+def current_registry() -> Optional[QueryRegistry]:
+    """当前请求的搜索记录,请求结束后随请求上下文释放;不在请求中或关闭去重时返回 None"""
+    ctx = current_context()
+    if ctx is None or config.QUERY_DEDUP_SIMILARITY <= 0:
+        return None
+    with _REGISTRIES_LOCK:
+        registry = _REGISTRIES.get(ctx)
+        if registry is None:
+            registry = _REGISTRIES[ctx] = QueryRegistry()
+        return registry
+
+
+QUERY_DEDUP = Counter("query_dedup_total", "因重复而未发出的搜索次数, scope 为 plan 表示同一批关键词内重复, session 表示与本次请求之前的搜索重复",
+                      ("scope",))
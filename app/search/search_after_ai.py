@@ -1,4 +1,6 @@
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from contextlib import ExitStack
 import time
 from urllib.parse import urlparse
 import traceback
@@ -6,17 +8,25 @@ import sys
 from typing import List, Dict, Tuple
 from pathlib import Path
 
-from openai import OpenAI
-
 ROOT_DIR = Path(__file__).resolve().parent.parent.parent
 if str(ROOT_DIR) not in sys.path:
     sys.path.append(str(ROOT_DIR))
 
-from app.search.search_searxng_api import search_api_worker
+from app.search.query_dedup import current_registry, dedupe_queries
+from app.search.search_searxng_api import search_api_worker, search_api_worker_async
 from app.search.models import SearchResults,SearchResult,SearchRequest
 from app.utils.tools import get_time, response2json
 from app.utils.black_url import URL_BLACKLIST
-from app.utils.compress_content import compress_url_content
+from app.utils.async_runtime import gather_limited, run_async
+from app.utils.compress_content import compress_url_content, compress_url_content_async
+from app.utils.key_pool import use_key
+from app.utils.llm_client import get_async_openai_client, get_openai_client
+from app.utils.rate_limit import throttle, throttle_async
+from app.utils.resilience import BackendUnavailable, backoff, backoff_async, guarded
+from app.utils.metrics import EVALUATE_BATCHES, EVALUATE_LATENCY, RETRIES, submit_tracked
+from app.utils.request_context import (DeadlineExceeded, cancel_pending_futures, current_span,
+                                       raise_if_cancelled, record_usage, span, stage_budget,
+                                       time_left, timeout_for, traced, wait_result)
 from config.logging_config import logger
 from config import base_config as config
 from app.utils.prompt import RELEVANCE_EVALUATION_PROMPT
@@ -27,11 +37,7 @@ from app.utils.prompt import RELEVANCE_EVALUATION_PROMPT
 RELEVANCE_THRESHOLD = 0  # 相关性阈值,低于此分数的结果将被过滤
 MAX_RETRIES = 3  # 最大重试次数
 BATCH_SIZE = 15
-# OpenAI 客户端初始化
-client = OpenAI(
-    api_key=config.SEARCH_KEYWORD_API_KEY,
-    base_url=config.SEARCH_KEYWORD_API_URL
-)
+MAX_EVALUATE_RESULTS = 50  # 参与相关性评估的结果数上限
 
 def is_duplicate(new_result, existing_results):
     """判断搜索结果是否重复"""
@@ -60,105 +66,474 @@ def is_duplicate(new_result, existing_results):
             
     return False
 
-def evaluate_single_batch(batch_idx : int, batch : List[Dict], search_purpose : str):
-    """评估单批次搜索结果的相关性"""
-    client = OpenAI(
-        api_key=config.EVALUATE_API_KEY,
-        base_url=config.EVALUATE_API_URL
-    )
+def _evaluation_prompt(batch : List[Dict], search_purpose : str) -> str:
     # 构造格式化后的结果文本
     formatted_results = [
         f"索引 {idx}:\n标题: {result.get('title', '无标题')}\n内容摘要: {result.get('content', '')[:200]}\nURL: {result.get('url', '')}"
         for idx, result in enumerate(batch)
     ]
     results_text = "\n".join(formatted_results)
-    evaluation_prompt = RELEVANCE_EVALUATION_PROMPT.substitute(
+    return RELEVANCE_EVALUATION_PROMPT.substitute(
         current_time=get_time(),
         search_purpose=search_purpose,
         results_text=results_text,
         batch_size=len(batch)
     )
 
+def _parse_scores(batch_idx : int, batch : List[Dict], response_text : str, attempt : int) -> dict:
+    """解析模型输出的评分,数量与批次不符时抛出 ValueError"""
+    scores_dict = response2json(response_text)
+    logger.info(f"批次 {batch_idx} 评分结果 (尝试 {attempt}): {scores_dict}")
+
+    # 检查输出是否包含所有索引
+    if len(scores_dict) != len(batch):
+        raise ValueError(f"输出长度 {len(scores_dict)} 与输入长度 {len(batch)} 不匹配")
+
+    # 转换为全局索引和标准分数
+    scores = {}
+    for key, value in scores_dict.items():
+        try:
+            scores[key] = float(value)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"转换评分时出错: {e}, key={key}, value={value}")
+    return scores
+
+def _scored_batch(batch_idx : int, batch : List[Dict], scores : dict, batch_start : float) -> List[Dict]:
+    """记录批次耗时与结果,把评分写回各条结果;没有评分时使用默认评分"""
+    success = bool(scores)
+    EVALUATE_LATENCY.observe(time.perf_counter() - batch_start, model=config.EVALUATE_MODEL)
+    EVALUATE_BATCHES.inc(model=config.EVALUATE_MODEL, status="ok" if success else "fallback")
+    # 多次尝试后仍未成功则采用默认评分
+    if not success:
+        logger.warning(f"批次 {batch_idx} 在 {MAX_RETRIES} 次尝试后仍未获取评分,使用默认评分")
+        for idx, result in enumerate(batch):
+            global_idx = batch_idx * 10 + idx
+            scores[global_idx] = result.get('score', 3)
+    results_score = []
+    for idx,tmp in enumerate(batch):
+        tmp["relevance_score"] = scores[list(scores.keys())[idx]]
+        results_score.append(tmp)
+    return results_score
+
+def _default_scored(batch : List[Dict]) -> List[Dict]:
+    """未能完成评估的批次使用搜索引擎给出的分数"""
+    for result in batch:
+        result["relevance_score"] = result.get('score', 3)
+    return batch
+
+def evaluate_single_batch(batch_idx : int, batch : List[Dict], search_purpose : str):
+    """评估单批次搜索结果的相关性"""
+    evaluation_prompt = _evaluation_prompt(batch, search_purpose)
+
     retry_count = 0
     scores = {}
     success = False
+    batch_start = time.perf_counter()
 
     while retry_count < MAX_RETRIES and not success:
+        raise_if_cancelled()
+        if retry_count:
+            RETRIES.inc(stage="evaluate", backend="openai", model=config.EVALUATE_MODEL)
         try:
             messages = [{"role": "user", "content": evaluation_prompt}]
-            response = client.chat.completions.create(
-                model=config.EVALUATE_MODEL,
-                messages=messages,
-                temperature=0.1,
-                stream=False
-            )
+            reservation = throttle(config.EVALUATE_MODEL, evaluation_prompt)
+            with span("evaluate_batch", batch=batch_idx, attempt=retry_count + 1) as call_span, \
+                    guarded(config.EVALUATE_MODEL), use_key("evaluate", config.EVALUATE_API_KEYS) as lease:
+                client = get_openai_client(config.EVALUATE_API_URL, lease.key)
+                response = client.chat.completions.create(
+                    model=config.EVALUATE_MODEL,
+                    messages=messages,
+                    temperature=0.1,
+                    stream=False,
+                    timeout=timeout_for(120),
+                )
+            reservation.settle(response.usage)
+            record_usage("evaluate", response.usage, call_span.duration)
             response_text = response.choices[0].message.content.strip()
-            scores_dict = response2json(response_text)
-            logger.info(f"批次 {batch_idx} 评分结果 (尝试 {retry_count+1}): {scores_dict}")
-
-            # 检查输出是否包含所有索引
-            if len(scores_dict) != len(batch):
-                raise ValueError(f"输出长度 {len(scores_dict)} 与输入长度 {len(batch)} 不匹配")
-
-            # 转换为全局索引和标准分数
-            for key, value in scores_dict.items():
-                try:
-                    scores[key] = float(value)
-                except (ValueError, TypeError) as e:
-                    logger.warning(f"转换评分时出错: {e}, key={key}, value={value}")
+            scores = _parse_scores(batch_idx, batch, response_text, retry_count + 1)
             success = True
 
+        except (BackendUnavailable, DeadlineExceeded) as e:
+            logger.warning(f"批次 {batch_idx} 跳过评估: {e}")
+            break
         except Exception as e:
             logger.error(f"批次 {batch_idx} 评估时出错: {e}")
             logger.error(traceback.format_exc())
             retry_count += 1
+            if retry_count < MAX_RETRIES:
+                backoff(retry_count - 1)
+
+    return _scored_batch(batch_idx, batch, scores if success else {}, batch_start)
+
+
+async def evaluate_single_batch_async(batch_idx : int, batch : List[Dict], search_purpose : str):
+    """evaluate_single_batch 的异步版本"""
+    evaluation_prompt = _evaluation_prompt(batch, search_purpose)
+    scores = {}
+    batch_start = time.perf_counter()
+
+    for attempt in range(MAX_RETRIES):
+        if attempt:
+            RETRIES.inc(stage="evaluate", backend="openai", model=config.EVALUATE_MODEL)
+        try:
+            reservation = await throttle_async(config.EVALUATE_MODEL, evaluation_prompt)
+            with span("evaluate_batch", batch=batch_idx, attempt=attempt + 1) as call_span, \
+                    guarded(config.EVALUATE_MODEL), use_key("evaluate", config.EVALUATE_API_KEYS) as lease:
+                client = get_async_openai_client(config.EVALUATE_API_URL, lease.key)
+                response = await client.chat.completions.create(
+                    model=config.EVALUATE_MODEL,
+                    messages=[{"role": "user", "content": evaluation_prompt}],
+                    temperature=0.1,
+                    stream=False,
+                    timeout=timeout_for(120),
+                )
+            reservation.settle(response.usage)
+            record_usage("evaluate", response.usage, call_span.duration)
+            scores = _parse_scores(batch_idx, batch, response.choices[0].message.content.strip(), attempt + 1)
+            break
+        except (BackendUnavailable, DeadlineExceeded) as e:
+            logger.warning(f"批次 {batch_idx} 跳过评估: {e}")
+            break
+        except Exception as e:
+            logger.error(f"批次 {batch_idx} 评估时出错: {e}")
+            if attempt + 1 < MAX_RETRIES:
+                await backoff_async(attempt)
+
+    return _scored_batch(batch_idx, batch, scores, batch_start)
+
+
+async def _gather_results(coros, describe) -> list:
+    """异步扇出并收集结果,失败的任务记录日志后得到 None"""
+    results = await gather_limited(coros)
+    for idx, result in enumerate(results):
+        if isinstance(result, Exception):
+            # 超时放弃的任务已由 gather_limited 汇总记录
+            if not isinstance(result, DeadlineExceeded):
+                logger.error(f"{describe(idx)}: {str(result)}")
+            results[idx] = None
+    return results
+
+
+class _ResultCollector:
+    """按搜索完成的顺序收集结果: 去重、截断到 limit 条(0 表示不限),每凑满 BATCH_SIZE 条新结果就交出一批"""
+
+    def __init__(self, limit: int = 0):
+        self.results = []
+        self.limit = limit
+        self.truncated = False
+        self._pending = []
+
+    def add(self, results) -> List[List[Dict]]:
+        for result in results or []:
+            if self.limit and len(self.results) >= self.limit:
+                if not self.truncated:
+                    self.truncated = True
+                    logger.info(f"搜索结果过多,仅取前{self.limit}个结果")
+                break
+            # 添加结果,同时进行去重
+            if not is_duplicate(result, self.results):
+                self.results.append(result)
+                self._pending.append(result)
+        batches = []
+        while len(self._pending) >= BATCH_SIZE:
+            batches.append(self._pending[:BATCH_SIZE])
+            self._pending = self._pending[BATCH_SIZE:]
+        return batches
+
+    def flush(self) -> List[List[Dict]]:
+        """交出不足一批的剩余结果"""
+        batches = [self._pending] if self._pending else []
+        self._pending = []
+        return batches
+
+
+def _search_tasks(query_keys, time_page) -> List[Tuple[str, str]]:
+    queries = []
+    for data in query_keys:
+        query = data.key
+        language = data.language
+        logger.info(f"搜索关键词: {query}, 语言: {language}, 时间范围: {time_page}")
+        if query and language:
+            queries.append((query, language))
+    return dedupe_queries(queries)
+
+
+def _split_answered(queries, time_page):
+    """
+    把关键词分为本次请求中已搜索过(含近似重复)的与需要搜索的。
+    返回 (搜索记录, [已有的结果], [需要搜索的关键词])
+    """
+    registry = current_registry()
+    if registry is None:
+        return None, [], queries
+    answered, remaining = [], []
+    for query, language in queries:
+        results = registry.lookup(query, language, time_page)
+        if results is None:
+            remaining.append((query, language))
+        else:
+            answered.append(results)
+    return registry, answered, remaining
+
+
+def _run_searches(queries, time_page, on_results) -> None:
+    """
+    并发搜索,每个关键词完成时立即把结果交给 on_results,不必等待排在前面的慢查询。
+    到截止时间仍未完成的搜索不再等待,其结果完成后只写入搜索缓存。
+    """
+    registry, answered, queries = _split_answered(queries, time_page)
+    executor = ThreadPoolExecutor(max_workers=config.SEARCH_API_LIMIT)
+    with cancel_pending_futures(executor):
+        with stage_budget("search"):
+            futures = {submit_tracked("search", executor, search_api_worker, query, language, time_page): (query, language)
+                       for query, language in queries}
+            left = time_left()
+        try:
+            # 重复的关键词直接使用已有结果,在搜索阶段的时间预算之外交给 on_results
+            for results in answered:
+                on_results(results)
+            for future in as_completed(futures, timeout=None if left is None else max(left, 0)):
+                raise_if_cancelled()
+                try:
+                    results = future.result()
+                    if registry is not None:
+                        registry.record(*futures[future], time_page, results)
+                    on_results(results)
+                except DeadlineExceeded:
+                    logger.warning("搜索未在时间预算内完成,已放弃")
+                except Exception as e:
+                    logger.error(f"处理搜索结果时出错: {str(e)}")
+                    logger.error(traceback.format_exc())
+        except FutureTimeoutError:
+            unfinished = sum(not future.done() for future in futures)
+            logger.warning(f"{unfinished} 个搜索未在时间预算内完成,已放弃")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def _run_searches_async(queries, time_page, on_results) -> None:
+    """_run_searches 的异步版本,到截止时间仍未完成的搜索被取消"""
+    semaphore = asyncio.Semaphore(config.ASYNC_FANOUT_LIMIT)
+
+    async def search(query, language):
+        async with semaphore:
+            results = await search_api_worker_async(query, language, time_page)
+        if registry is not None:
+            registry.record(query, language, time_page, results)
+        return results
+
+    registry, answered, queries = _split_answered(queries, time_page)
+    with stage_budget("search"):
+        tasks = [asyncio.ensure_future(search(query, language)) for query, language in queries]
+        left = time_left()
+    try:
+        for results in answered:
+            on_results(results)
+        for next_done in asyncio.as_completed(tasks, timeout=None if left is None else max(left, 0)):
+            try:
+                results = await next_done
+            except asyncio.TimeoutError:
+                raise
+            except Exception as e:
+                logger.error(f"处理搜索结果时出错: {str(e)}")
+                continue
+            on_results(results)
+    except asyncio.TimeoutError:
+        unfinished = sum(not task.done() for task in tasks)
+        logger.warning(f"{unfinished} 个搜索未在时间预算内完成,已放弃")
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def search_queries(query_keys, time_page) -> List[Dict]:
+    """并发搜索全部关键词,按完成顺序合并并去重结果"""
+    queries = _search_tasks(query_keys, time_page)
+    collector = _ResultCollector()
+    if config.ASYNC_FANOUT:
+        run_async(_run_searches_async(queries, time_page, collector.add))
+    else:
+        _run_searches(queries, time_page, collector.add)
+    return collector.results
 
-    # 多次尝试后仍未成功则采用默认评分
-    if not success:
-        logger.warning(f"批次 {batch_idx} 在 {MAX_RETRIES} 次尝试后仍未获取评分,使用默认评分")
-        for idx, result in enumerate(batch):
-            global_idx = batch_idx * 10 + idx
-            scores[global_idx] = result.get('score', 3)
-    results_score = []
-    for idx,tmp in enumerate(batch):
-        tmp["relevance_score"] = scores[list(scores.keys())[idx]]
-        results_score.append(tmp)
-    return results_score
 
+def _split_batches(search_results: List[Dict]) -> List[List[Dict]]:
+    return [search_results[i:i + BATCH_SIZE] for i in range(0, len(search_results), BATCH_SIZE)]
 
+
+class _BatchEvaluator:
+    """把评估批次提交到线程池,收集时未在时间预算内完成的批次使用默认评分"""
+
+    def __init__(self, executor, search_purpose: str):
+        self.executor = executor
+        self.search_purpose = search_purpose
+        self.batches = []
+        self.futures = []
+
+    def submit(self, batches: List[List[Dict]]) -> None:
+        for batch in batches:
+            self.futures.append(submit_tracked("evaluate", self.executor, evaluate_single_batch,
+                                               len(self.batches), batch, self.search_purpose))
+            self.batches.append(batch)
+
+    def collect(self) -> List[Dict]:
+        results_score_all = []
+        for i, future in enumerate(self.futures):
+            raise_if_cancelled()
+            try:
+                results_score_all += wait_result(future)
+            except DeadlineExceeded:
+                logger.warning(f"批次 {i} 未在时间预算内完成评估,使用默认评分")
+                results_score_all += _default_scored(self.batches[i])
+            except Exception as e:
+                logger.error(f"获取评估结果时出错: {str(e)}")
+                logger.error(traceback.format_exc())
+        logger.info(f"评估完成,得到 {len(results_score_all)} 个评分结果")
+        return results_score_all
+
+
+class _AsyncBatchEvaluator:
+    """_BatchEvaluator 的异步版本,需在事件循环中使用"""
+
+    def __init__(self, search_purpose: str):
+        self.search_purpose = search_purpose
+        self.batches = []
+        self.tasks = []
+        self._semaphore = asyncio.Semaphore(config.ASYNC_FANOUT_LIMIT)
+
+    async def _evaluate(self, batch_idx: int, batch: List[Dict]):
+        async with self._semaphore:
+            return await evaluate_single_batch_async(batch_idx, batch, self.search_purpose)
+
+    def submit(self, batches: List[List[Dict]]) -> None:
+        for batch in batches:
+            self.tasks.append(asyncio.ensure_future(self._evaluate(len(self.batches), batch)))
+            self.batches.append(batch)
+
+    async def collect(self) -> List[Dict]:
+        if not self.tasks:
+            return []
+        left = time_left()
+        try:
+            _, pending = await asyncio.wait(self.tasks, timeout=None if left is None else max(left, 0))
+        except asyncio.CancelledError:
+            for task in self.tasks:
+                task.cancel()
+            raise
+        results_score_all = []
+        for i, task in enumerate(self.tasks):
+            if task in pending:
+                task.cancel()
+                logger.warning(f"批次 {i} 未在时间预算内完成评估,使用默认评分")
+                results_score_all += _default_scored(self.batches[i])
+            elif task.exception() is not None:
+                logger.error(f"获取评估结果时出错: {str(task.exception())}")
+                results_score_all += _default_scored(self.batches[i])
+            else:
+                results_score_all += task.result()
+        logger.info(f"评估完成,得到 {len(results_score_all)} 个评分结果")
+        return results_score_all
+
+
+async def _evaluate_async(search_purpose: str, batches: List[List[Dict]]) -> List[Dict]:
+    evaluator = _AsyncBatchEvaluator(search_purpose)
+    evaluator.submit(batches)
+    return await evaluator.collect()
+
+
+@traced("evaluate_relevance")
 def evaluate_relevance(search_purpose : str, search_results :List[Dict]):
     """使用多线程并发评估搜索结果的相关性和重要性"""
     if not search_results:
         return []
-    
+
     # 将搜索结果分割 分批进行判断
-    batches = []
-    for i in range(0, len(search_results), BATCH_SIZE):
-        batches.append(search_results[i:i+BATCH_SIZE])
+    batches = _split_batches(search_results)
     logger.info(f"将 {len(search_results)} 个结果分为 {len(batches)} 批进行评估")
-    
-    # 使用线程池并发处理评估任务
-    with ThreadPoolExecutor(max_workers=min(config.EVALUATE_THREAD_NUM, len(batches))) as executor:
-        futures = []
-        for i, batch in enumerate(batches):
-            futures.append(executor.submit(evaluate_single_batch, i, batch, search_purpose))
-        
-        # 收集结果
-        results_score_all = []
-        for future in futures:
-            try:
-                # results_score = future.result()
-                results_score_all += future.result()
-            except Exception as e:
-                traceback.print_exc()
-                logger.error(f"获取评估结果时出错: {str(e)}")
-                logger.error(traceback.format_exc())
-    
-    # 按评分降序排序
-    # sorted_scores = sorted(all_scores.items(), key=lambda x: x[1], reverse=True)
-    logger.info(f"评估完成,得到 {len(results_score_all)} 个评分结果")
-    return results_score_all
 
+    with stage_budget("evaluate"):
+        if config.ASYNC_FANOUT:
+            return run_async(_evaluate_async(search_purpose, batches))
+        with ThreadPoolExecutor(max_workers=min(config.EVALUATE_THREAD_NUM, len(batches))) as executor, \
+                cancel_pending_futures(executor):
+            evaluator = _BatchEvaluator(executor, search_purpose)
+            evaluator.submit(batches)
+            return evaluator.collect()
+
+
+def _excluding_blacklist(results, collector: _ResultCollector, excluded: list) -> List[List[Dict]]:
+    """排除黑名单中的网址后交给 collector,excluded 累计被排除的数量"""
+    results = results or []
+    kept = [result for result in results
+            if not any(result.get('url', '').startswith(prefix) for prefix in URL_BLACKLIST)]
+    excluded[0] += len(results) - len(kept)
+    return collector.add(kept)
+
+
+def _search_and_evaluate(search_request: SearchRequest) -> List[Dict]:
+    """
+    搜索与相关性评估重叠进行: 每个关键词的搜索完成后立即合并去重,
+    凑满一批就开始评估,不必等全部搜索结束。返回全部带评分的结果。
+    评估阶段的时间预算从提交第一批时开始计算。
+    """
+    queries = _search_tasks(search_request.query_keys, search_request.time_page)
+    collector = _ResultCollector(limit=MAX_EVALUATE_RESULTS)
+    excluded = [0]
+
+    if config.ASYNC_FANOUT:
+        return run_async(_search_and_evaluate_async(search_request, queries, collector, excluded))
+
+    with ThreadPoolExecutor(max_workers=config.EVALUATE_THREAD_NUM) as executor, \
+            cancel_pending_futures(executor), ExitStack() as evaluate_scope:
+        evaluator = _BatchEvaluator(executor, search_request.search_purpose)
+
+        def submit(batches):
+            if batches and not evaluator.batches:
+                evaluate_scope.enter_context(stage_budget("evaluate"))
+            evaluator.submit(batches)
+
+        with span("search_api_calls", queries=len(queries)) as search_span:
+            _run_searches(queries, search_request.time_page,
+                          lambda results: submit(_excluding_blacklist(results, collector, excluded)))
+        record_usage("search", seconds=search_span.duration)
+        _log_search_done(collector, excluded[0], len(evaluator.batches))
+        with span("evaluate_relevance"):
+            submit(collector.flush())
+            return evaluator.collect()
+
+
+async def _search_and_evaluate_async(search_request: SearchRequest, queries, collector: _ResultCollector,
+                                     excluded: list) -> List[Dict]:
+    """_search_and_evaluate 的异步版本"""
+    evaluator = _AsyncBatchEvaluator(search_request.search_purpose)
+    with ExitStack() as evaluate_scope:
+
+        def submit(batches):
+            if batches and not evaluator.batches:
+                evaluate_scope.enter_context(stage_budget("evaluate"))
+            evaluator.submit(batches)
+
+        try:
+            with span("search_api_calls", queries=len(queries)) as search_span:
+                await _run_searches_async(queries, search_request.time_page,
+                                          lambda results: submit(_excluding_blacklist(results, collector, excluded)))
+            record_usage("search", seconds=search_span.duration)
+            _log_search_done(collector, excluded[0], len(evaluator.batches))
+            with span("evaluate_relevance"):
+                submit(collector.flush())
+                return await evaluator.collect()
+        except asyncio.CancelledError:
+            for task in evaluator.tasks:
+                task.cancel()
+            raise
+
+
+def _log_search_done(collector: _ResultCollector, excluded: int, started: int) -> None:
+    logger.info(f"搜索完成,处理后共有 {len(collector.results)} 个结果,黑名单排除了{excluded}个结果"
+                + (f",其中 {started} 批已在搜索期间开始评估" if started else ""))
+
+
+@traced("search_ai")
 def search_ai(search_request: SearchRequest, deep: bool = True) -> SearchResults:
 
     if deep:
@@ -166,54 +541,16 @@ def search_ai(search_request: SearchRequest, deep: bool = True) -> SearchResults
     else:
         logger.info("简易搜索模式")
     # time.sleep(10)
-    start_time = time.time()
-    # 对搜索引擎返回的内容进行去重得到的结果
-    new_results = []
     max_search_results = search_request.max_search_results
     search_purpose = search_request.search_purpose
-    time_page = search_request.time_page
     logger.info(f"开始搜索 - 目的: {search_purpose}")
-    
-    with ThreadPoolExecutor(max_workers=config.SEARCH_API_LIMIT) as executor:
-        futures = []
-        for data in search_request.query_keys:
-            query = data.key
-            language = data.language
-            logger.info(f"搜索关键词: {query}, 语言: {language}, 时间范围: {time_page}")
-            if query and language:
-                futures.append(executor.submit(search_api_worker, query, language, time_page))
-        
-        # 收集搜索结果
-        for future in futures:
-            try:
-                results = future.result()
-                
-                # 添加结果,同时进行去重
-                for result in results:
-                    if not is_duplicate(result, new_results):
-                        new_results.append(result)
-            except Exception as e:
-                logger.error(f"处理搜索结果时出错: {str(e)}")
-                logger.error(traceback.format_exc())
-    if URL_BLACKLIST:
-        unique_results = [
-            result for result in new_results
-            if not any(result.get('url').startswith(prefix) for prefix in URL_BLACKLIST)
-        ]
-    else:
-        unique_results = new_results
-    
-    logger.info(f"搜索完成,处理后共有 {len(unique_results)} 个结果,黑名单排除了{len(new_results)-len(unique_results)}个结果")
-    if len(unique_results) > 50:
-        unique_results = unique_results[:50]
-        logger.info("搜索结果过多,仅取前50个结果")
-    if not unique_results:
-        logger.warning("没有找到任何搜索结果")
-        return {}
-    
+
     try:
-        # 评估结果的相关性和重要性
-        results_score_all = evaluate_relevance(search_purpose, unique_results)
+        # 搜索并评估结果的相关性和重要性
+        results_score_all = _search_and_evaluate(search_request)
+        if not results_score_all:
+            logger.warning("没有找到任何搜索结果")
+            return {}
         top_results = sorted(results_score_all, key=lambda x:x['relevance_score'], reverse=True)
         top_results = top_results[:max_search_results:]
         for result in top_results:
@@ -235,8 +572,7 @@ def search_ai(search_request: SearchRequest, deep: bool = True) -> SearchResults
         return {}
     if deep:
         deepscan_results = deepscan(top_results, search_request)
-        search_time = time.time() - start_time
-        logger.info(f"搜索耗时: {search_time:.2f} 秒")
+        logger.info(f"搜索耗时: {current_span().duration:.2f} 秒")
         
         return deepscan_results
     else:
@@ -251,31 +587,47 @@ def search_ai(search_request: SearchRequest, deep: bool = True) -> SearchResults
         return search_results
 
 
+def fetch_contents(search_response: list, search_purpose: str) -> list:
+    """并发抓取并压缩各结果的网页内容,按输入顺序返回,失败的为 None"""
+    if config.ASYNC_FANOUT:
+        return run_async(_gather_results(
+            (compress_url_content_async(result['url'], search_purpose, result['title'] + "\n" + result['content'])
+             for result in search_response),
+            lambda idx: f"获取URL内容失败 ({search_response[idx]['url']})"))
+
+    # 使用多线程并发处理URL内容获取
+    with ThreadPoolExecutor(max_workers=config.CRAWL_THREAD_NUM) as executor, cancel_pending_futures(executor):
+        futures = {}
+        for i, result in enumerate(search_response):
+            url = result['url']
+            title = result['title'] + "\n" + result['content']
+            futures[submit_tracked("crawl", executor, compress_url_content, url, search_purpose, title)] = i
+        
+        # 收集结果并处理可能的错误
+        url_contents = [None] * len(search_response)
+        for future in futures:
+            raise_if_cancelled()
+            idx = futures[future]
+            try:
+                url_contents[idx] = wait_result(future)
+            except DeadlineExceeded:
+                logger.warning(f"未在时间预算内获取URL内容,已放弃 ({search_response[idx]['url']})")
+            except Exception as e:
+                logger.error(f"获取URL内容失败 ({search_response[idx]['url']}): {str(e)}")
+                logger.error(traceback.format_exc())
+                url_contents[idx] = None
+    return url_contents
+
+
+@traced("deepscan")
 def deepscan(search_response: list, search_request: SearchRequest) -> SearchResults:
     """获取网页的内容"""
     logger.info(f"开始深度扫描 {len(search_response)} 个URL")
     search_results_deepscan = SearchResults(search_request=search_request)
     search_purpose = search_request.search_purpose
-    # 使用多线程并发处理URL内容获取
     if search_response:
-        with ThreadPoolExecutor(max_workers=config.CRAWL_THREAD_NUM) as executor:
-            futures = {}
-            for i, result in enumerate(search_response):
-                url = result['url']
-                title = result['title'] + "\n" + result['content']
-                futures[executor.submit(compress_url_content, url, search_purpose, title)] = i
-            
-            # 收集结果并处理可能的错误
-            url_contents = [None] * len(search_response)
-            for future in futures:
-                idx = futures[future]
-                try:
-                    url_contents[idx] = future.result()
-                except Exception as e:
-                    logger.error(f"获取URL内容失败 ({search_response[idx]['url']}): {str(e)}")
-                    logger.error(traceback.format_exc())
-                    url_contents[idx] = None
-    
+        with stage_budget("crawl"):
+            url_contents = fetch_contents(search_response, search_purpose)
         logger.info("URL内容获取完毕")
         
         # 准备结构化结果
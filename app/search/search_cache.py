@@ -0,0 +1,166 @@
+"""
+搜索结果缓存: 深度研究的多个步骤、不同用户之间经常发出几乎相同的搜索,
+相同的 (查询词, 语言, 时间范围, 搜索后端) 在有效期内直接复用上次的结果。
+内存中的 LRU 在前,磁盘上的 SQLite 在后,重启后磁盘中的结果仍然可用。
+有效期按时间范围区分: 限定最近几天的搜索结果变化快,有效期短;不限时间的有效期长。
+"""
+from collections import OrderedDict
+import hashlib
+import json
+from pathlib import Path
+import sqlite3
+import sys
+import time
+from threading import Lock
+from typing import Optional
+
+# 将项目根目录添加到sys.path
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from app.utils.metrics import SEARCH_CACHE
+from config import base_config as config
+from config.logging_config import logger
+
+DB_NAME = "search_cache.sqlite3"
+TIME_WINDOWS = ("day", "month", "year")
+
+
+def parse_cache_ttls(raw: str) -> dict[str, float]:
+    """解析 SEARCH_CACHE_TTLS,格式为 时间范围=秒数,多个用逗号分隔"""
+    ttls = {}
+    for item in raw.split(","):
+        name, sep, value = item.strip().partition("=")
+        if not sep:
+            continue
+        try:
+            ttls[name.strip()] = float(value)
+        except ValueError:
+            logger.warning(f"SEARCH_CACHE_TTLS 中的 {item.strip()} 格式有误,已忽略")
+    return ttls
+
+
+def time_window(time_page) -> str:
+    """time_page 为 [天, 月, 年],取最大的非零单位作为时间范围,都为 0 时为 any(不限时间)"""
+    window = "any"
+    for name, value in zip(TIME_WINDOWS, time_page or ()):
+        if value:
+            window = name
+    return window
+
+
+def cache_ttl(time_page) -> float:
+    return parse_cache_ttls(config.SEARCH_CACHE_TTLS).get(time_window(time_page), 0.0)
+
+
+def normalize_query(query: str) -> str:
+    """大小写与空白字符不同的查询视为同一个"""
+    return " ".join(str(query).split()).casefold()
+
+
+def search_cache_key(query: str, language: str, time_page, backend: str) -> str:
+    raw = json.dumps([normalize_query(query), language or "", list(time_page or ()), backend], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SearchCache:
+    """两级缓存,线程安全;值为搜索后端返回的结果列表"""
+
+    def __init__(self):
+        self._items: "OrderedDict[str, tuple[float, list]]" = OrderedDict()
+        self._lock = Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_path: Optional[Path] = None
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        """磁盘缓存的连接,SEARCH_CACHE_DIR 为空时只使用内存缓存;配置变化后重新打开。需持有 _lock"""
+        path = Path(config.SEARCH_CACHE_DIR) if config.SEARCH_CACHE_DIR else None
+        if path is not None and not path.is_absolute():
+            path = ROOT_DIR / path
+        if path != self._db_path:
+            if self._db is not None:
+                self._db.close()
+            self._db, self._db_path = None, path
+            if path is not None:
+                try:
+                    path.mkdir(parents=True, exist_ok=True)
+                    db = sqlite3.connect(path / DB_NAME, check_same_thread=False)
+                    db.execute("PRAGMA journal_mode=WAL")
+                    db.execute("CREATE TABLE IF NOT EXISTS search_cache "
+                               "(key TEXT PRIMARY KEY, expires_at REAL NOT NULL, results TEXT NOT NULL)")
+                    db.execute("DELETE FROM search_cache WHERE expires_at < ?", (time.time(),))
+                    db.commit()
+                    self._db = db
+                    logger.info(f"搜索缓存已打开: {path / DB_NAME}")
+                except (OSError, sqlite3.Error) as e:
+                    logger.warning(f"无法打开搜索缓存 {path / DB_NAME},只使用内存缓存: {e}")
+        return self._db
+
+    def _remember(self, key: str, expires_at: float, results: list) -> None:
+        """写入内存缓存并淘汰最久未使用的,需持有 _lock"""
+        self._items[key] = (expires_at, results)
+        self._items.move_to_end(key)
+        while len(self._items) > max(config.SEARCH_CACHE_SIZE, 1):
+            self._items.popitem(last=False)
+
+    def get(self, key: str) -> Optional[list]:
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                if item[0] >= now:
+                    self._items.move_to_end(key)
+                    SEARCH_CACHE.inc(tier="memory")
+                    return item[1]
+                del self._items[key]
+            db = self._connection()
+            if db is not None:
+                try:
+                    row = db.execute("SELECT expires_at, results FROM search_cache WHERE key = ?", (key,)).fetchone()
+                    if row is not None and row[0] >= now:
+                        results = json.loads(row[1])
+                        self._remember(key, row[0], results)
+                        SEARCH_CACHE.inc(tier="disk")
+                        return results
+                except (sqlite3.Error, ValueError) as e:
+                    logger.warning(f"读取搜索缓存失败: {e}")
+        SEARCH_CACHE.inc(tier="miss")
+        return None
+
+    def put(self, key: str, results: list, ttl: float) -> None:
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._remember(key, expires_at, results)
+            db = self._connection()
+            if db is not None:
+                try:
+                    db.execute("INSERT OR REPLACE INTO search_cache (key, expires_at, results) VALUES (?, ?, ?)",
+                               (key, expires_at, json.dumps(results, ensure_ascii=False)))
+                    db.commit()
+                except (sqlite3.Error, TypeError, ValueError) as e:
+                    logger.warning(f"写入搜索缓存失败: {e}")
+
+
+SEARCH_RESULT_CACHE = SearchCache()
+
+
+def cached_results(query: str, language: str, time_page, backend: str) -> tuple[Optional[str], Optional[list]]:
+    """
+    查询缓存,返回 (缓存键, 结果)。
+    该时间范围未开启缓存时缓存键为 None;未命中时结果为 None。
+    """
+    if cache_ttl(time_page) <= 0:
+        return None, None
+    key = search_cache_key(query, language, time_page, backend)
+    results = SEARCH_RESULT_CACHE.get(key)
+    if results is not None:
+        logger.info(f"搜索缓存命中: '{query}' ({backend})")
+    return key, results
+
+
+def store_results(key: Optional[str], results, time_page) -> None:
+    """写入缓存,空结果(多半是搜索失败)不缓存"""
+    if key is None or not results or not isinstance(results, list):
+        return
+    SEARCH_RESULT_CACHE.put(key, results, cache_ttl(time_page))
@@ -1,9 +1,13 @@
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, wait
+import httpx
 import requests
 import re  
 import traceback
-import time
 import sys
+import time
 from pathlib import Path
+from urllib.parse import urlsplit
 
 ROOT_DIR = Path(__file__).resolve().parent.parent.parent
 if str(ROOT_DIR) not in sys.path:
@@ -11,46 +15,220 @@ if str(ROOT_DIR) not in sys.path:
 
 from config.logging_config import logger
 from config import base_config as config
+from app.search import searxng_pool
+from app.search.backends import SearchBackend, register_backend, route
+from app.search.search_cache import cached_results, store_results
+from app.utils.metrics import RETRIES, SEARCH_LATENCY, SEARCH_REQUESTS, SEARXNG_PAGES, submit_tracked
+from app.utils.request_context import (DeadlineExceeded, out_of_time, raise_if_cancelled, shared_executor, span,
+                                       time_left, timeout_for)
+from app.utils.http_client import get_async_client, get_session
+from app.utils.key_pool import use_key
+from app.utils.rate_limit import throttle, throttle_async
+from app.utils.resilience import BackendUnavailable, backoff, backoff_async, guarded
 
 # 黑名单文件路径 (假设在项目根目录)
 BLACKLIST_FILE = ROOT_DIR / 'blacklist.txt'
 # 日志配置在 config/logging_config.py 中统一管理
 
 MAX_RETRIES = 3  # 最大重试次数
+POLL_INTERVAL = 0.5  # 同时查询多个后端时,检查请求是否已取消的间隔(秒)
+TAVILY_URL = "https://api.tavily.com/search"
 # if not SEARXNG_URL:
 #     SEARXNG_URL = "https://seek.nuer.cc/"
 #     logger.warning(f"未在环境变量中找到 SEARXNG_URL, 使用默认值: {SEARXNG_URL} (不保证长期可用)")
 
-def by_searxng(query, language, time_page = [0,0,0]):
+# SearXNG 支持的时间范围及其覆盖的天数
+SEARXNG_TIME_RANGES = (("day", 1), ("week", 7), ("month", 31), ("year", 366))
+
+def _searxng_time_range(time_page):
+    """time_page 为 [天, 月, 年],表示最近多长时间;取能覆盖它的最小 SearXNG 时间范围,不限时间或超过一年时为 None"""
+    days, months, years = (list(time_page or ()) + [0, 0, 0])[:3]
+    span_days = days + months * 31 + years * 366
+    if span_days <= 0:
+        return None
+    for time_range, limit in SEARXNG_TIME_RANGES:
+        if span_days <= limit:
+            return time_range
+    return None
+
+def _searxng_params(query, language, time_page):
     params = {
         'q': query,
         'format': 'json',
         'language': language,
-        'time_page': time_page,
+        'pageno': 1,
         "engines": "bing,duckduckgo,google,wikipedia",
     }
+    time_range = _searxng_time_range(time_page)
+    if time_range:
+        params['time_range'] = time_range
+    return params
+
+def _tavily_payload(query, time_page):
+    time_range = None
+    time_page2time_range = {
+        0:"d",
+        1:"m",
+        2:"y"
+    }
+    for i, j in enumerate(time_page):
+        time_range = time_page2time_range[i] if j else time_range
+    if time_page[0] >= 7 and sum(time_page[1:]) == 0:
+        time_range = 'w'
+
+    return {
+        "query": query,
+        "topic": "general",
+        "search_depth": "basic",
+        "chunks_per_source": 3,
+        "max_results": config.TAVILY_MAX_NUM,
+        "time_range": time_range,
+        "include_raw_content": False,
+        "country": None
+    }
+
+def _search_status(error):
+    if isinstance(error, BackendUnavailable):
+        return "unavailable"
+    return "deadline" if isinstance(error, DeadlineExceeded) else "error"
+
+def _join_pages(results_by_page):
+    """按页码顺序拼接各页结果,相同网址只保留靠前的一个"""
+    return merge_results([[result for pageno in sorted(results_by_page) for result in results_by_page[pageno]]])
+
+def _extra_pages(query, results):
+    """第一页不重复的结果少于 SEARXNG_MIN_RESULTS 时需要额外请求的页码;第一页没有结果时不再翻页"""
+    if not results or len(_join_pages({1: results})) >= config.SEARXNG_MIN_RESULTS:
+        return []
+    pages = list(range(2, config.SEARXNG_MAX_PAGES + 1))
+    if pages:
+        logger.info(f"'{query}' 第一页只有 {len(results)} 条结果,同时请求第 {pages[0]}-{pages[-1]} 页")
+    return pages
+
+def _page_done(query, pageno, error):
+    if error is not None:
+        SEARCH_REQUESTS.inc(backend="searxng", status=_search_status(error))
+        SEARXNG_PAGES.inc(status="error")
+        logger.warning(f"获取 '{query}' 的第 {pageno} 页搜索结果失败: {error}")
+    else:
+        SEARXNG_PAGES.inc(status="used")
+
+def _pages_skipped(query, pending_pages):
+    if pending_pages:
+        SEARXNG_PAGES.inc(len(pending_pages), status="skipped")
+        reason = "超出时间预算" if out_of_time() else "结果已足够"
+        logger.info(f"'{query}' {reason},不再等待第 {', '.join(map(str, sorted(pending_pages)))} 页")
+
+def _fetch_page(params, pageno):
+    throttle("searxng")
+    with SEARCH_LATENCY.time(backend="searxng"):
+        results = searxng_pool.search({**params, 'pageno': pageno})
+    SEARCH_REQUESTS.inc(backend="searxng", status="ok")
+    return results
+
+async def _fetch_page_async(params, pageno):
+    await throttle_async("searxng")
+    with SEARCH_LATENCY.time(backend="searxng"):
+        results = await searxng_pool.search_async({**params, 'pageno': pageno})
+    SEARCH_REQUESTS.inc(backend="searxng", status="ok")
+    return results
+
+def _more_pages(query, params, results):
+    """
+    冷门查询第一页结果太少时并行请求后续页(各页分别选择实例),
+    拼接去重后的结果达到 SEARXNG_MIN_RESULTS 条即返回,不再等待其余页;后续页出错时忽略该页
+    """
+    pages = _extra_pages(query, results)
+    if not pages:
+        return results
+    results_by_page = {1: results}
+    executor = shared_executor("searxng-pages", config.SEARCH_FANOUT_THREADS)
+    pending = {}
+    try:
+        for pageno in pages:
+            pending[submit_tracked("searxng_pages", executor, _fetch_page, params, pageno)] = pageno
+        while pending and len(_join_pages(results_by_page)) < config.SEARXNG_MIN_RESULTS:
+            raise_if_cancelled()
+            if out_of_time():
+                break
+            left = time_left()
+            done, _ = wait(pending, timeout=POLL_INTERVAL if left is None else min(left, POLL_INTERVAL),
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                pageno = pending.pop(future)
+                error = future.exception()
+                if error is None:
+                    results_by_page[pageno] = future.result()
+                _page_done(query, pageno, error)
+        _pages_skipped(query, pending.values())
+    finally:
+        for future in pending:
+            future.cancel()
+    return _join_pages(results_by_page)
+
+async def _more_pages_async(query, params, results):
+    """_more_pages 的异步版本,结果足够后取消其余页的请求"""
+    pages = _extra_pages(query, results)
+    if not pages:
+        return results
+    results_by_page = {1: results}
+    tasks = {asyncio.ensure_future(_fetch_page_async(params, pageno)): pageno for pageno in pages}
+    pending = set(tasks)
+    try:
+        while pending and len(_join_pages(results_by_page)) < config.SEARXNG_MIN_RESULTS:
+            left = time_left()
+            done, pending = await asyncio.wait(pending, timeout=None if left is None else max(left, 0),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                error = task.exception()
+                if error is None:
+                    results_by_page[tasks[task]] = task.result()
+                _page_done(query, tasks[task], error)
+        _pages_skipped(query, [tasks[task] for task in pending])
+    finally:
+        for task in pending:
+            task.cancel()
+    return _join_pages(results_by_page)
+
+def by_searxng(query, language, time_page = [0,0,0]):
+    params = _searxng_params(query, language, time_page)
 
     retry_count = 0
     while retry_count < MAX_RETRIES:
         try:
             logger.info(f"正在搜索: '{query}' (语言:{language}, 时间页:{time_page})")
-            response = requests.get(config.SEARXNG_URL, params=params, timeout=15)
-            response.raise_for_status() # 检查 HTTP 错误状态码
+            throttle("searxng")
+            # 选择实例、熔断与对冲见 searxng_pool
+            with SEARCH_LATENCY.time(backend="searxng"):
+                results = searxng_pool.search(params)
+            SEARCH_REQUESTS.inc(backend="searxng", status="ok")
+            return _more_pages(query, params, results)
 
-            results = response.json().get('results', [])
-            return results
+        except BackendUnavailable as e:
+            SEARCH_REQUESTS.inc(backend="searxng", status="unavailable")
+            logger.warning(f"搜索关键词 '{query}' 失败: {e}")
+            return []
+
+        except DeadlineExceeded as e:
+            SEARCH_REQUESTS.inc(backend="searxng", status="deadline")
+            logger.warning(f"搜索关键词 '{query}' 失败: {e}")
+            return []
 
         except requests.exceptions.RequestException as e: # 更具体的网络异常捕获
+            SEARCH_REQUESTS.inc(backend="searxng", status="error")
             retry_count += 1
-            wait_time = 1 # 简单的固定等待时间，可以考虑指数退避
             logger.debug(f"搜索关键词 '{query}' 时发生网络错误: {str(e)}. "
                       f"尝试次数 {retry_count}/{MAX_RETRIES}. "
-                      f"{f'等待 {wait_time} 秒后重试...' if retry_count < MAX_RETRIES else '已达最大重试次数.'}")
+                      f"{'稍后重试...' if retry_count < MAX_RETRIES else '已达最大重试次数.'}")
             logger.debug(traceback.format_exc())
             if retry_count < MAX_RETRIES:
-                time.sleep(wait_time)
+                RETRIES.inc(stage="search", backend="searxng", model="")
+                backoff(retry_count - 1)
         except Exception as e: # 捕获其他可能的异常 (如 JSON 解析错误)
              # 对于非网络错误，通常不需要重试
+            SEARCH_REQUESTS.inc(backend="searxng", status="error")
             logger.error(f"处理关键词 '{query}' 的搜索结果时发生意外错误: {str(e)}")
             logger.error(traceback.format_exc())
             return [] # 出现意外错误，返回空列表
@@ -60,30 +238,8 @@ def by_searxng(query, language, time_page = [0,0,0]):
     return []
 
 def by_tavily(query, language, time_page = [0,0,0]):
-    time_range = None
-    time_page2time_range = {
-        0:"d",
-        1:"m",
-        2:"y"
-    }
-    for i, j in enumerate(time_page):
-        time_range = time_page2time_range[i] if j else time_range
-    if time_page[0] >= 7 and sum(time_page[1:]) == 0:
-        time_range = 'w'
-
-    TAVILY_URL = "https://api.tavily.com/search"
-    payload = {
-        "query": query,
-        "topic": "general",
-        "search_depth": "basic",
-        "chunks_per_source": 3,
-        "max_results": config.TAVILY_MAX_NUM,
-        "time_range": time_range,
-        "include_raw_content": False,
-        "country": None
-    }
+    payload = _tavily_payload(query, time_page)
     headers = {
-        "Authorization": f"Bearer {config.TAVILY_KEY}",
         "Content-Type": "application/json"
     }
 
@@ -91,23 +247,40 @@ def by_tavily(query, language, time_page = [0,0,0]):
     while retry_count < MAX_RETRIES:
         try:
             logger.info(f"Tavily 正在搜索: '{query}'")
-            response = requests.post(TAVILY_URL, headers=headers, json=payload, timeout=15)
-            response.raise_for_status() # 检查 HTTP 错误状态码
+            throttle("tavily")
+            with guarded("tavily"), SEARCH_LATENCY.time(backend="tavily"), \
+                    use_key("tavily", config.TAVILY_KEYS) as lease:
+                response = get_session().post(TAVILY_URL, headers={**headers, "Authorization": f"Bearer {lease.key}"},
+                                              json=payload, timeout=timeout_for(15))
+                response.raise_for_status() # 检查 HTTP 错误状态码
 
-            results = response.json().get('results', [])
+                results = response.json().get('results', [])
+            SEARCH_REQUESTS.inc(backend="tavily", status="ok")
             return results
 
+        except BackendUnavailable as e:
+            SEARCH_REQUESTS.inc(backend="tavily", status="unavailable")
+            logger.warning(f"搜索关键词 '{query}' 失败: {e}")
+            return []
+
+        except DeadlineExceeded as e:
+            SEARCH_REQUESTS.inc(backend="tavily", status="deadline")
+            logger.warning(f"搜索关键词 '{query}' 失败: {e}")
+            return []
+
         except requests.exceptions.RequestException as e: # 更具体的网络异常捕获
+            SEARCH_REQUESTS.inc(backend="tavily", status="error")
             retry_count += 1
-            wait_time = 1 # 简单的固定等待时间，可以考虑指数退避
             logger.debug(f"搜索关键词 '{query}' 时发生网络错误: {str(e)}. "
                       f"尝试次数 {retry_count}/{MAX_RETRIES}. "
-                      f"{f'等待 {wait_time} 秒后重试...' if retry_count < MAX_RETRIES else '已达最大重试次数.'}")
+                      f"{'稍后重试...' if retry_count < MAX_RETRIES else '已达最大重试次数.'}")
             logger.debug(traceback.format_exc())
             if retry_count < MAX_RETRIES:
-                time.sleep(wait_time)
+                RETRIES.inc(stage="search", backend="tavily", model="")
+                backoff(retry_count - 1)
         except Exception as e: # 捕获其他可能的异常 (如 JSON 解析错误)
              # 对于非网络错误，通常不需要重试
+            SEARCH_REQUESTS.inc(backend="tavily", status="error")
             logger.error(f"处理关键词 '{query}' 的搜索结果时发生意外错误: {str(e)}")
             logger.error(traceback.format_exc())
             return [] # 出现意外错误，返回空列表
@@ -116,17 +289,233 @@ def by_tavily(query, language, time_page = [0,0,0]):
     logger.error(f"搜索关键词 '{query}' 失败，已重试 {MAX_RETRIES} 次。")
     return []
 
+async def _search_async(backend, query, fetch):
+    """异步搜索的公共流程: 速率限制、网络错误重试,fetch 发出请求并返回结果列表"""
+    for attempt in range(MAX_RETRIES):
+        try:
+            logger.info(f"{backend} 正在搜索: '{query}'")
+            await throttle_async(backend)
+            with SEARCH_LATENCY.time(backend=backend):
+                results = await fetch()
+            SEARCH_REQUESTS.inc(backend=backend, status="ok")
+            return results
+
+        except BackendUnavailable as e:
+            SEARCH_REQUESTS.inc(backend=backend, status="unavailable")
+            logger.warning(f"搜索关键词 '{query}' 失败: {e}")
+            return []
+
+        except DeadlineExceeded as e:
+            SEARCH_REQUESTS.inc(backend=backend, status="deadline")
+            logger.warning(f"搜索关键词 '{query}' 失败: {e}")
+            return []
+
+        except httpx.HTTPError as e:
+            SEARCH_REQUESTS.inc(backend=backend, status="error")
+            logger.debug(f"搜索关键词 '{query}' 时发生网络错误: {str(e)}. 尝试次数 {attempt + 1}/{MAX_RETRIES}.")
+            if attempt + 1 < MAX_RETRIES:
+                RETRIES.inc(stage="search", backend=backend, model="")
+                await backoff_async(attempt)
+        except Exception as e:
+            SEARCH_REQUESTS.inc(backend=backend, status="error")
+            logger.error(f"处理关键词 '{query}' 的搜索结果时发生意外错误: {str(e)}")
+            return []
+
+    logger.error(f"搜索关键词 '{query}' 失败，已重试 {MAX_RETRIES} 次。")
+    return []
+
+async def by_searxng_async(query, language, time_page = [0,0,0]):
+    params = _searxng_params(query, language, time_page)
+    results = await _search_async("searxng", query, lambda: searxng_pool.search_async(params))
+    return await _more_pages_async(query, params, results)
+
+async def by_tavily_async(query, language, time_page = [0,0,0]):
+    payload = _tavily_payload(query, time_page)
+
+    async def fetch():
+        with guarded("tavily"), use_key("tavily", config.TAVILY_KEYS) as lease:
+            response = await get_async_client().post(
+                TAVILY_URL, headers={"Content-Type": "application/json", "Authorization": f"Bearer {lease.key}"},
+                json=payload, timeout=timeout_for(15))
+            response.raise_for_status()  # 429 由 use_key 让密钥进入冷却
+            return response.json().get('results', [])
+
+    return await _search_async("tavily", query, fetch)
+
+class SearxngBackend(SearchBackend):
+    name = "searxng"
+    time_filter = True
+    page_size = 20
+
+    def configured(self):
+        return bool(config.SEARXNG_URLS)
+
+    def available(self):
+        # 每个实例各有熔断器,至少一个可用即可
+        return searxng_pool.available()
+
+    def search(self, query, language, time_page):
+        return by_searxng(query, language, time_page)
+
+    async def search_async(self, query, language, time_page):
+        return await by_searxng_async(query, language, time_page)
+
+class TavilyBackend(SearchBackend):
+    name = "tavily"
+    cost = 1.0  # 按次计费
+    time_filter = True
+    raw_content = True
+
+    @property
+    def page_size(self):
+        return config.TAVILY_MAX_NUM
+
+    def configured(self):
+        return bool(config.TAVILY_KEY)
+
+    def search(self, query, language, time_page):
+        return by_tavily(query, language, time_page)
+
+    async def search_async(self, query, language, time_page):
+        return await by_tavily_async(query, language, time_page)
+
+# 注册顺序即 priority 路由的优先级
+register_backend(SearxngBackend())
+register_backend(TavilyBackend())
+
+def _url_key(url):
+    parts = urlsplit(url.strip())
+    return f"{parts.netloc.lower()}{parts.path.rstrip('/')}?{parts.query}"
+
+def merge_results(results_by_backend):
+    """按各后端的排名交替合并结果,相同网址只保留排名靠前的一个"""
+    lists = [results for results in results_by_backend if results]
+    merged, seen = [], set()
+    for rank in range(max((len(results) for results in lists), default=0)):
+        for results in lists:
+            if rank >= len(results):
+                continue
+            result = results[rank]
+            key = _url_key(result['url']) if result.get('url') else None
+            if key in seen:
+                continue
+            if key is not None:
+                seen.add(key)
+            merged.append(result)
+    return merged
+
+def _enough(results_by_backend):
+    """race 模式下是否已有足够的不重复结果,可以不再等待其余后端"""
+    return config.SEARCH_PROVIDER_MODE == "race" and \
+        len(merge_results(results_by_backend.values())) >= config.SEARCH_RACE_MIN_RESULTS
+
+def _search_one(backend, query, language, time_page):
+    key, results = cached_results(query, language, time_page, backend.name)
+    if results is not None:
+        return results
+    logger.info(f"使用 {backend.name} Search API")
+    start = time.perf_counter()
+    with span("search_api", backend=backend.name, query=query):
+        results = backend.search(query, language, time_page)
+    backend.stats.record(time.perf_counter() - start, bool(results))
+    store_results(key, results, time_page)
+    return results
+
+async def _search_one_async(backend, query, language, time_page):
+    # 缓存是本地 SQLite,读写耗时很短,直接在事件循环中执行
+    key, results = cached_results(query, language, time_page, backend.name)
+    if results is not None:
+        return results
+    logger.info(f"使用 {backend.name} Search API")
+    start = time.perf_counter()
+    with span("search_api", backend=backend.name, query=query):
+        results = await backend.search_async(query, language, time_page)
+    backend.stats.record(time.perf_counter() - start, bool(results))
+    store_results(key, results, time_page)
+    return results
+
+def _search_all(backends, query, language, time_page):
+    """同时查询多个后端并合并结果;race 模式下结果足够时不再等待较慢的后端"""
+    results_by_backend = {}
+    executor = shared_executor("search-backends", config.SEARCH_FANOUT_THREADS)
+    pending = {}
+    try:
+        for backend in backends:
+            pending[submit_tracked("search_backends", executor, _search_one, backend, query, language,
+                                   time_page)] = backend.name
+        while pending and not _enough(results_by_backend):
+            raise_if_cancelled()
+            if out_of_time():
+                logger.warning(f"搜索 '{query}' 时 {', '.join(pending.values())} 未在时间预算内返回,已放弃")
+                break
+            left = time_left()
+            done, _ = wait(pending, timeout=POLL_INTERVAL if left is None else min(left, POLL_INTERVAL),
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    results_by_backend[name] = future.result()
+                except Exception as e:
+                    logger.error(f"{name} 搜索 '{query}' 时出错: {str(e)}")
+        if pending and not out_of_time():
+            logger.info(f"已有足够的搜索结果,不再等待 {', '.join(pending.values())}: '{query}'")
+    finally:
+        # 不等待仍在进行的后端,它们完成后结果照常写入缓存;还在排队的直接取消
+        for future in pending:
+            future.cancel()
+    return merge_results(results_by_backend[backend.name] for backend in backends
+                         if backend.name in results_by_backend)
+
+async def _search_all_async(backends, query, language, time_page):
+    """_search_all 的异步版本,race 模式下取消较慢的后端"""
+    tasks = {asyncio.ensure_future(_search_one_async(backend, query, language, time_page)): backend.name
+             for backend in backends}
+    results_by_backend = {}
+    pending = set(tasks)
+    try:
+        while pending and not _enough(results_by_backend):
+            left = time_left()
+            done, pending = await asyncio.wait(pending, timeout=None if left is None else max(left, 0),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                logger.warning(f"搜索 '{query}' 时 {', '.join(tasks[task] for task in pending)} "
+                               f"未在时间预算内返回,已放弃")
+                break
+            for task in done:
+                if task.exception() is not None:
+                    logger.error(f"{tasks[task]} 搜索 '{query}' 时出错: {str(task.exception())}")
+                else:
+                    results_by_backend[tasks[task]] = task.result()
+        if pending and not out_of_time():
+            logger.info(f"已有足够的搜索结果,取消 {', '.join(tasks[task] for task in pending)}: '{query}'")
+    finally:
+        for task in pending:
+            task.cancel()
+    return merge_results(results_by_backend[backend.name] for backend in backends
+                         if backend.name in results_by_backend)
+
 # --- 搜索工作函数 ---
 def search_api_worker(query, language = "all", time_page = [0,0,0]):
-    results = ""
-    if config.SEARXNG_URL:
-        logger.info(f"使用SeaXNG Search API")
-        results = by_searxng(query=query,language=language,time_page=time_page)
-    elif config.TAVILY_KEY:
-        logger.info(f"使用Tavily Search API")
-        results = by_tavily(query=query,language=language,time_page=time_page)
+    """
+    按 SEARCH_PROVIDER_MODE 搜索: fallback 只用按 SEARCH_ROUTING 选出的最合适的后端;
+    all 同时查询全部后端并合并去重;race 同样同时查询,但不重复结果足够时立即返回
+    """
+    backends = route(query, language, time_page)
+    if not backends:
+        return ""
+    if config.SEARCH_PROVIDER_MODE == "fallback" or len(backends) == 1:
+        return _search_one(backends[0], query, language, time_page)
+    return _search_all(backends, query, language, time_page)
+
+async def search_api_worker_async(query, language = "all", time_page = [0,0,0]):
+    """search_api_worker 的异步版本"""
+    backends = route(query, language, time_page)
+    if not backends:
+        return ""
+    if config.SEARCH_PROVIDER_MODE == "fallback" or len(backends) == 1:
+        return await _search_one_async(backends[0], query, language, time_page)
+    return await _search_all_async(backends, query, language, time_page)
 
-    return results
 # --- 示例用法 (如果需要直接运行此文件测试) ---
 if __name__ == "__main__":
     # 配置日志记录器
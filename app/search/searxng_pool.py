@@ -0,0 +1,214 @@
+"""
+多个 SearXNG 实例: SEARXNG_URL 可填写多个地址(逗号分隔),每次搜索选择进行中请求最少、近期延迟最低的实例,
+每个实例有独立的熔断器。开启 SEARXNG_HEDGE 后,首个实例超过其近期 p90 延迟仍未返回时,
+向另一个实例发出相同的查询,取先返回的结果,缓解上游搜索引擎限流造成的长尾延迟。
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from pathlib import Path
+import sys
+import time
+from threading import Lock
+from typing import Optional
+from urllib.parse import urlsplit
+
+# 将项目根目录添加到sys.path
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from app.utils.http_client import get_async_client, get_session
+from app.utils.metrics import Counter, Gauge, submit_tracked
+from app.utils.request_context import shared_executor, time_left, timeout_for
+from app.utils.resilience import BackendUnavailable, guarded, is_available
+from config import base_config as config
+from config.logging_config import logger
+
+SEARCH_TIMEOUT = 15
+LATENCY_WINDOW = 200  # 每个实例保留最近多少次成功请求的耗时,用于计算 p90
+MIN_SAMPLES = 20  # 样本少于这个数时使用 SEARXNG_HEDGE_DELAY 作为对冲等待时间
+EWMA_ALPHA = 0.2
+
+
+class SearxngInstance:
+    """一个 SearXNG 实例的负载与延迟统计,线程安全"""
+
+    def __init__(self, url: str, name: str):
+        self.url = url
+        self.name = name  # 熔断器与指标使用的名称
+        self.in_flight = 0
+        self.ewma = 0.0
+        self._latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        self._lock = Lock()
+
+    @contextmanager
+    def track(self):
+        """
+        统计进行中的请求数;成功时记录耗时,出错时按超时时间计入平均延迟,使选择暂时避开该实例。
+        被取消的请求(如对冲中较慢的一方)不计入统计。
+        """
+        with self._lock:
+            self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self._record(max(time.perf_counter() - start, SEARCH_TIMEOUT))
+            raise
+        except BaseException:
+            self._record(None)
+            raise
+        self._record(time.perf_counter() - start, ok=True)
+
+    def _record(self, seconds: Optional[float], ok: bool = False) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            if seconds is None:
+                return
+            if ok:
+                self._latencies.append(seconds)
+            self.ewma = seconds if not self.ewma else EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * self.ewma
+
+    def load(self) -> tuple[int, float]:
+        with self._lock:
+            return self.in_flight, self.ewma
+
+    def hedge_delay(self) -> float:
+        """发出对冲请求前的等待时间: 近期成功请求耗时的 p90"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < MIN_SAMPLES:
+            return config.SEARXNG_HEDGE_DELAY
+        return latencies[int(len(latencies) * 0.9)]
+
+
+_INSTANCES: dict[str, SearxngInstance] = {}
+_INSTANCES_LOCK = Lock()
+
+
+def instances() -> list[SearxngInstance]:
+    """当前配置中的全部实例;只有一个实例时沿用 searxng 作为熔断器名称"""
+    urls = config.SEARXNG_URLS
+    with _INSTANCES_LOCK:
+        result = []
+        for url in urls:
+            instance = _INSTANCES.get(url)
+            if instance is None:
+                name = "searxng" if len(urls) == 1 else f"searxng:{urlsplit(url).netloc}"
+                instance = _INSTANCES[url] = SearxngInstance(url, name)
+            result.append(instance)
+        return result
+
+
+def available() -> bool:
+    """是否至少有一个实例没有熔断"""
+    return any(is_available(instance.name) for instance in instances())
+
+
+def pick(exclude: tuple = ()) -> Optional[SearxngInstance]:
+    """选择没有熔断、进行中请求最少的实例,相同时选近期延迟低的;没有可用实例时返回 None"""
+    candidates = [instance for instance in instances()
+                  if instance not in exclude and is_available(instance.name)]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda instance: instance.load())
+
+
+def _request(instance: SearxngInstance, params: dict) -> list:
+    with guarded(instance.name), instance.track():
+        response = get_session().get(instance.url, params=params, timeout=timeout_for(SEARCH_TIMEOUT))
+        response.raise_for_status()
+        return response.json().get('results', [])
+
+
+async def _request_async(instance: SearxngInstance, params: dict) -> list:
+    with guarded(instance.name), instance.track():
+        response = await get_async_client().get(instance.url, params=params, timeout=timeout_for(SEARCH_TIMEOUT))
+        response.raise_for_status()
+        return response.json().get('results', [])
+
+
+def _hedge_wait(primary: SearxngInstance) -> float:
+    delay = primary.hedge_delay()
+    left = time_left()
+    return delay if left is None else max(0.0, min(delay, left))
+
+
+def search(params: dict) -> list:
+    """
+    在选出的实例上搜索,返回结果列表。没有可用实例时抛出 BackendUnavailable,
+    请求出错时抛出原异常(对冲时两个实例都出错才抛出),由调用方决定是否重试。
+    """
+    primary = pick()
+    if primary is None:
+        raise BackendUnavailable("searxng")
+    if not config.SEARXNG_HEDGE or len(config.SEARXNG_URLS) < 2:
+        return _request(primary, params)
+
+    executor = shared_executor("searxng-hedge", config.SEARCH_FANOUT_THREADS)
+    futures = {}
+    try:
+        futures[submit_tracked("searxng_hedge", executor, _request, primary, params)] = primary
+        done, _ = wait(futures, timeout=_hedge_wait(primary))
+        if not done:
+            secondary = pick(exclude=(primary,))
+            if secondary is not None:
+                logger.info(f"{primary.name} 超过 {primary.hedge_delay():.2f} 秒未返回,同时向 {secondary.name} 发出搜索")
+                futures[submit_tracked("searxng_hedge", executor, _request, secondary, params)] = secondary
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if len(futures) > 1:
+                        SEARXNG_HEDGES.inc(winner="primary" if futures[future] is primary else "hedge")
+                    return future.result()
+                error = error or future.exception()
+        raise error
+    finally:
+        # 不等待较慢的实例,其请求完成后只用于更新延迟统计;还在排队的请求直接取消
+        for future in futures:
+            future.cancel()
+
+
+async def search_async(params: dict) -> list:
+    """search 的异步版本,对冲时取消较慢的请求"""
+    primary = pick()
+    if primary is None:
+        raise BackendUnavailable("searxng")
+    if not config.SEARXNG_HEDGE or len(config.SEARXNG_URLS) < 2:
+        return await _request_async(primary, params)
+
+    tasks = {asyncio.ensure_future(_request_async(primary, params)): primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=_hedge_wait(primary))
+        if not done:
+            secondary = pick(exclude=(primary,))
+            if secondary is not None:
+                logger.info(f"{primary.name} 超过 {primary.hedge_delay():.2f} 秒未返回,同时向 {secondary.name} 发出搜索")
+                tasks[asyncio.ensure_future(_request_async(secondary, params))] = secondary
+        error = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if len(tasks) > 1:
+                        SEARXNG_HEDGES.inc(winner="primary" if tasks[task] is primary else "hedge")
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _in_flight() -> dict:
+    return {(instance.name,): instance.load()[0] for instance in instances()}
+
+
+SEARXNG_HEDGES = Counter("searxng_hedged_requests_total", "发出了对冲请求的搜索次数, winner 为先返回结果的一方", ("winner",))
+Gauge("searxng_in_flight", "各 SearXNG 实例进行中的请求数", ("instance",), callback=_in_flight)
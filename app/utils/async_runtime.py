@@ -0,0 +1,121 @@
+"""
+异步扇出的运行环境: 进程内一个后台事件循环,搜索、抓取、压缩、评估的异步实现都在这个循环上并发执行,
+同步的流水线代码通过 run_async 提交协程并等待结果。并发宽度由信号量限制,不再受线程数约束。
+异步 HTTP 客户端与 OpenAI 客户端绑定在这个循环上,跨请求复用连接。
+"""
+import asyncio
+from concurrent.futures import CancelledError, Future
+from contextvars import copy_context
+from pathlib import Path
+import sys
+from threading import Lock, Thread
+from typing import Awaitable, Iterable, Optional
+
+# 将项目根目录添加到sys.path
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from app.utils.request_context import DeadlineExceeded, on_cancel, raise_if_cancelled, time_left
+from config import base_config as config
+from config.logging_config import logger
+
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_LOOP_LOCK = Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """获取后台事件循环,首次调用时在守护线程中启动"""
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            loop = asyncio.new_event_loop()
+            Thread(target=loop.run_forever, name="async-fanout", daemon=True).start()
+            _LOOP = loop
+            logger.info("异步扇出事件循环已启动")
+        return _LOOP
+
+
+def run_async(coro: Awaitable):
+    """
+    在后台事件循环上运行协程并阻塞等待结果。
+    协程在调用方的上下文副本中执行(请求上下文、当前 span 随之传递),请求取消时协程被取消。
+    """
+    try:
+        raise_if_cancelled()
+    except BaseException:
+        coro.close()
+        raise
+    loop = get_loop()
+    ctx = copy_context()
+    result: Future = Future()
+    tasks = []
+
+    def start():
+        if result.cancelled():
+            coro.close()
+            return
+        task = ctx.run(loop.create_task, coro)
+        tasks.append(task)
+
+        def done(item: asyncio.Task):
+            if item.cancelled():
+                result.cancel()
+            elif item.exception() is not None:
+                result.set_exception(item.exception())
+            else:
+                result.set_result(item.result())
+
+        task.add_done_callback(done)
+
+    def cancel():
+        result.cancel()
+        loop.call_soon_threadsafe(lambda: [task.cancel() for task in tasks])
+
+    loop.call_soon_threadsafe(start)
+    with on_cancel(cancel):
+        try:
+            return result.result()
+        except CancelledError:
+            raise_if_cancelled()
+            raise
+
+
+async def gather_limited(coros: Iterable[Awaitable], limit: int = 0, return_exceptions: bool = True) -> list:
+    """
+    并发执行协程,同时最多 limit 个(0 表示使用 ASYNC_FANOUT_LIMIT),结果按输入顺序返回。
+    到截止时间仍未完成的协程被取消,其结果为 DeadlineExceeded。
+    """
+    semaphore = asyncio.Semaphore(limit or config.ASYNC_FANOUT_LIMIT)
+
+    async def run(item: Awaitable):
+        async with semaphore:
+            return await item
+
+    tasks = [asyncio.ensure_future(run(item)) for item in coros]
+    if not tasks:
+        return []
+    left = time_left()
+    try:
+        _, pending = await asyncio.wait(tasks, timeout=None if left is None else max(left, 0))
+    except asyncio.CancelledError:
+        # asyncio.wait 不会取消子任务,请求取消时需要手动取消
+        for task in tasks:
+            task.cancel()
+        raise
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning(f"{len(pending)} 个任务未在时间预算内完成,已放弃")
+
+    results = []
+    for task in tasks:
+        if task in pending:
+            results.append(DeadlineExceeded())
+            continue
+        error = task.exception()
+        # 请求取消(RequestCancelled)等非普通异常不作为结果返回
+        if error is not None and (not return_exceptions or not isinstance(error, Exception)):
+            raise error
+        results.append(error if error is not None else task.result())
+    return results
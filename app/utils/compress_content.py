@@ -1,25 +1,91 @@
 import sys
-import time
-import requests
 import json
 from pathlib import Path
-from openai import OpenAI
 
 # 将项目根目录添加到sys.path
 ROOT_DIR = Path(__file__).resolve().parent.parent.parent
 if str(ROOT_DIR) not in sys.path:
     sys.path.append(str(ROOT_DIR))
 
-from app.utils.url2txt import url_to_markdown
+from app.utils.url2txt import url_to_markdown, url_to_markdown_async
+from app.utils.http_client import get_async_client, get_session
 from config import base_config as config
 from config.logging_config import logger
 from app.utils.prompt import SYSTEM_PROMPT_SUMMARY
+from app.utils.key_pool import use_key
+from app.utils.llm_client import get_async_openai_client, get_openai_client
+from app.utils.rate_limit import throttle, throttle_async
+from app.utils.resilience import BackendUnavailable, backoff, backoff_async, guarded
+from app.utils.request_context import DeadlineExceeded, raise_if_cancelled, record_usage, span, timeout_for
+from app.utils.metrics import COMPRESS_LATENCY, COMPRESS_REQUESTS, RETRIES
 
 """
 target_type 1: 
 target_type 2: 
 """
 
+def _observe_attempt(backend: str, seconds: float, status: str) -> None:
+    """记录一次压缩模型调用的耗时与结果"""
+    COMPRESS_LATENCY.observe(seconds, backend=backend, model=config.COMPRESS_MODEL)
+    COMPRESS_REQUESTS.inc(backend=backend, model=config.COMPRESS_MODEL, status=status)
+
+
+def _user_prompt(url: str, user_input: str, title: str, html_content: str) -> str:
+    return f"用户需要的信息:{user_input}\n\n 网页的标题与摘要是{title} 网页的url是{url} 网页内容:{html_content[:70000:]}"
+
+
+def _gemini_payload(system_prompt: str, prompt: str) -> dict:
+    return {
+        "contents": [
+            {
+                "parts": [
+                    {
+                        "text": prompt
+                    }
+                ]
+            }
+        ],
+        "generationConfig": {
+            # "maxOutputTokens": 8192,
+            "temperature": 0.2
+        },
+        "systemInstruction": {
+            "parts": [
+                {
+                    "text": system_prompt
+                }
+            ]
+        }
+    }
+
+
+def _gemini_text(response_json: dict):
+    """从 Gemini 的响应中提取文本,没有时返回 None"""
+    if "candidates" in response_json and len(response_json["candidates"]) > 0:
+        candidate = response_json["candidates"][0]
+        if "content" in candidate and "parts" in candidate["content"]:
+            parts = candidate["content"]["parts"]
+            if len(parts) > 0 and "text" in parts[0]:
+                return parts[0]["text"]
+    return None
+
+
+def _strip_think(response_text: str) -> str:
+    if response_text.rstrip().startswith("<think>"):
+        response_text = response_text.split("</think>",maxsplit=1)[-1]
+    return response_text
+
+
+def _finish(response_text: str) -> str:
+    """模型判断网页与需求无关时会只输出 //--++ 标记,此时丢弃"""
+    if len(response_text) < 50 and "//--++" in response_text:
+        # if '+' in response_text:
+        #     return response_text[:40000:]
+        if '-' in response_text:
+            return ''
+    return response_text.strip()
+
+
 def by_gemini(url: str, user_input: str, title: str = "",target_type:str = '1') -> str:
     """
     使用大模型对网页内容进行提取和处理,提高信息密度
@@ -39,86 +105,79 @@ def by_gemini(url: str, user_input: str, title: str = "",target_type:str = '1')
         return ''
     try:
         logger.info(f"开始提取网页内容: {url}")
-        start_time = time.time()
         
         # 使用默认配置或传入的配置
         if target_type == '1':
             SYSTEM_PROMPT = SYSTEM_PROMPT_SUMMARY
             
         # 抓取网页内容
-        html_content = url_to_markdown(url)
+        with span("crawl") as crawl_span:
+            html_content = url_to_markdown(url)
+        record_usage("crawl", seconds=crawl_span.duration)
+        raise_if_cancelled()
         html_len = len(html_content)
         
         if html_len > 2000:            
             # 准备请求数据
-            payload = {
-                "contents": [
-                    {
-                        "parts": [
-                            {
-                                "text": f"用户需要的信息:{user_input}\n\n 网页的标题与摘要是{title} 网页的url是{url} 网页内容:{html_content[:70000:]}"
-                            }
-                        ]
-                    }
-                ],
-                "generationConfig": {
-                    # "maxOutputTokens": 8192,
-                    "temperature": 0.2
-                },
-                "systemInstruction": {
-                    "parts": [
-                        {
-                            "text": SYSTEM_PROMPT
-                        }
-                    ]
-                }
-            }
+            payload = _gemini_payload(SYSTEM_PROMPT, _user_prompt(url, user_input, title, html_content))
             
             # 设置请求头
             headers = {
                 "Content-Type": "application/json"
             }
             
-            # 重试机制,最多重试3次,间隔1秒
+            # 重试机制,最多重试3次,间隔按指数退避
             response_text = None
             response_json = None
+            call_span = None
             
             for attempt in range(3):
+                raise_if_cancelled()
+                if attempt:
+                    RETRIES.inc(stage="compress", backend="gemini", model=config.COMPRESS_MODEL)
                 try:
-                    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{config.COMPRESS_MODEL}:generateContent?key={config.COMPRESS_API_KEY}"
-                    # 发送POST请求
-                    response = requests.post(api_url, headers=headers, data=json.dumps(payload),timeout=180) # 三分钟超时
-                    response.raise_for_status()
-                    
-                    # 解析响应
-                    response_json = response.json()
+                    reservation = throttle(config.COMPRESS_MODEL, payload["contents"][0]["parts"][0]["text"])
+                    with span("compress", model=config.COMPRESS_MODEL, attempt=attempt + 1) as call_span, \
+                            guarded(config.COMPRESS_MODEL), use_key("compress", config.COMPRESS_API_KEYS) as lease:
+                        api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{config.COMPRESS_MODEL}:generateContent?key={lease.key}"
+                        # 发送POST请求
+                        response = get_session().post(api_url, headers=headers, data=json.dumps(payload),timeout=timeout_for(180)) # 最长三分钟
+                        response.raise_for_status()
+                        
+                        # 解析响应
+                        response_json = response.json()
+                    reservation.settle(response_json.get("usageMetadata"))
+                    record_usage("compress", response_json.get("usageMetadata"), call_span.duration)
                     
                     # 从响应中提取文本
-                    if "candidates" in response_json and len(response_json["candidates"]) > 0:
-                        candidate = response_json["candidates"][0]
-                        if "content" in candidate and "parts" in candidate["content"]:
-                            parts = candidate["content"]["parts"]
-                            if len(parts) > 0 and "text" in parts[0]:
-                                response_text = parts[0]["text"]
-                                break
+                    response_text = _gemini_text(response_json)
+                    if response_text:
+                        _observe_attempt("gemini", call_span.duration, "ok")
+                        break
                     
                     if not response_text:
+                        _observe_attempt("gemini", call_span.duration, "empty")
                         logger.warning(
                             f"API响应未包含预期的文本内容: {response_json}"
                         )
-                        time.sleep(1)
+                        backoff(attempt)
                         
+                except (BackendUnavailable, DeadlineExceeded) as e:
+                    status = "unavailable" if isinstance(e, BackendUnavailable) else "deadline"
+                    COMPRESS_REQUESTS.inc(backend="gemini", model=config.COMPRESS_MODEL, status=status)
+                    logger.warning(f"跳过网页压缩: {e}")
+                    break
                 except Exception as e:
+                    _observe_attempt("gemini", call_span.duration if call_span else 0.0, "error")
                     logger.error(
-                        f"第 {attempt + 1} 次调用失败: {str(e)},1秒后重试..."
+                        f"第 {attempt + 1} 次调用失败: {str(e)},稍后重试..."
                     )
-                    time.sleep(1)
+                    backoff(attempt)
                     
             if response_text is None:
                 raise Exception("连续3次调用均失败")
-            if response_text.rstrip().startswith("<think>"):
-                    response_text = response_text.split("</think>",maxsplit=1)[-1]
-            processing_time = time.time() - start_time
+            response_text = _strip_think(response_text)
+            processing_time = call_span.duration
             
             try:
                 # 获取token消耗信息
@@ -143,12 +202,7 @@ def by_gemini(url: str, user_input: str, title: str = "",target_type:str = '1')
                 )
             except Exception as e:
                 logger.error(f"处理速度计算失败: {str(e)}")
-            if len(response_text) < 50 and "//--++" in response_text:
-                # if '+' in response_text:
-                #     return response_text[:40000:]
-                if '-' in response_text:
-                    return ''
-            return response_text.strip()
+            return _finish(response_text)
         else:
             return html_content
 
@@ -175,52 +229,69 @@ def by_openai(url: str, user_input: str, title: str = "",target_type:str = '1'):
     
     try:
         logger.info(f"开始提取网页内容: {url}")
-        start_time = time.time()
         
         # 使用默认配置或传入的配置
         if target_type == '1':
             SYSTEM_PROMPT = SYSTEM_PROMPT_SUMMARY
             
         # 抓取网页内容
-        html_content = url_to_markdown(url)
+        with span("crawl") as crawl_span:
+            html_content = url_to_markdown(url)
+        record_usage("crawl", seconds=crawl_span.duration)
+        raise_if_cancelled()
         html_len = len(html_content)
         
         if html_len > 2000:
             # 准备消息
             messages = [
                 {'role':'system','content':SYSTEM_PROMPT},
-                {'role':'user','content':f"用户需要的信息:{user_input}\n\n 网页的标题与摘要是{title} 网页的url是{url} 网页内容:{html_content[:70000:]}"}
+                {'role':'user','content':_user_prompt(url, user_input, title, html_content)}
             ]
             
-            client = OpenAI(api_key=config.COMPRESS_API_KEY,base_url=config.COMPRESS_API_URL)
-            
-            # 重试机制,最多重试3次,间隔1秒
+            # 重试机制,最多重试3次,间隔按指数退避
             response_text = None
             completion = None
+            call_span = None
             
             for attempt in range(3):
+                raise_if_cancelled()
+                if attempt:
+                    RETRIES.inc(stage="compress", backend="openai", model=config.COMPRESS_MODEL)
                 try:
-                    completion = client.chat.completions.create(
-                        model=config.COMPRESS_MODEL,
-                        messages=messages,
-                        temperature=0.1,
-                    )
+                    reservation = throttle(config.COMPRESS_MODEL, messages[1]['content'])
+                    with span("compress", model=config.COMPRESS_MODEL, attempt=attempt + 1) as call_span, \
+                            guarded(config.COMPRESS_MODEL), use_key("compress", config.COMPRESS_API_KEYS) as lease:
+                        client = get_openai_client(config.COMPRESS_API_URL, lease.key)
+                        completion = client.chat.completions.create(
+                            model=config.COMPRESS_MODEL,
+                            messages=messages,
+                            temperature=0.1,
+                            timeout=timeout_for(180),
+                        )
+                    reservation.settle(completion.usage)
+                    record_usage("compress", completion.usage, call_span.duration)
                     
                     response_text = completion.choices[0].message.content
+                    _observe_attempt("openai", call_span.duration, "ok" if response_text else "empty")
                     if response_text:
                         break
                         
+                except (BackendUnavailable, DeadlineExceeded) as e:
+                    status = "unavailable" if isinstance(e, BackendUnavailable) else "deadline"
+                    COMPRESS_REQUESTS.inc(backend="openai", model=config.COMPRESS_MODEL, status=status)
+                    logger.warning(f"跳过网页压缩: {e}")
+                    break
                 except Exception as e:
+                    _observe_attempt("openai", call_span.duration if call_span else 0.0, "error")
                     logger.error(
-                        f"第 {attempt + 1} 次调用失败: {str(e)},1秒后重试..."
+                        f"第 {attempt + 1} 次调用失败: {str(e)},稍后重试..."
                     )
-                    time.sleep(1)
+                    backoff(attempt)
                     
             if response_text is None:
                 raise Exception("连续3次调用均失败")
-            if response_text.rstrip().startswith("<think>"):
-                response_text = response_text.split("</think>",maxsplit=1)[-1]
-            processing_time = time.time() - start_time
+            response_text = _strip_think(response_text)
+            processing_time = call_span.duration
             
             try:
                 # 获取token消耗信息
@@ -235,11 +306,7 @@ def by_openai(url: str, user_input: str, title: str = "",target_type:str = '1'):
             except Exception as e:
                 logger.error(f"处理速度计算失败: {str(e)}")
                 
-            if len(response_text) < 50 and "//--++" in response_text:
-                if '-' in response_text:
-                    return ''
-                    
-            return response_text.strip()
+            return _finish(response_text)
         else:
             return html_content
             
@@ -264,12 +331,127 @@ def compress_url_content(url: str, user_input: str, title: str = "",target_type:
         Exception: 当API调用或内容处理失败时
     """
     text = ""
-    if config.COMPRESS_API_TYPE == "GEMINI":
-        text = by_gemini(url,user_input,title,target_type)
-    else:
-        text = by_openai(url,user_input,title,target_type)
+    with span("compress_url_content", url=url):
+        if config.COMPRESS_API_TYPE == "GEMINI":
+            text = by_gemini(url,user_input,title,target_type)
+        else:
+            text = by_openai(url,user_input,title,target_type)
     return text
 
+
+async def by_gemini_async(url: str, user_input: str, title: str = "", target_type: str = '1') -> str:
+    """by_gemini 的异步版本,抓取与模型调用都在事件循环上进行"""
+    if not url:
+        return ''
+    try:
+        logger.info(f"开始提取网页内容: {url}")
+        with span("crawl") as crawl_span:
+            html_content = await url_to_markdown_async(url)
+        record_usage("crawl", seconds=crawl_span.duration)
+        if len(html_content) <= 2000:
+            return html_content
+
+        prompt = _user_prompt(url, user_input, title, html_content)
+        payload = _gemini_payload(SYSTEM_PROMPT_SUMMARY, prompt)
+        for attempt in range(3):
+            if attempt:
+                RETRIES.inc(stage="compress", backend="gemini", model=config.COMPRESS_MODEL)
+            call_span = None
+            try:
+                reservation = await throttle_async(config.COMPRESS_MODEL, prompt)
+                with span("compress", model=config.COMPRESS_MODEL, attempt=attempt + 1) as call_span, \
+                        guarded(config.COMPRESS_MODEL), use_key("compress", config.COMPRESS_API_KEYS) as lease:
+                    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{config.COMPRESS_MODEL}:generateContent?key={lease.key}"
+                    response = lease.check(await get_async_client().post(api_url, json=payload, timeout=timeout_for(180)))
+                    response.raise_for_status()
+                    response_json = response.json()
+                reservation.settle(response_json.get("usageMetadata"))
+                record_usage("compress", response_json.get("usageMetadata"), call_span.duration)
+                response_text = _gemini_text(response_json)
+                _observe_attempt("gemini", call_span.duration, "ok" if response_text else "empty")
+                if response_text:
+                    response_text = _strip_think(response_text)
+                    logger.info(f"网页:{url} gemini处理耗时: {call_span.duration:.2f}秒,"
+                                f"原始内容长度{len(html_content)},压缩后内容长度{len(response_text)}")
+                    return _finish(response_text)
+                logger.warning(f"API响应未包含预期的文本内容: {response_json}")
+            except (BackendUnavailable, DeadlineExceeded) as e:
+                status = "unavailable" if isinstance(e, BackendUnavailable) else "deadline"
+                COMPRESS_REQUESTS.inc(backend="gemini", model=config.COMPRESS_MODEL, status=status)
+                logger.warning(f"跳过网页压缩: {e}")
+                return ''
+            except Exception as e:
+                _observe_attempt("gemini", call_span.duration if call_span else 0.0, "error")
+                logger.error(f"第 {attempt + 1} 次调用失败: {str(e)},稍后重试...")
+            await backoff_async(attempt)
+        raise Exception("连续3次调用均失败")
+    except Exception as e:
+        logger.error(f"gemini处理失败: {str(e)}")
+        return ''
+
+
+async def by_openai_async(url: str, user_input: str, title: str = "", target_type: str = '1') -> str:
+    """by_openai 的异步版本,抓取与模型调用都在事件循环上进行"""
+    if not url:
+        return ''
+    try:
+        logger.info(f"开始提取网页内容: {url}")
+        with span("crawl") as crawl_span:
+            html_content = await url_to_markdown_async(url)
+        record_usage("crawl", seconds=crawl_span.duration)
+        if len(html_content) <= 2000:
+            return html_content
+
+        messages = [
+            {'role':'system','content':SYSTEM_PROMPT_SUMMARY},
+            {'role':'user','content':_user_prompt(url, user_input, title, html_content)}
+        ]
+        for attempt in range(3):
+            if attempt:
+                RETRIES.inc(stage="compress", backend="openai", model=config.COMPRESS_MODEL)
+            call_span = None
+            try:
+                reservation = await throttle_async(config.COMPRESS_MODEL, messages[1]['content'])
+                with span("compress", model=config.COMPRESS_MODEL, attempt=attempt + 1) as call_span, \
+                        guarded(config.COMPRESS_MODEL), use_key("compress", config.COMPRESS_API_KEYS) as lease:
+                    client = get_async_openai_client(config.COMPRESS_API_URL, lease.key)
+                    completion = await client.chat.completions.create(
+                        model=config.COMPRESS_MODEL,
+                        messages=messages,
+                        temperature=0.1,
+                        timeout=timeout_for(180),
+                    )
+                reservation.settle(completion.usage)
+                record_usage("compress", completion.usage, call_span.duration)
+                response_text = completion.choices[0].message.content
+                _observe_attempt("openai", call_span.duration, "ok" if response_text else "empty")
+                if response_text:
+                    response_text = _strip_think(response_text)
+                    logger.info(f"网页:{url} {config.COMPRESS_MODEL}处理耗时: {call_span.duration:.2f}秒,"
+                                f"原始内容长度{len(html_content)},压缩后内容长度{len(response_text)}")
+                    return _finish(response_text)
+            except (BackendUnavailable, DeadlineExceeded) as e:
+                status = "unavailable" if isinstance(e, BackendUnavailable) else "deadline"
+                COMPRESS_REQUESTS.inc(backend="openai", model=config.COMPRESS_MODEL, status=status)
+                logger.warning(f"跳过网页压缩: {e}")
+                return ''
+            except Exception as e:
+                _observe_attempt("openai", call_span.duration if call_span else 0.0, "error")
+                logger.error(f"第 {attempt + 1} 次调用失败: {str(e)},稍后重试...")
+            await backoff_async(attempt)
+        raise Exception("连续3次调用均失败")
+    except Exception as e:
+        logger.error(f"{config.COMPRESS_MODEL}处理失败: {str(e)}")
+        return ''
+
+
+async def compress_url_content_async(url: str, user_input: str, title: str = "", target_type: str = '1') -> str:
+    """compress_url_content 的异步版本,由 ASYNC_FANOUT 开启的扇出调用"""
+    with span("compress_url_content", url=url):
+        if config.COMPRESS_API_TYPE == "GEMINI":
+            return await by_gemini_async(url, user_input, title, target_type)
+        return await by_openai_async(url, user_input, title, target_type)
+
 if __name__ == "__main__":
     # 示例用法
     test_url = r"https://tieba.baidu.com/home/main/?id=tb.1.83af9dd9.uDPZD2sU3nTxtBfZQQRcGQ"
@@ -0,0 +1,104 @@
+"""
+共享的 HTTP 连接池: 搜索、网页抓取、Gemini 等所有对外 HTTP 请求复用同一个 requests.Session,
+按主机保持长连接,避免每次请求都重新进行 TCP 与 TLS 握手。
+"""
+import asyncio
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from pathlib import Path
+import sys
+from threading import Lock
+from typing import Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+# 将项目根目录添加到sys.path
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from config import base_config as config
+from config.logging_config import logger
+
+HOST_POOLS = 32  # 最多同时保留多少个主机的连接池
+
+_SESSION: Optional[requests.Session] = None
+_SESSION_SETTINGS: Optional[tuple] = None
+_SESSION_LOCK = Lock()
+_ASYNC_CLIENTS: dict[asyncio.AbstractEventLoop, tuple[tuple, httpx.AsyncClient]] = {}
+_ASYNC_CLIENTS_LOCK = Lock()
+_CLOSING: set = set()
+
+
+def parse_host_limits(raw: str) -> dict[str, int]:
+    """解析 HTTP_HOST_LIMITS,格式为 主机名[:端口]=连接数,多个用逗号分隔"""
+    limits = {}
+    for item in raw.split(","):
+        host, sep, value = item.strip().partition("=")
+        if not sep:
+            continue
+        try:
+            limits[host.strip().lower()] = int(value)
+        except ValueError:
+            logger.warning(f"HTTP_HOST_LIMITS 中的 {item.strip()} 格式有误,已忽略")
+    return limits
+
+
+def _build_session(pool_size: int, pool_block: bool, host_limits: dict[str, int]) -> requests.Session:
+    session = requests.Session()
+    # 多个请求共用会话,不保存 cookie,避免不同请求之间互相影响
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = HTTPAdapter(pool_connections=HOST_POOLS, pool_maxsize=pool_size, pool_block=pool_block)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # 单独限制的主机: 同时最多 limit 个连接,超出的请求等待空闲连接
+    for host, limit in host_limits.items():
+        host_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(limit, 1), pool_block=True)
+        session.mount(f"http://{host}/", host_adapter)
+        session.mount(f"https://{host}/", host_adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """获取共享的会话,连接池配置变化后自动重建"""
+    global _SESSION, _SESSION_SETTINGS
+    settings = (config.HTTP_POOL_MAXSIZE, config.HTTP_POOL_BLOCK, config.HTTP_HOST_LIMITS)
+    with _SESSION_LOCK:
+        if _SESSION is None or _SESSION_SETTINGS != settings:
+            if _SESSION is not None:
+                # 旧会话不主动关闭,进行中的请求仍可完成
+                logger.info("HTTP 连接池配置已变更,新请求将使用新的连接池")
+            _SESSION = _build_session(config.HTTP_POOL_MAXSIZE, config.HTTP_POOL_BLOCK,
+                                      parse_host_limits(config.HTTP_HOST_LIMITS))
+            _SESSION_SETTINGS = settings
+        return _SESSION
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    获取当前事件循环上共享的异步 HTTP 客户端(异步扇出使用),连接池大小同 HTTP_POOL_MAXSIZE。
+    只能在事件循环中调用;HTTP_HOST_LIMITS 的单主机限制对异步客户端不生效。
+    """
+    loop = asyncio.get_running_loop()
+    settings = (config.HTTP_POOL_MAXSIZE,)
+    with _ASYNC_CLIENTS_LOCK:
+        # 已关闭的事件循环上的客户端无法再使用,不再保留
+        for closed in [other for other in _ASYNC_CLIENTS if other.is_closed()]:
+            del _ASYNC_CLIENTS[closed]
+        cached = _ASYNC_CLIENTS.get(loop)
+        if cached is not None and cached[0] == settings:
+            return cached[1]
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=config.HTTP_POOL_MAXSIZE),
+            cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+            follow_redirects=True,
+        )
+        _ASYNC_CLIENTS[loop] = (settings, client)
+    if cached is not None:
+        # 关闭旧客户端的连接池,仍在使用旧客户端的请求会失败并按各自的逻辑重试
+        logger.info("HTTP 连接池配置已变更,异步客户端已重建")
+        task = loop.create_task(cached[1].aclose())
+        _CLOSING.add(task)  # 事件循环只保留任务的弱引用
+        task.add_done_callback(_CLOSING.discard)
+    return client
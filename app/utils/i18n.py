@@ -54,6 +54,10 @@ _MESSAGES = {
         'zh': "🏁 **未能执行任何搜索计划，深度研究结束**\n\n",
         'en': "🏁 **No search plans executed, research finished**\n\n",
     },
+    'deadline_reached': {
+        'zh': "⏱️ **研究时间已用完,使用已获取的信息生成回答**\n\n",
+        'en': "⏱️ **Research time budget used up, answering with the information gathered so far**\n\n",
+    },
     'deep_finished': {
         'zh': "🏁 **深度研究完成**\n\n",
         'en': "🏁 **Deep research completed**\n\n",
@@ -0,0 +1,192 @@
+"""
+多密钥调度: 配置中逗号分隔的多个 API 密钥在每次调用时重新选择,而不是启动时固定使用其中一个。
+每次选择进行中请求最少、最久未被限流、最久未使用的密钥;遇到 429 或配额错误的密钥进入冷却,
+冷却期间只有在所有密钥都不可用时才会被选中。
+"""
+from contextlib import contextmanager
+from pathlib import Path
+import sys
+import time
+from threading import Lock
+from typing import Optional
+
+import httpx
+import openai
+import requests
+
+# 将项目根目录添加到sys.path
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from app.utils.metrics import Counter, Gauge
+from config import base_config as config
+from config.logging_config import logger
+
+
+def mask_key(key: str) -> str:
+    """日志与指标中只显示密钥末尾几位"""
+    return f"...{key[-4:]}" if len(key) > 8 else "***"
+
+
+def _parse_retry_after(headers) -> Optional[float]:
+    try:
+        value = float((headers or {}).get("retry-after", ""))
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """判断调用失败是否由限流或配额不足引起"""
+    if isinstance(error, openai.RateLimitError):
+        return True
+    status = None
+    if isinstance(error, openai.APIStatusError):
+        status = error.status_code
+    elif isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+    elif isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+    if status == 429:
+        return True
+    # 部分服务商在配额用尽时返回 403
+    return status == 403 and "quota" in str(error).lower()
+
+
+def _retry_after_from_error(error: BaseException) -> Optional[float]:
+    response = getattr(error, "response", None)
+    return _parse_retry_after(getattr(response, "headers", None))
+
+
+class _KeyState:
+    __slots__ = ("key", "in_flight", "cooldown_until", "last_limited", "last_used")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.last_limited = 0.0
+        self.last_used = 0.0
+
+
+class KeyPool:
+    """一组可互相替代的密钥,线程安全"""
+
+    def __init__(self, name: str, keys: list[str]):
+        self.name = name
+        self.keys = tuple(keys)
+        self._states = {key: _KeyState(key) for key in self.keys}
+        self._lock = Lock()
+
+    def acquire(self) -> str:
+        """选择一个密钥并计入进行中的请求,用完后需调用 release"""
+        now = time.monotonic()
+        with self._lock:
+            if not self._states:
+                return ""
+            states = list(self._states.values())
+            ready = [state for state in states if state.cooldown_until <= now]
+            if ready:
+                state = min(ready, key=lambda s: (s.in_flight, s.last_limited, s.last_used))
+            else:
+                state = min(states, key=lambda s: s.cooldown_until)
+                logger.warning(f"{self.name} 的 {len(states)} 个密钥都在冷却中,使用最早恢复的 {mask_key(state.key)}")
+            state.in_flight += 1
+            state.last_used = now
+            return state.key
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None and state.in_flight > 0:
+                state.in_flight -= 1
+
+    def cool_down(self, key: str, retry_after: Optional[float] = None) -> None:
+        """密钥被限流,在 retry_after(默认 KEY_COOLDOWN_SECONDS)秒内不再优先使用"""
+        seconds = retry_after or config.KEY_COOLDOWN_SECONDS
+        now = time.monotonic()
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                return
+            state.cooldown_until = max(state.cooldown_until, now + seconds)
+            state.last_limited = now
+        KEY_COOLDOWNS.inc(pool=self.name)
+        logger.warning(f"{self.name} 的密钥 {mask_key(key)} 被限流,暂停使用 {seconds:.0f} 秒")
+
+    def in_flight(self) -> dict[tuple, int]:
+        with self._lock:
+            return {
+                (self.name, f"{index}:{mask_key(state.key)}"): state.in_flight
+                for index, state in enumerate(self._states.values())
+            }
+
+
+class KeyLease:
+    """一次调用占用的密钥"""
+
+    def __init__(self, pool: KeyPool, key: str):
+        self.pool = pool
+        self.key = key
+        self.limited = False
+
+    def mark_limited(self, retry_after: Optional[float] = None) -> None:
+        if not self.limited:
+            self.limited = True
+            self.pool.cool_down(self.key, retry_after)
+
+    def check(self, response):
+        """检查 requests 或 httpx 的响应,返回 429 时让密钥进入冷却"""
+        if response.status_code == 429:
+            self.mark_limited(_parse_retry_after(response.headers))
+        return response
+
+
+_POOLS: dict[str, KeyPool] = {}
+_POOLS_LOCK = Lock()
+
+
+def get_key_pool(name: str, keys: list[str]) -> KeyPool:
+    """获取名为 name 的密钥池,配置重新加载后密钥变化时重建"""
+    with _POOLS_LOCK:
+        pool = _POOLS.get(name)
+        if pool is None or pool.keys != tuple(keys):
+            pool = KeyPool(name, keys)
+            _POOLS[name] = pool
+        return pool
+
+
+@contextmanager
+def use_key(name: str, keys: list[str]):
+    """
+    从密钥池中取一个密钥用于本次调用,结束后归还。
+    with 块内抛出的限流错误会让该密钥进入冷却,其余错误原样抛出。
+
+    Args:
+        name: 密钥池名称,同一阶段的调用共用一个池
+        keys: 配置中的全部密钥,如 config.COMPRESS_API_KEYS
+    """
+    pool = get_key_pool(name, keys)
+    lease = KeyLease(pool, pool.acquire())
+    try:
+        yield lease
+    except Exception as e:
+        if is_rate_limited(e):
+            lease.mark_limited(_retry_after_from_error(e))
+        raise
+    finally:
+        pool.release(lease.key)
+
+
+def _in_flight_stats() -> dict:
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    stats = {}
+    for pool in pools:
+        stats.update(pool.in_flight())
+    return stats
+
+
+KEY_COOLDOWNS = Counter("api_key_cooldowns_total", "密钥因限流或配额错误进入冷却的次数", ("pool",))
+Gauge("api_key_in_flight", "各密钥上正在进行的调用数", ("pool", "key"), callback=_in_flight_stats)
@@ -0,0 +1,69 @@
+"""
+OpenAI 兼容客户端注册表: 按 (base_url, api_key) 在进程内复用客户端及其连接池,
+各阶段(对话、关键词、评估、压缩、总结)不再每次调用都新建客户端、重新握手。
+OpenAI 客户端可以在多个线程中同时使用。
+"""
+import asyncio
+from collections import OrderedDict
+from pathlib import Path
+import sys
+from threading import Lock
+
+from openai import AsyncOpenAI, OpenAI
+
+# 将项目根目录添加到sys.path
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from config.logging_config import logger
+
+MAX_CLIENTS = 64  # 多密钥轮换时每个密钥一个客户端,超出后丢弃最久未使用的
+
+_CLIENTS: "OrderedDict[tuple[str, str], OpenAI]" = OrderedDict()
+_CLIENTS_LOCK = Lock()
+_ASYNC_CLIENTS: "OrderedDict[tuple, AsyncOpenAI]" = OrderedDict()
+
+
+def get_openai_client(base_url: str, api_key: str) -> OpenAI:
+    """
+    获取 (base_url, api_key) 对应的共享客户端,不存在时创建。
+    调用方应在每次调用时从 config 读取地址与密钥,配置重新加载后自然会用上新的客户端。
+    """
+    key = (base_url or "", api_key or "")
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            client = OpenAI(api_key=api_key, base_url=base_url or None)
+            _CLIENTS[key] = client
+            # 被丢弃的客户端不主动关闭,进行中的调用仍可完成
+            while len(_CLIENTS) > MAX_CLIENTS:
+                _CLIENTS.popitem(last=False)
+        else:
+            _CLIENTS.move_to_end(key)
+        return client
+
+
+def get_async_openai_client(base_url: str, api_key: str) -> AsyncOpenAI:
+    """异步版本,客户端绑定在当前事件循环上(见 app/utils/async_runtime.py)"""
+    key = (asyncio.get_running_loop(), base_url or "", api_key or "")
+    with _CLIENTS_LOCK:
+        client = _ASYNC_CLIENTS.get(key)
+        if client is None:
+            client = AsyncOpenAI(api_key=api_key, base_url=base_url or None)
+            _ASYNC_CLIENTS[key] = client
+            while len(_ASYNC_CLIENTS) > MAX_CLIENTS:
+                _ASYNC_CLIENTS.popitem(last=False)
+        else:
+            _ASYNC_CLIENTS.move_to_end(key)
+        return client
+
+
+def clear_openai_clients() -> None:
+    """配置重新加载后调用,丢弃旧配置对应的客户端"""
+    with _CLIENTS_LOCK:
+        count = len(_CLIENTS) + len(_ASYNC_CLIENTS)
+        _CLIENTS.clear()
+        _ASYNC_CLIENTS.clear()
+    if count:
+        logger.info(f"已清理 {count} 个模型客户端,后续调用将按新配置创建")
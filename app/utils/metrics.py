@@ -0,0 +1,252 @@
+"""
+Prometheus 文本格式的运行指标,由 /metrics 接口输出。
+不依赖 prometheus_client,只实现本项目用到的 Counter / Gauge / Histogram。
+"""
+from contextlib import contextmanager
+from pathlib import Path
+import sys
+import time
+from threading import Lock
+from typing import Callable, Iterable, Optional
+
+# 将项目根目录添加到sys.path
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from app.utils.request_context import submit_in_context
+from config.logging_config import logger
+
+PREFIX = "deepresearch_"
+# 从几十毫秒的搜索请求到数分钟的深度研究总结都能覆盖
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}, 实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class Gauge(_Metric):
+    """可增可减的当前值;也可以传入 callback,在输出时读取 {标签值元组: 数值}"""
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 callback: Optional[Callable[[], dict]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+        self._callback = callback
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def render(self) -> list[str]:
+        if self._callback is not None:
+            try:
+                items = sorted(self._callback().items())
+            except Exception as e:
+                logger.warning(f"读取指标 {self.name} 失败: {e}")
+                items = []
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    """耗时分布,单位为秒"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values: dict[tuple, list] = {}  # 标签 -> [各桶计数, 总和, 次数]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        """记录 with 块的耗时,出现异常时同样记录"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = self._header()
+        for key, (counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._lock = Lock()
+
+    def register(self, metric: _Metric) -> None:
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+
+# --- 搜索 ---
+SEARCH_REQUESTS = Counter("search_api_requests_total", "搜索接口调用次数", ("backend", "status"))
+SEARCH_LATENCY = Histogram("search_api_duration_seconds", "搜索接口单次调用耗时", ("backend",))
+SEARCH_CACHE = Counter("search_cache_lookups_total", "搜索结果缓存查询次数, tier 为 memory/disk 表示命中的层级, miss 为未命中", ("tier",))
+SEARXNG_PAGES = Counter("searxng_extra_pages_total", "结果不足时额外请求的 SearXNG 结果页, status 为 used/error/skipped(结果已足够或超时而未等待)", ("status",))
+
+# --- 相关性评估 ---
+EVALUATE_BATCHES = Counter("evaluate_batches_total", "相关性评估批次数, status 为 fallback 表示使用了默认评分", ("model", "status"))
+EVALUATE_LATENCY = Histogram("evaluate_batch_duration_seconds", "单个评估批次耗时(含重试)", ("model",))
+
+# --- 网页抓取 ---
+CRAWL_REQUESTS = Counter("crawler_requests_total", "各抓取后端的调用次数", ("backend", "status"))
+CRAWL_LATENCY = Histogram("crawler_duration_seconds", "各抓取后端的单次调用耗时", ("backend",))
+
+# --- 网页压缩 ---
+COMPRESS_REQUESTS = Counter("compress_requests_total", "网页压缩模型调用次数", ("backend", "model", "status"))
+COMPRESS_LATENCY = Histogram("compress_duration_seconds", "网页压缩模型单次调用耗时", ("backend", "model"))
+
+# --- 总结 ---
+SUMMARY_TTFT = Histogram("summary_ttft_seconds", "流式总结从发出请求到收到第一个 token 的时间", ("backend", "model"))
+SUMMARY_LATENCY = Histogram("summary_duration_seconds", "总结模型完整回复耗时", ("backend", "model"))
+
+# --- 重试 ---
+RETRIES = Counter("retries_total", "各阶段的重试次数", ("stage", "backend", "model"))
+
+# --- 流水线线程池 ---
+POOL_QUEUE_DEPTH = Gauge("pool_queue_depth", "流水线线程池(搜索/评估/抓取)中已提交但尚未开始的任务数", ("pool",))
+
+
+def submit_tracked(pool: str, executor, fn, *args, **kwargs):
+    """submit_in_context 的包装,同时统计该线程池中排队的任务数"""
+    lock = Lock()
+    started = False
+
+    def mark_started(*_):
+        nonlocal started
+        with lock:
+            if started:
+                return
+            started = True
+        POOL_QUEUE_DEPTH.dec(pool=pool)
+
+    def run(*run_args, **run_kwargs):
+        mark_started()
+        return fn(*run_args, **run_kwargs)
+
+    POOL_QUEUE_DEPTH.inc(pool=pool)
+    try:
+        future = submit_in_context(executor, run, *args, **kwargs)
+    except BaseException:
+        mark_started()
+        raise
+    # 任务被取消时不会执行 run,在完成回调中补上
+    future.add_done_callback(mark_started)
+    return future
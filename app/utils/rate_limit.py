@@ -0,0 +1,204 @@
+"""
+进程内共享的调用速率限制: 按模型名或搜索后端(searxng / tavily)分别限制每分钟请求数(RPM)
+与每分钟 token 数(TPM),在发出请求前等待配额,而不是等服务商返回 429 后再重试。
+所有并发请求共用同一组令牌桶,限制值见配置项 RATE_LIMITS。
+"""
+import asyncio
+import math
+from pathlib import Path
+import sys
+import time
+from threading import Lock
+from typing import Optional
+
+# 将项目根目录添加到sys.path
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from app.utils.metrics import Histogram
+from app.utils.request_context import DeadlineExceeded, raise_if_cancelled, time_left
+from config import base_config as config
+from config.logging_config import logger
+
+POLL_INTERVAL = 0.5  # 等待配额期间检查请求是否已取消的间隔(秒)
+CHARS_PER_TOKEN = 3  # 估算 token 数用,中英文混合内容取折中值
+
+RATE_LIMIT_WAIT = Histogram("rate_limit_wait_seconds", "调用前等待速率配额的时间", ("name",),
+                            buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60))
+
+
+def parse_rate_limits(raw: str) -> dict[str, tuple[int, int]]:
+    """解析 RATE_LIMITS,格式为 名称=RPM[/TPM],多个用逗号分隔,0 表示不限制"""
+    limits = {}
+    for item in raw.split(","):
+        name, sep, value = item.strip().partition("=")
+        if not sep:
+            continue
+        rpm, _, tpm = value.partition("/")
+        try:
+            limits[name.strip()] = (int(rpm or 0), int(tpm or 0))
+        except ValueError:
+            logger.warning(f"RATE_LIMITS 中的 {item.strip()} 格式有误,已忽略")
+    return limits
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _usage_tokens(usage) -> Optional[int]:
+    """从 OpenAI 的 usage 对象或 Gemini 的 usageMetadata 字典中取总 token 数"""
+    if isinstance(usage, dict):
+        return usage.get("totalTokenCount")
+    return getattr(usage, "total_tokens", None)
+
+
+class TokenBucket:
+    """容量为每分钟限额、匀速补充的令牌桶;limit 为 0 时不限制"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """还需等待多久才有 amount 个令牌,调用前需先 refill"""
+        if not self.capacity or self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        if self.capacity:
+            # 可以透支,按实际 usage 修正时多用的部分会推迟之后的调用
+            self.tokens -= amount
+
+
+class Reservation:
+    """一次调用预占的配额,拿到实际 usage 后用 settle 修正 token 数"""
+
+    def __init__(self, limiter: Optional["RateLimiter"] = None, tokens: int = 0):
+        self.limiter = limiter
+        self.tokens = tokens
+
+    def settle(self, usage) -> None:
+        actual = _usage_tokens(usage)
+        if self.limiter is None or actual is None:
+            return
+        self.limiter.adjust(actual - self.tokens)
+        self.tokens = actual
+
+
+class RateLimiter:
+    """一个模型或搜索后端的 RPM 与 TPM 限制,线程安全"""
+
+    def __init__(self, name: str, rpm: int, tpm: int):
+        self.name = name
+        self.limits = (rpm, tpm)
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._lock = Lock()
+
+    def _clamp(self, tokens: int) -> int:
+        # 单次调用超过每分钟上限时按上限计,否则永远等不到
+        return min(tokens, int(self.tokens.capacity)) if self.tokens.capacity else tokens
+
+    def _try_take(self, tokens: int) -> float:
+        """
+        有配额时直接扣除并返回 0,否则返回还需等待的秒数。
+        等到配额时已超出当前时间预算则抛出 DeadlineExceeded。
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if wait <= 0:
+                self.requests.take(1)
+                self.tokens.take(tokens)
+                return wait
+        left = time_left()
+        if left is not None and wait > left:
+            raise DeadlineExceeded(f"{self.name} 的速率配额在时间预算内无法获得")
+        return wait
+
+    def _acquired(self, tokens: int, start: float) -> Reservation:
+        waited = time.perf_counter() - start
+        RATE_LIMIT_WAIT.observe(waited, name=self.name)
+        if waited >= 1:
+            logger.info(f"{self.name} 达到速率限制,等待 {waited:.2f} 秒后发出请求")
+        return Reservation(self, tokens)
+
+    def acquire(self, tokens: int = 0) -> Reservation:
+        """阻塞直到请求数与 token 数都有配额,期间请求被取消时抛出 RequestCancelled"""
+        tokens = self._clamp(tokens)
+        start = time.perf_counter()
+        while (wait := self._try_take(tokens)) > 0:
+            raise_if_cancelled()
+            time.sleep(min(wait, POLL_INTERVAL))
+        return self._acquired(tokens, start)
+
+    async def acquire_async(self, tokens: int = 0) -> Reservation:
+        """acquire 的异步版本,等待期间不占用线程,同样在请求被取消时抛出 RequestCancelled"""
+        tokens = self._clamp(tokens)
+        start = time.perf_counter()
+        while (wait := self._try_take(tokens)) > 0:
+            raise_if_cancelled()
+            await asyncio.sleep(min(wait, POLL_INTERVAL))
+        return self._acquired(tokens, start)
+
+    def adjust(self, delta: int) -> None:
+        """按实际 token 数修正,delta 为正表示多用,为负表示退回"""
+        if not delta or not self.tokens.capacity:
+            return
+        with self._lock:
+            self.tokens.refill(time.monotonic())
+            self.tokens.take(delta)
+            self.tokens.tokens = min(self.tokens.tokens, self.tokens.capacity)
+
+
+_LIMITERS: dict[str, RateLimiter] = {}
+_LIMITERS_LOCK = Lock()
+
+
+def get_rate_limiter(name: str) -> Optional[RateLimiter]:
+    """获取 name 的限制器,未配置限制时返回 None;配置重新加载后限制值变化时重建"""
+    rpm, tpm = parse_rate_limits(config.RATE_LIMITS).get(name, (0, 0))
+    if not rpm and not tpm:
+        return None
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(name)
+        if limiter is None or limiter.limits != (rpm, tpm):
+            limiter = RateLimiter(name, rpm, tpm)
+            _LIMITERS[name] = limiter
+        return limiter
+
+
+def throttle(name: str, text: str = "") -> Reservation:
+    """
+    发出请求前等待 name 的速率配额。
+
+    Args:
+        name: 模型名或搜索后端名,与 RATE_LIMITS 中的名称对应
+        text: 本次请求的输入内容,用于估算 token 数
+
+    Returns:
+        Reservation: 调用完成后可用 settle(usage) 按实际 token 数修正
+    """
+    limiter = get_rate_limiter(name)
+    if limiter is None:
+        return Reservation()
+    return limiter.acquire(estimate_tokens(text) if text else 0)
+
+
+async def throttle_async(name: str, text: str = "") -> Reservation:
+    """throttle 的异步版本"""
+    limiter = get_rate_limiter(name)
+    if limiter is None:
+        return Reservation()
+    return await limiter.acquire_async(estimate_tokens(text) if text else 0)
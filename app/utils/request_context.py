@@ -0,0 +1,383 @@
+"""
+请求上下文: 在一次请求的整个流水线中共享的状态(各阶段的 token 与耗时统计、取消标记、span 时间线、截止时间)。
+通过 ContextVar 传递,流式生成器用 bind 包装,线程池任务用 submit_in_context 提交。
+"""
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from functools import wraps
+from pathlib import Path
+import sys
+import time
+import uuid
+from threading import Event, Lock
+from typing import Callable, Generator, Optional
+
+# 将项目根目录添加到sys.path
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from app.utils.tracing import TRACES, Span, Trace
+from config import base_config as config
+from config.logging_config import logger
+
+# 流水线中的阶段: 对话(工具选择) / 关键词生成 / 搜索 / 研究计划 / 相关性评估 / 网页抓取 / 网页压缩 / 总结
+STAGES = ("chat", "keyword", "search", "plan", "evaluate", "crawl", "compress", "summary")
+
+
+class UsageTracker:
+    """按阶段累计 token 消耗、调用次数和耗时,可在多个线程中同时记录"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._stages: dict[str, dict] = {}
+
+    def add(self, stage: str, prompt_tokens: int = 0, completion_tokens: int = 0, seconds: float = 0.0) -> None:
+        with self._lock:
+            item = self._stages.setdefault(stage, {
+                "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "calls": 0, "seconds": 0.0,
+            })
+            item["prompt_tokens"] += prompt_tokens
+            item["completion_tokens"] += completion_tokens
+            item["total_tokens"] += prompt_tokens + completion_tokens
+            item["calls"] += 1
+            item["seconds"] += seconds
+
+    def to_dict(self) -> dict:
+        """OpenAI 格式的 usage,附带各阶段明细"""
+        with self._lock:
+            order = {name: i for i, name in enumerate(STAGES)}
+            stages = {
+                name: {**item, "seconds": round(item["seconds"], 3)}
+                for name, item in sorted(self._stages.items(), key=lambda kv: order.get(kv[0], len(order)))
+            }
+        prompt_tokens = sum(item["prompt_tokens"] for item in stages.values())
+        completion_tokens = sum(item["completion_tokens"] for item in stages.values())
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "stages": stages,
+        }
+
+
+class RequestCancelled(BaseException):
+    """
+    请求已被取消(客户端断开或任务被删除)。
+    继承 BaseException,不会被流水线中各处的 except Exception 当作普通错误吞掉。
+    """
+
+
+class DeadlineExceeded(Exception):
+    """当前阶段或整个请求的时间预算已用完,调用方应返回已有的部分结果"""
+
+    def __init__(self, message: str = "已超出时间预算"):
+        super().__init__(message)
+
+
+class RequestContext:
+    """一次请求的上下文"""
+
+    def __init__(self):
+        self.request_id = uuid.uuid4().hex
+        self.started_at = time.time()
+        # 搜索与研究阶段的截止时间(time.monotonic),总结不受限制
+        self.deadline = (time.monotonic() + config.REQUEST_DEADLINE_SECONDS
+                         if config.REQUEST_DEADLINE_SECONDS > 0 else None)
+        self.usage = UsageTracker()
+        self.trace = Trace(self.request_id)
+        TRACES.add(self.trace)
+        self._cancel_event = Event()
+        self._cancel_callbacks: list[Callable[[], None]] = []
+        self._cancel_lock = Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self) -> None:
+        """标记取消,并执行已注册的回调(取消排队中的任务、关闭进行中的连接)"""
+        with self._cancel_lock:
+            if self._cancel_event.is_set():
+                return
+            self._cancel_event.set()
+            callbacks = list(self._cancel_callbacks)
+        logger.info("请求已取消,正在停止后续工作")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"执行取消回调时出现问题: {e}")
+
+    @contextmanager
+    def on_cancel(self, callback: Callable[[], None]):
+        """在 with 块内注册取消回调;已取消时立即执行"""
+        with self._cancel_lock:
+            already = self._cancel_event.is_set()
+            if not already:
+                self._cancel_callbacks.append(callback)
+        if already:
+            callback()
+        try:
+            yield
+        finally:
+            with self._cancel_lock:
+                if callback in self._cancel_callbacks:
+                    self._cancel_callbacks.remove(callback)
+
+    def root_span(self):
+        """在 with 块结束(包括取消和出错)时结束 trace 的根区间"""
+        return _finishing(self.trace.root)
+
+    def usage_dict(self) -> dict:
+        return {**self.usage.to_dict(), "elapsed_seconds": round(time.time() - self.started_at, 3)}
+
+    @contextmanager
+    def activate(self):
+        """在当前线程中把自己设为当前请求上下文,新的 span 挂在根区间下"""
+        token = _CURRENT.set(self)
+        span_token = _CURRENT_SPAN.set(self.trace.root)
+        try:
+            yield self
+        finally:
+            _CURRENT_SPAN.reset(span_token)
+            _CURRENT.reset(token)
+
+    def _enter(self) -> None:
+        _CURRENT.set(self)
+        _CURRENT_SPAN.set(self.trace.root)
+
+    def bind(self, gen: Generator) -> Generator:
+        """
+        包装生成器,每一步都在同一个 contextvars.Context 中执行。
+        流式生成器的每一步可能由不同线程驱动,ContextVar 不会自动跟随;
+        固定的 Context 让生成器中打开的 span 在各步之间保持为当前区间。
+        """
+        context = copy_context()
+        context.run(self._enter)
+        try:
+            while True:
+                try:
+                    data = context.run(next, gen)
+                except StopIteration:
+                    return
+                yield data
+        finally:
+            context.run(gen.close)
+
+
+_CURRENT: ContextVar[Optional[RequestContext]] = ContextVar("request_context", default=None)
+_CURRENT_SPAN: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+_STAGE_DEADLINE: ContextVar[Optional[float]] = ContextVar("stage_deadline", default=None)
+
+
+def current_context() -> Optional[RequestContext]:
+    return _CURRENT.get()
+
+
+def current_span() -> Optional[Span]:
+    return _CURRENT_SPAN.get()
+
+
+@contextmanager
+def _finishing(item: Span):
+    """with 块结束时结束区间,并按退出方式记录状态"""
+    try:
+        yield item
+    except (RequestCancelled, GeneratorExit):
+        item.finish("cancelled")
+        raise
+    except Exception as e:
+        item.attrs["error"] = str(e)[:200]
+        item.finish("error")
+        raise
+    finally:
+        item.finish()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    记录一段计时区间,作为当前区间的子区间加入请求的 trace。
+    不在请求上下文中时只计时,返回的 Span 同样可以读取 duration。
+    """
+    parent = _CURRENT_SPAN.get()
+    item = parent.child(name, attrs) if parent is not None else Span(name, attrs)
+    token = _CURRENT_SPAN.set(item)
+    try:
+        with _finishing(item):
+            yield item
+    finally:
+        _CURRENT_SPAN.reset(token)
+
+
+def traced(name: str):
+    """装饰器: 把整个函数调用记录为一个 span,只用于普通函数(不用于生成器)"""
+    def decorator(func: Callable):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    """向线程池提交任务,任务在提交时的上下文副本中运行"""
+    raise_if_cancelled()
+    try:
+        return executor.submit(copy_context().run, fn, *args, **kwargs)
+    except RuntimeError:
+        # 取消时线程池已被关闭
+        raise_if_cancelled()
+        raise
+
+
+_SHARED_EXECUTORS: dict[str, ThreadPoolExecutor] = {}
+_SHARED_EXECUTORS_LOCK = Lock()
+
+
+def shared_executor(name: str, max_workers: int) -> ThreadPoolExecutor:
+    """
+    按名称共享的有界线程池,首次使用时创建,max_workers 只在创建时生效。
+    多个请求共用,不能关闭;放弃等待时逐个取消尚未开始的任务。
+    """
+    with _SHARED_EXECUTORS_LOCK:
+        executor = _SHARED_EXECUTORS.get(name)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix=name)
+            _SHARED_EXECUTORS[name] = executor
+        return executor
+
+
+def is_cancelled() -> bool:
+    ctx = _CURRENT.get()
+    return ctx is not None and ctx.cancelled
+
+
+def raise_if_cancelled() -> None:
+    """当前请求已取消时抛出 RequestCancelled,用于在每个阶段开始前停止调度新工作"""
+    if is_cancelled():
+        raise RequestCancelled()
+
+
+def sleep_unless_cancelled(seconds: float) -> None:
+    """等待 seconds 秒,期间请求被取消时立即抛出 RequestCancelled,用于重试前的等待"""
+    ctx = _CURRENT.get()
+    if ctx is None:
+        time.sleep(seconds)
+        return
+    ctx._cancel_event.wait(seconds)
+    raise_if_cancelled()
+
+
+def parse_stage_budgets(raw: str) -> dict[str, float]:
+    """解析 STAGE_BUDGETS,格式为 阶段=秒数,多个用逗号分隔"""
+    budgets = {}
+    for item in raw.split(","):
+        name, sep, value = item.strip().partition("=")
+        if not sep:
+            continue
+        try:
+            budgets[name.strip()] = float(value)
+        except ValueError:
+            logger.warning(f"STAGE_BUDGETS 中的 {item.strip()} 格式有误,已忽略")
+    return budgets
+
+
+def current_deadline() -> Optional[float]:
+    """当前生效的截止时间: 请求截止时间与所在阶段截止时间中较早的一个,都没有时为 None"""
+    ctx = _CURRENT.get()
+    deadlines = [d for d in (ctx.deadline if ctx else None, _STAGE_DEADLINE.get()) if d is not None]
+    return min(deadlines) if deadlines else None
+
+
+def time_left() -> Optional[float]:
+    """距当前截止时间的剩余秒数(可能为负),没有截止时间时为 None"""
+    deadline = current_deadline()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def out_of_time() -> bool:
+    left = time_left()
+    return left is not None and left <= 0
+
+
+def timeout_for(default: Optional[float]) -> Optional[float]:
+    """
+    单次 HTTP 或模型调用的超时: 取 default 与剩余时间中较小的一个。
+    时间已用完时抛出 DeadlineExceeded,不再发出请求。
+    """
+    left = time_left()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceeded()
+    return left if default is None else min(default, left)
+
+
+@contextmanager
+def stage_budget(stage: str):
+    """
+    在 with 块内为 stage 设置时间预算(见 STAGE_BUDGETS),不会晚于外层的截止时间。
+    块内提交到线程池或事件循环的任务同样受此限制。
+    """
+    seconds = parse_stage_budgets(config.STAGE_BUDGETS).get(stage, 0)
+    if seconds <= 0:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    outer = current_deadline()
+    token = _STAGE_DEADLINE.set(deadline if outer is None else min(deadline, outer))
+    try:
+        yield
+    finally:
+        _STAGE_DEADLINE.reset(token)
+
+
+def wait_result(future):
+    """等待线程池任务的结果,最多等到截止时间,届时仍未完成则抛出 DeadlineExceeded"""
+    left = time_left()
+    try:
+        return future.result(timeout=None if left is None else max(left, 0))
+    except FutureTimeoutError:
+        raise DeadlineExceeded() from None
+
+
+@contextmanager
+def on_cancel(callback: Callable[[], None]):
+    """为当前请求注册取消回调,不在请求上下文中时不做任何事"""
+    ctx = _CURRENT.get()
+    if ctx is None:
+        yield
+        return
+    with ctx.on_cancel(callback):
+        yield
+
+
+def cancel_pending_futures(executor):
+    """请求取消时关闭线程池并丢弃尚未开始的任务"""
+    return on_cancel(lambda: executor.shutdown(wait=False, cancel_futures=True))
+
+
+def record_usage(stage: str, usage=None, seconds: float = 0.0) -> None:
+    """
+    记录一次模型调用的消耗,不在请求上下文中时忽略。
+
+    Args:
+        stage: 阶段名称,见 STAGES
+        usage: OpenAI 返回的 usage 对象,或 Gemini 返回的 usageMetadata 字典
+        seconds: 本次调用耗时
+    """
+    ctx = _CURRENT.get()
+    if ctx is None:
+        return
+    prompt_tokens = completion_tokens = 0
+    if isinstance(usage, dict):
+        prompt_tokens = usage.get("promptTokenCount", 0) or 0
+        completion_tokens = (usage.get("candidatesTokenCount", 0) or 0) + (usage.get("thoughtsTokenCount", 0) or 0)
+    elif usage is not None:
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    ctx.usage.add(stage, prompt_tokens, completion_tokens, seconds)
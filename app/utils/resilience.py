@@ -0,0 +1,174 @@
+"""
+后端容错: 每个搜索后端、抓取后端与模型一个熔断器,以及带随机抖动的指数退避。
+连续失败达到 CIRCUIT_FAILURE_THRESHOLD 次后熔断,CIRCUIT_RESET_SECONDS 秒内的调用直接失败;
+之后放行一次试探调用(半开),成功则恢复,失败则继续熔断。
+"""
+import asyncio
+from contextlib import contextmanager
+from pathlib import Path
+import random
+import sys
+import time
+from threading import Lock
+
+# 将项目根目录添加到sys.path
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from app.utils.key_pool import is_rate_limited
+from app.utils.metrics import Counter, Gauge
+from app.utils.request_context import DeadlineExceeded, out_of_time, sleep_unless_cancelled, time_left
+from config import base_config as config
+from config.logging_config import logger
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class BackendUnavailable(Exception):
+    """后端处于熔断状态,调用被直接拒绝"""
+
+    def __init__(self, name: str):
+        super().__init__(f"{name} 暂时不可用(已熔断)")
+        self.name = name
+
+
+class CircuitBreaker:
+    """一个后端的熔断器,线程安全"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = Lock()
+
+    def _reset_due(self) -> bool:
+        return time.monotonic() - self.opened_at >= config.CIRCUIT_RESET_SECONDS
+
+    def available(self) -> bool:
+        """是否值得尝试,不占用半开状态的试探名额"""
+        with self._lock:
+            if self.state == OPEN:
+                return self._reset_due()
+            return not (self.state == HALF_OPEN and self._probing)
+
+    def allow(self) -> bool:
+        """是否放行本次调用;熔断到期后只放行一个试探调用"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if not self._reset_due():
+                    return False
+                self.state = HALF_OPEN
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            recovered = self.state != CLOSED
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+        if recovered:
+            logger.info(f"{self.name} 已恢复")
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            tripped = self.state == HALF_OPEN or (
+                self.state == CLOSED and self.failures >= config.CIRCUIT_FAILURE_THRESHOLD)
+            if tripped:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self._probing = False
+        if tripped:
+            CIRCUIT_OPENED.inc(backend=self.name)
+            logger.warning(f"{self.name} 连续失败 {self.failures} 次,"
+                           f"{config.CIRCUIT_RESET_SECONDS:g} 秒内的调用将直接跳过")
+
+    def release_probe(self) -> None:
+        """试探调用既未成功也未失败(如请求被取消)时归还名额"""
+        with self._lock:
+            self._probing = False
+
+
+_BREAKERS: dict[str, CircuitBreaker] = {}
+_BREAKERS_LOCK = Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    with _BREAKERS_LOCK:
+        breaker = _BREAKERS.get(name)
+        if breaker is None:
+            breaker = _BREAKERS[name] = CircuitBreaker(name)
+        return breaker
+
+
+def is_available(name: str) -> bool:
+    return get_breaker(name).available()
+
+
+@contextmanager
+def guarded(name: str):
+    """
+    通过熔断器调用后端: 熔断中抛出 BackendUnavailable;with 块正常结束记为成功,抛出异常记为失败。
+    限流错误说明后端可用;时间预算用完(包括按剩余时间缩短的超时)是调用方的原因,都不计入失败。
+    """
+    breaker = get_breaker(name)
+    if not breaker.allow():
+        raise BackendUnavailable(name)
+    try:
+        yield
+    except Exception as e:
+        if is_rate_limited(e) or isinstance(e, DeadlineExceeded) or out_of_time():
+            breaker.release_probe()
+        else:
+            breaker.record_failure()
+        raise
+    except BaseException:
+        breaker.release_probe()
+        raise
+    breaker.record_success()
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    第 attempt 次(从 0 开始)重试前的等待时间: 指数增长并全量随机抖动,避免并发请求同时重试。
+    不超过当前时间预算的剩余时间。
+    """
+    delay = random.uniform(0, min(config.RETRY_BACKOFF_MAX, config.RETRY_BACKOFF_BASE * (2 ** attempt)))
+    left = time_left()
+    return delay if left is None else max(0.0, min(delay, left))
+
+
+def backoff(attempt: int) -> float:
+    """按 backoff_delay 等待,请求取消时立即停止;返回实际等待的秒数"""
+    delay = backoff_delay(attempt)
+    sleep_unless_cancelled(delay)
+    return delay
+
+
+async def backoff_async(attempt: int) -> float:
+    """backoff 的异步版本,请求取消时由任务取消中断"""
+    delay = backoff_delay(attempt)
+    await asyncio.sleep(delay)
+    return delay
+
+
+def _breaker_states() -> dict:
+    with _BREAKERS_LOCK:
+        breakers = list(_BREAKERS.values())
+    return {(breaker.name,): _STATE_VALUES[breaker.state] for breaker in breakers}
+
+
+CIRCUIT_OPENED = Counter("circuit_opened_total", "熔断器打开的次数", ("backend",))
+Gauge("circuit_state", "熔断器状态: 0 正常, 1 半开, 2 熔断", ("backend",), callback=_breaker_states)
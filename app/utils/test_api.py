@@ -72,8 +72,8 @@ def evaluate_single_batch_test():
 def summary_test():
     """测试对话总结功能"""
     user_messages = [{"role": "user", "content": "你好,简短的介绍一下你自己吧"}]
-    rsp = summary(user_messages)
-    if rsp:
+    content, _ = summary(user_messages)
+    if content and content != 'error':
         return True
 
 # --- 供 WebUI 调用的辅助函数 ---
@@ -26,6 +26,8 @@ if str(ROOT_DIR) not in sys.path:
     sys.path.append(str(ROOT_DIR))
 
 from app.search.models import SearchRequest, QueryKeys
+from app.utils.http_client import get_session
+from app.utils.request_context import timeout_for
 from config import base_config as config
 from config.logging_config import logger
 from app.utils.i18n import i18n
@@ -160,12 +162,28 @@ def sse_create_openai_data(content: str = '', reasoning_content: str = '') -> st
 
 
 def sse_create_openai_usage_data(usage: dict) -> str:
-    """创建OpenAI格式的使用统计SSE数据"""
-    completion_tokens = usage.get("completion_tokens", 0)
-    prompt_tokens = usage.get("prompt_tokens", 0)
-    total_tokens = usage.get("total_tokens", 0)
-    template = f"""data: {{"usage":{{"completion_tokens":{completion_tokens},"prompt_tokens":{prompt_tokens},"total_tokens":{total_tokens}}},"choices":[],"created":{time.time()},"id":"search-{time.time()}","model":"search-model","object":"chat.completion.chunk"}}\n\n"""
-    return template
+    """创建OpenAI格式的使用统计SSE数据,usage 中的其他字段(如各阶段明细)原样附带"""
+    data_structure = {
+        "usage": {
+            **usage,
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "total_tokens": usage.get("total_tokens", 0),
+        },
+        "choices": [],
+        "created": int(time.time()),
+        "id": f"search-{time.time()}",
+        "model": "search-model",
+        "object": "chat.completion.chunk",
+    }
+    json_data = json.dumps(data_structure, ensure_ascii=False)
+    return f"data: {json_data}\n\n"
+
+
+def sse_create_trace_data(trace: dict) -> str:
+    """创建请求 span 时间线的SSE数据,使用单独的 trace 事件类型,不影响只读取 data 的客户端"""
+    json_data = json.dumps(trace, ensure_ascii=False)
+    return f"event: trace\ndata: {json_data}\n\n"
 
 
 def sse_gemini2openai_data(gemini_sse_data: str) -> str:
@@ -310,7 +328,8 @@ def download_file(url):
     
     try:
         # 先发送HEAD请求检查文件大小（如果服务器支持）
-        head_response = requests.head(url, timeout=10)
+        session = get_session()
+        head_response = session.head(url, timeout=timeout_for(10))
         if head_response.status_code == 200:
             content_length = head_response.headers.get('Content-Length')
             if content_length and int(content_length) > MAX_FILE_SIZE:
@@ -319,23 +338,23 @@ def download_file(url):
                 )
                 return ''
         
-        # 流式下载并限制大小
-        response = requests.get(url, timeout=30, stream=True)
-        response.raise_for_status()
-        
-        downloaded_size = 0
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    downloaded_size += len(chunk)
-                    if downloaded_size > MAX_FILE_SIZE:
-                        logger.warning(
-                            f"下载过程中发现文件过大: {downloaded_size / (1024*1024):.1f}MB > 10MB"
-                        )
-                        # 删除部分下载的文件
-                        file_path.unlink(missing_ok=True)
-                        return ''
-                    f.write(chunk)
+        # 流式下载并限制大小,提前返回时同样归还连接
+        with session.get(url, timeout=timeout_for(30), stream=True) as response:
+            response.raise_for_status()
+            
+            downloaded_size = 0
+            with open(file_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    if chunk:
+                        downloaded_size += len(chunk)
+                        if downloaded_size > MAX_FILE_SIZE:
+                            logger.warning(
+                                f"下载过程中发现文件过大: {downloaded_size / (1024*1024):.1f}MB > 10MB"
+                            )
+                            # 删除部分下载的文件
+                            file_path.unlink(missing_ok=True)
+                            return ''
+                        f.write(chunk)
         
         return file_path  # Path对象，布尔值为True
         
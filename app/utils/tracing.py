@@ -0,0 +1,150 @@
+"""
+请求的 span 时间线: 每个请求记录一棵带时间的区间树(工具选择、搜索、研究计划、网页压缩、总结等),
+可通过请求 id 查询,用于查看关键路径以及哪些阶段没有并行起来。
+区间的创建与当前区间的传递见 app/utils/request_context.py 中的 span。
+"""
+from collections import OrderedDict
+from pathlib import Path
+import sys
+import threading
+import time
+from threading import Lock
+from typing import Optional
+
+# 将项目根目录添加到sys.path
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from config import base_config as config
+
+
+class Span:
+    """一段计时区间,子区间可能在其他线程中并发记录"""
+
+    def __init__(self, name: str, attrs: Optional[dict] = None):
+        self.name = name
+        self.attrs = dict(attrs or {})
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.status = "running"
+        self.thread = threading.current_thread().name
+        self.children: list["Span"] = []
+        self._lock = Lock()
+
+    @property
+    def duration(self) -> float:
+        """已结束时为区间长度,未结束时为到目前为止的耗时(秒)"""
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def child(self, name: str, attrs: Optional[dict] = None) -> "Span":
+        item = Span(name, attrs)
+        with self._lock:
+            self.children.append(item)
+        return item
+
+    def finish(self, status: str = "ok") -> None:
+        """结束区间,重复调用时保留第一次的结果"""
+        if self.end is None:
+            self.end = time.perf_counter()
+            self.status = status
+
+    def snapshot_children(self) -> list["Span"]:
+        with self._lock:
+            return list(self.children)
+
+    def to_dict(self, origin: float) -> dict:
+        """start 为相对于请求开始的偏移(秒)"""
+        data = {
+            "name": self.name,
+            "start": round(self.start - origin, 4),
+            "duration": round(self.duration, 4),
+            "status": self.status,
+            "thread": self.thread,
+        }
+        if self.attrs:
+            data["attrs"] = self.attrs
+        children = self.snapshot_children()
+        if children:
+            data["children"] = [child.to_dict(origin) for child in children]
+        return data
+
+
+class Trace:
+    """一个请求的 span 树,根区间从请求上下文创建时开始"""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.created_at = time.time()
+        self.root = Span("request")
+
+    def finish(self, status: str = "ok") -> None:
+        self.root.finish(status)
+
+    def critical_path(self) -> list[dict]:
+        """决定整个请求耗时的区间链,按开始时间排列;并发的区间中只保留最晚结束的那个"""
+        return [
+            {"name": item.name, "start": round(item.start - self.root.start, 4), "duration": round(item.duration, 4)}
+            for item in _critical_chain(self.root)
+        ]
+
+    def to_dict(self) -> dict:
+        return {
+            "request_id": self.request_id,
+            "object": "trace",
+            "created": int(self.created_at),
+            "duration": round(self.root.duration, 4),
+            "status": self.root.status,
+            "critical_path": self.critical_path(),
+            "spans": self.root.to_dict(self.root.start),
+        }
+
+
+def _span_end(item: Span) -> float:
+    return item.end if item.end is not None else float("inf")
+
+
+def _critical_chain(item: Span) -> list[Span]:
+    """
+    从最晚结束的子区间往前找: 每一步取在上一个区间开始之前结束的、结束最晚的子区间,
+    得到首尾相接的一串子区间,再对其中每个区间递归展开。
+    """
+    children = item.snapshot_children()
+    chain = []
+    cutoff = float("inf")
+    while True:
+        # 允许 1 毫秒的误差,前后衔接的区间之间通常有少量间隔或重叠
+        candidates = [child for child in children if _span_end(child) <= cutoff + 1e-3 and child not in chain]
+        if not candidates:
+            break
+        last = max(candidates, key=_span_end)
+        chain.append(last)
+        cutoff = last.start
+    path = []
+    for child in reversed(chain):
+        path.append(child)
+        path.extend(_critical_chain(child))
+    return path
+
+
+class TraceStore:
+    """保存最近 TRACE_HISTORY_SIZE 个请求的 trace,请求进行中也可查询"""
+
+    def __init__(self):
+        self._items: "OrderedDict[str, Trace]" = OrderedDict()
+        self._lock = Lock()
+
+    def add(self, trace: Trace) -> None:
+        if config.TRACE_HISTORY_SIZE <= 0:
+            return
+        with self._lock:
+            self._items[trace.request_id] = trace
+            while len(self._items) > config.TRACE_HISTORY_SIZE:
+                self._items.popitem(last=False)
+
+    def get(self, request_id: str) -> Optional[Trace]:
+        with self._lock:
+            return self._items.get(request_id)
+
+
+TRACES = TraceStore()
@@ -1,6 +1,5 @@
+import asyncio
 import sys
-import time
-import requests
 import json
 from typing import Optional
 import  os
@@ -17,11 +16,15 @@ if str(ROOT_DIR) not in sys.path:
 from config import base_config as config
 from config.logging_config import logger
 from app.utils.tools import download_file,extract_text_from_file
+from app.utils.http_client import get_async_client, get_session
+from app.utils.request_context import DeadlineExceeded, out_of_time, raise_if_cancelled, timeout_for
+from app.utils.metrics import CRAWL_LATENCY, CRAWL_REQUESTS, RETRIES
+from app.utils.resilience import backoff, backoff_async, guarded, is_available
 
 MIN_RESULT_LEN = 1000
+MAX_CRAWL_ATTEMPTS = 2
 
-def by_firecrawl(url: str, server_url: str = config.FIRECRAWL_API_URL) -> str:
-    scrape_url = f"{server_url}/v1/scrape"
+def _firecrawl_request(url: str) -> tuple[dict, dict]:
     payload = {
         "url": url,
         "onlyMainContent": True,
@@ -33,7 +36,20 @@ def by_firecrawl(url: str, server_url: str = config.FIRECRAWL_API_URL) -> str:
     }
     if config.FIRECRAWL_API_KEY:
         headers["Authorization"] = f"Bearer {config.FIRECRAWL_API_KEY}"
-    response = requests.post(scrape_url, json=payload, headers=headers, timeout=30)
+    return payload, headers
+
+def _jina_headers() -> dict:
+    headers = {
+        "X-Respond-With": "markdown",
+    }
+    if config.JINA_API_KEY:
+        headers["Authorization"] = f"Bearer {config.JINA_API_KEY}"
+    return headers
+
+def by_firecrawl(url: str, server_url: str = config.FIRECRAWL_API_URL) -> str:
+    scrape_url = f"{server_url}/v1/scrape"
+    payload, headers = _firecrawl_request(url)
+    response = get_session().post(scrape_url, json=payload, headers=headers, timeout=timeout_for(30))
     response.raise_for_status()
     
     data_json = json.loads(response.text)
@@ -45,10 +61,11 @@ def by_crawl4ai(url: str, server_url: str = config.CRAWL4AI_API_URL) ->str:
     crawl_paylod = {
         "urls" : [f"{url}"], 
     }
-    response = requests.post(
+    response = get_session().post(
         server_url,
         # headers=headers,
-        json=crawl_paylod
+        json=crawl_paylod,
+        timeout=timeout_for(None)
     )
     response.raise_for_status()
     rsp_json = response.json()
@@ -57,15 +74,32 @@ def by_crawl4ai(url: str, server_url: str = config.CRAWL4AI_API_URL) ->str:
 
 def by_jina(url: str, server_url: str = config.JINA_API_URL) -> str:
     crawl_url = server_url + "/" + url
-    headers = {
-        "X-Respond-With": "markdown",
-    }
-    if config.JINA_API_KEY:
-        headers["Authorization"] = f"Bearer {config.JINA_API_KEY}"
-    response = requests.get(crawl_url, headers=headers, timeout=40)
+    response = get_session().get(crawl_url, headers=_jina_headers(), timeout=timeout_for(40))
     response.raise_for_status()
     return response.text
 
+def _crawl_with(backend: str, crawl_fn, url: str) -> str:
+    """调用抓取后端并记录耗时与结果, 内容过短记为 short; 后端熔断时抛出 BackendUnavailable"""
+    try:
+        with guarded(backend), CRAWL_LATENCY.time(backend=backend):
+            result = crawl_fn(url)
+    except DeadlineExceeded:
+        CRAWL_REQUESTS.inc(backend=backend, status="deadline")
+        raise
+    except Exception:
+        CRAWL_REQUESTS.inc(backend=backend, status="error")
+        raise
+    status = "ok" if result and result != 'error' and len(result) > MIN_RESULT_LEN else "short"
+    CRAWL_REQUESTS.inc(backend=backend, status=status)
+    return result
+
+def _available_crawlers() -> list[str]:
+    """已配置且未熔断的抓取后端,按优先级排列"""
+    return [name for name, server_url in (("firecrawl", config.FIRECRAWL_API_URL),
+                                          ("crawl4ai", config.CRAWL4AI_API_URL),
+                                          ("jina", config.JINA_API_URL))
+            if server_url and is_available(name)]
+
 def url_to_markdown(url: str) -> Optional[str]:
     """
     从给定URL抓取内容并转换为Markdown格式
@@ -76,7 +110,7 @@ def url_to_markdown(url: str) -> Optional[str]:
         str: Markdown格式的内容 如果抓取失败则返回空字符串
     """
     attempt_count = 0
-    max_attempts = 2
+    max_attempts = MAX_CRAWL_ATTEMPTS
     best_result = ''  # 存储最佳结果
     if not url:
         return ""
@@ -97,12 +131,21 @@ def url_to_markdown(url: str) -> Optional[str]:
                 return "提取内容失败!"
 
     while attempt_count < max_attempts:
+        raise_if_cancelled()
+        if out_of_time():
+            logger.warning(f"时间预算已用完,停止抓取 {url}")
+            break
         attempt_count += 1  # 在循环开始就增加计数
+        # 熔断中的后端直接跳过,全部不可用时不再重试
+        backends = _available_crawlers()
+        if not backends:
+            logger.warning(f"没有可用的抓取后端,跳过 {url}")
+            break
         try:
             # firecrawl
-            if config.FIRECRAWL_API_URL:
+            if "firecrawl" in backends:
                 try:
-                    result = by_firecrawl(url)
+                    result = _crawl_with("firecrawl", by_firecrawl, url)
                     if result and result != 'error' and len(result) > MIN_RESULT_LEN:
                         logger.info(f'使用firecrawl抓取 {url} 成功')
                         return result
@@ -112,9 +155,10 @@ def url_to_markdown(url: str) -> Optional[str]:
                     logger.error(f"Firecrawl抓取{url}失败: {str(e)}")
 
             # crawl4ai 
-            if config.CRAWL4AI_API_URL:
+            raise_if_cancelled()
+            if "crawl4ai" in backends:
                 try:
-                    result = by_crawl4ai(url)
+                    result = _crawl_with("crawl4ai", by_crawl4ai, url)
                     if result and result != 'error' and len(result) > MIN_RESULT_LEN:
                         logger.info(f'使用crawl4ai抓取 {url} 成功')
                         return result
@@ -125,9 +169,10 @@ def url_to_markdown(url: str) -> Optional[str]:
                     logger.error(f"Crawl4ai抓取{url}失败: {str(e)}")
 
             # jina
-            if config.JINA_API_URL:
+            raise_if_cancelled()
+            if "jina" in backends:
                 try:
-                    result = by_jina(url)
+                    result = _crawl_with("jina", by_jina, url)
                     if result and result != 'error' and len(result) > MIN_RESULT_LEN:
                         logger.info(f'使用Jina抓取 {url} 成功')
                         return result
@@ -139,12 +184,13 @@ def url_to_markdown(url: str) -> Optional[str]:
 
             if attempt_count < max_attempts:
                 logger.info(f"抓取过程出现问题,第 {attempt_count+1} 次尝试抓取...")
-                time.sleep(1)  # 添加重试延迟
+                RETRIES.inc(stage="crawl", backend="all", model="")
+                backoff(attempt_count - 1)  # 添加重试延迟
 
         except Exception as e:
             logger.error(f"抓取过程发生未知错误: {str(e)}")
             if attempt_count < max_attempts:
-                time.sleep(1)
+                backoff(attempt_count - 1)
 
     if best_result:
         logger.info(f"返回最佳可用结果(长度:{len(best_result)})")
@@ -152,6 +198,85 @@ def url_to_markdown(url: str) -> Optional[str]:
 
     return ''
 
+async def by_firecrawl_async(url: str) -> str:
+    payload, headers = _firecrawl_request(url)
+    response = await get_async_client().post(f"{config.FIRECRAWL_API_URL}/v1/scrape", json=payload,
+                                             headers=headers, timeout=timeout_for(30))
+    response.raise_for_status()
+    return response.json()['data']['markdown']
+
+async def by_crawl4ai_async(url: str) -> str:
+    # 与同步版本一致,只受时间预算限制
+    response = await get_async_client().post(config.CRAWL4AI_API_URL, json={"urls": [url]}, timeout=timeout_for(None))
+    response.raise_for_status()
+    return response.json()["results"][0]["markdown"]["raw_markdown"]
+
+async def by_jina_async(url: str) -> str:
+    response = await get_async_client().get(config.JINA_API_URL + "/" + url, headers=_jina_headers(),
+                                            timeout=timeout_for(40))
+    response.raise_for_status()
+    return response.text
+
+_ASYNC_CRAWLERS = {
+    "firecrawl": by_firecrawl_async,
+    "crawl4ai": by_crawl4ai_async,
+    "jina": by_jina_async,
+}
+
+async def _crawl_with_async(backend: str, url: str) -> str:
+    """_crawl_with 的异步版本"""
+    try:
+        with guarded(backend), CRAWL_LATENCY.time(backend=backend):
+            result = await _ASYNC_CRAWLERS[backend](url)
+    except DeadlineExceeded:
+        CRAWL_REQUESTS.inc(backend=backend, status="deadline")
+        raise
+    except Exception:
+        CRAWL_REQUESTS.inc(backend=backend, status="error")
+        raise
+    status = "ok" if result and result != 'error' and len(result) > MIN_RESULT_LEN else "short"
+    CRAWL_REQUESTS.inc(backend=backend, status=status)
+    return result
+
+async def url_to_markdown_async(url: str) -> str:
+    """url_to_markdown 的异步版本: 按同样的顺序尝试各抓取后端,文件下载仍在线程中同步进行"""
+    if not url:
+        return ""
+    url = url.strip(' ').lower()
+    if not config.JINA_API_URL and url.endswith(tuple(config.AVAILABLE_EXTENSIONS)):
+        return await asyncio.to_thread(url_to_markdown, url)
+
+    best_result = ''
+    for attempt in range(MAX_CRAWL_ATTEMPTS):
+        if out_of_time():
+            logger.warning(f"时间预算已用完,停止抓取 {url}")
+            break
+        backends = _available_crawlers()
+        if not backends:
+            logger.warning(f"没有可用的抓取后端,跳过 {url}")
+            break
+        for backend in backends:
+            if out_of_time():
+                break
+            try:
+                result = await _crawl_with_async(backend, url)
+            except Exception as e:
+                logger.error(f"{backend}抓取{url}失败: {str(e)}")
+                continue
+            if result and result != 'error' and len(result) > MIN_RESULT_LEN:
+                logger.info(f'使用{backend}抓取 {url} 成功')
+                return result
+            if result and len(result) > len(best_result):
+                best_result = result
+        if attempt + 1 < MAX_CRAWL_ATTEMPTS:
+            logger.info(f"抓取过程出现问题,第 {attempt + 2} 次尝试抓取...")
+            RETRIES.inc(stage="crawl", backend="all", model="")
+            await backoff_async(attempt)
+
+    if best_result:
+        logger.info(f"返回最佳可用结果(长度:{len(best_result)})")
+    return best_result
+
 # 使用示例
 if __name__ == "__main__":
     test_url = "https://ai.google.dev/gemini-api/docs/music-generation?hl=zh-cn"
@@ -0,0 +1,192 @@
+"""
+启动预热: 服务启动时解析配置中各依赖服务(SearXNG、Tavily、抓取服务、各模型接口)的域名,
+并提前在共享连接池中建立连接,记录各服务的基线延迟。预热完成前 /ready 返回 503,
+新扩容的实例在连接就绪后才接收流量,第一个请求不再承担 DNS、TCP 与 TLS 握手的耗时。
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import socket
+import sys
+import time
+from threading import Event, Lock, Thread
+from urllib.parse import urlsplit
+
+import openai
+
+# 将项目根目录添加到sys.path
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from app.search import searxng_pool
+from app.search.search_searxng_api import TAVILY_URL
+from app.utils.http_client import get_session
+from app.utils.llm_client import get_openai_client
+from app.utils.metrics import Gauge
+from config import base_config as config
+from config.logging_config import logger
+
+GEMINI_URL = "https://generativelanguage.googleapis.com"
+
+_READY = Event()
+_STARTED = False
+_LOCK = Lock()
+_RESULTS: dict[str, dict] = {}
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def http_endpoints() -> dict[str, str]:
+    """通过共享 requests.Session 访问的服务: 名称 -> 源站地址"""
+    endpoints = {instance.name: instance.url for instance in searxng_pool.instances()}
+    endpoints.update({
+        "tavily": TAVILY_URL if config.TAVILY_KEY else "",
+        "firecrawl": config.FIRECRAWL_API_URL,
+        "crawl4ai": config.CRAWL4AI_API_URL,
+        "jina": config.JINA_API_URL,
+        "gemini": GEMINI_URL if "GEMINI" in (config.COMPRESS_API_TYPE, config.SUMMARY_API_TYPE) else "",
+    })
+    return {name: _origin(url) for name, url in endpoints.items() if url}
+
+
+def llm_endpoints() -> dict[str, tuple[str, list[str]]]:
+    """通过 OpenAI 兼容客户端访问的模型接口: 名称 -> (base_url, 全部密钥),相同地址只预热一次"""
+    stages = [
+        ("chat", config.BASE_CHAT_API_URL, config.BASE_CHAT_API_KEYS),
+        ("keyword", config.SEARCH_KEYWORD_API_URL, config.SEARCH_KEYWORD_API_KEYS),
+        ("evaluate", config.EVALUATE_API_URL, config.EVALUATE_API_KEYS),
+    ]
+    if config.COMPRESS_API_TYPE != "GEMINI":
+        stages.append(("compress", config.COMPRESS_API_URL, config.COMPRESS_API_KEYS))
+    if config.SUMMARY_API_TYPE != "GEMINI":
+        stages.append(("summary", config.SUMMARY_API_URL, config.SUMMARY_API_KEYS))
+
+    endpoints: dict[str, tuple[str, list[str]]] = {}
+    by_url: dict[tuple, str] = {}
+    for stage, url, keys in stages:
+        if not url:
+            continue
+        signature = (url, tuple(keys))
+        if signature in by_url:
+            # 多个阶段共用同一接口时合并名称,如 llm:chat,keyword
+            old = by_url[signature]
+            new = f"{old},{stage}"
+            endpoints[new] = endpoints.pop(old)
+            by_url[signature] = new
+        else:
+            name = f"llm:{stage}"
+            endpoints[name] = (url, list(keys))
+            by_url[signature] = name
+    return endpoints
+
+
+def _resolve(url: str) -> float:
+    """解析域名并返回耗时,结果由系统缓存供随后的连接使用"""
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    start = time.perf_counter()
+    socket.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)
+    return time.perf_counter() - start
+
+
+def _open_http(url: str) -> float:
+    """向源站发送 HEAD 请求建立连接,任何 HTTP 状态码都说明连接可用"""
+    start = time.perf_counter()
+    get_session().head(url, timeout=config.WARMUP_TIMEOUT, allow_redirects=False).close()
+    return time.perf_counter() - start
+
+
+def _open_llm(url: str, key: str) -> float:
+    """通过共享的 OpenAI 客户端请求模型列表,在该客户端的连接池中建立连接"""
+    client = get_openai_client(url, key).with_options(timeout=config.WARMUP_TIMEOUT, max_retries=0)
+    start = time.perf_counter()
+    try:
+        # 只需要建立连接,不解析返回内容
+        client.models.with_raw_response.list()
+    except openai.APIStatusError:
+        # 部分服务商不提供模型列表接口,有响应即说明连接可用
+        pass
+    return time.perf_counter() - start
+
+
+def _warm(name: str, url: str, connect) -> dict:
+    result = {"url": url, "ok": False}
+    try:
+        result["dns_seconds"] = round(_resolve(url), 4)
+        WARMUP_SECONDS.set(result["dns_seconds"], endpoint=name, phase="dns")
+        # 并发请求,让连接池中保留多个已建立的连接
+        with ThreadPoolExecutor(max_workers=config.WARMUP_CONNECTIONS) as executor:
+            seconds = list(executor.map(lambda _: connect(), range(config.WARMUP_CONNECTIONS)))
+        result["connect_seconds"] = round(min(seconds), 4)
+        result["ok"] = True
+        WARMUP_SECONDS.set(result["connect_seconds"], endpoint=name, phase="connect")
+        logger.info(f"预热 {name} ({url}) 完成: DNS {result['dns_seconds']:.3f} 秒,"
+                    f"首个请求 {result['connect_seconds']:.3f} 秒")
+    except Exception as e:
+        result["error"] = str(e)[:200]
+        logger.warning(f"预热 {name} ({url}) 失败: {e}")
+    return result
+
+
+def warmup() -> dict[str, dict]:
+    """预热全部已配置的服务,返回 {名称: 结果};单个服务失败不影响其他服务"""
+    tasks = [(name, url, lambda url=url: _open_http(url)) for name, url in http_endpoints().items()]
+    for name, (url, keys) in llm_endpoints().items():
+        # 每个密钥对应一个客户端和连接池,分别预热
+        for index, key in enumerate(keys or [""], 1):
+            label = name if len(keys) <= 1 else f"{name}#{index}"
+            tasks.append((label, url, lambda url=url, key=key: _open_llm(url, key)))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(len(tasks), 16))) as executor:
+        results = dict(zip([name for name, _, _ in tasks],
+                           executor.map(lambda task: _warm(*task), tasks)))
+    failed = [name for name, result in results.items() if not result["ok"]]
+    logger.info(f"启动预热完成,共 {len(results)} 个服务,耗时 {time.perf_counter() - start:.2f} 秒"
+                + (f",失败: {', '.join(failed)}" if failed else ""))
+    return results
+
+
+def _run() -> None:
+    try:
+        results = warmup()
+        with _LOCK:
+            _RESULTS.update(results)
+    except Exception as e:
+        logger.error(f"启动预热出错: {e}")
+    finally:
+        # 预热失败的服务在请求时再建立连接,不阻止实例就绪
+        _READY.set()
+
+
+def start_warmup() -> None:
+    """在后台线程中开始预热,只执行一次;WARMUP_ON_START 关闭时直接标记为就绪"""
+    global _STARTED
+    with _LOCK:
+        if _STARTED:
+            return
+        _STARTED = True
+    if not config.WARMUP_ON_START:
+        _READY.set()
+        return
+    logger.info("开始启动预热...")
+    Thread(target=_run, name="warmup", daemon=True).start()
+
+
+def is_ready() -> bool:
+    return _READY.is_set()
+
+
+def readiness() -> dict:
+    """/ready 接口的返回内容"""
+    with _LOCK:
+        endpoints = dict(_RESULTS)
+    return {"status": "ready" if is_ready() else "warming", "endpoints": endpoints}
+
+
+WARMUP_SECONDS = Gauge("warmup_seconds", "启动预热时各服务的基线延迟: dns 为域名解析, connect 为首个请求",
+                       ("endpoint", "phase"))
+Gauge("ready", "预热完成并可以接收流量时为 1", callback=lambda: {(): 1 if is_ready() else 0})
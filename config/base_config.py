@@ -35,6 +35,13 @@ load_env()
 APP_LANG = os.getenv("APP_LANG", "zh").lower()
 
 
+def parse_api_keys(api_key_str) -> list[str]:
+    """解析逗号分隔的API密钥字符串，实际调用时由 app/utils/key_pool.py 按次轮换使用"""
+    if not api_key_str:
+        return []
+    return [key.strip() for key in api_key_str.split(',') if key.strip()]
+
+
 def get_random_api_key(api_key_str):
     """从逗号分隔的API密钥字符串中随机选择一个
     
@@ -44,10 +51,7 @@ def get_random_api_key(api_key_str):
     Returns:
         随机选择的API密钥，如果输入为空则返回空字符串
     """
-    if not api_key_str:
-        return ""
-    
-    keys = [key.strip() for key in api_key_str.split(',') if key.strip()]
+    keys = parse_api_keys(api_key_str)
     if not keys:
         return ""
     
@@ -67,12 +71,15 @@ API_KEY = os.getenv("API_KEY", "sk-1")
 #############################################
 # SearXNG配置（需要支持JSON格式）
 SEARXNG_URL = os.getenv("SEARXNG_URL")
+# 可填写多个 SearXNG 实例(逗号分隔),每次搜索选择负载最低的实例,见 app/search/searxng_pool.py
+SEARXNG_URLS = [url.strip() for url in (SEARXNG_URL or "").split(",") if url.strip()]
 SEARCH_API_LIMIT = os.getenv("SEARCH_API_LIMIT")
 if SEARCH_API_LIMIT:
     SEARCH_API_LIMIT = int(SEARCH_API_LIMIT)
 
 # tavily 配置
 TAVILY_KEY = get_random_api_key(os.getenv("TAVILY_KEY", ""))
+TAVILY_KEYS = parse_api_keys(os.getenv("TAVILY_KEY", ""))
 TAVILY_MAX_NUM = os.getenv("TAVILY_MAX_NUM","20")
 #############################################
 # 网页爬虫配置
@@ -119,17 +126,20 @@ MAX_STEPS_NUM = int(os.getenv("MAX_STEPS_NUM", "12"))
 
 # 基础对话模型配置（需要支持function calling）
 BASE_CHAT_API_KEY = get_random_api_key(os.getenv("BASE_CHAT_API_KEY"))
+BASE_CHAT_API_KEYS = parse_api_keys(os.getenv("BASE_CHAT_API_KEY"))
 BASE_CHAT_API_URL = os.getenv("BASE_CHAT_API_URL")
 BASE_CHAT_MODEL = os.getenv("BASE_CHAT_MODEL")
 
 # 生成联网搜索关键词的模型配置（留空表示和基础对话模型相同）
 SEARCH_KEYWORD_API_KEY = get_random_api_key(os.getenv("SEARCH_KEYWORD_API_KEY", os.getenv("BASE_CHAT_API_KEY", "")))
+SEARCH_KEYWORD_API_KEYS = parse_api_keys(os.getenv("SEARCH_KEYWORD_API_KEY", os.getenv("BASE_CHAT_API_KEY", "")))
 SEARCH_KEYWORD_API_URL = os.getenv("SEARCH_KEYWORD_API_URL", BASE_CHAT_API_URL)
 SEARCH_KEYWORD_MODEL = os.getenv("SEARCH_KEYWORD_MODEL", BASE_CHAT_MODEL)
 
 # 评估网页价值的模型配置
 EVALUATE_THREAD_NUM = int(os.getenv("EVALUATE_THREAD_NUM", 5))
 EVALUATE_API_KEY = get_random_api_key(os.getenv("EVALUATE_API_KEY", os.getenv("BASE_CHAT_API_KEY", "")))
+EVALUATE_API_KEYS = parse_api_keys(os.getenv("EVALUATE_API_KEY", os.getenv("BASE_CHAT_API_KEY", "")))
 EVALUATE_API_URL = os.getenv("EVALUATE_API_URL", BASE_CHAT_API_URL)
 EVALUATE_MODEL = os.getenv("EVALUATE_MODEL", BASE_CHAT_MODEL)
 
@@ -139,6 +149,7 @@ COMPRESS_API_TYPE = os.getenv("COMPRESS_API_TYPE")
 if COMPRESS_API_TYPE:
     COMPRESS_API_TYPE = COMPRESS_API_TYPE.upper()
 COMPRESS_API_KEY = get_random_api_key(os.getenv("COMPRESS_API_KEY"))
+COMPRESS_API_KEYS = parse_api_keys(os.getenv("COMPRESS_API_KEY"))
 COMPRESS_API_URL = os.getenv("COMPRESS_API_URL","https://generativelanguage.googleapis.com")
 COMPRESS_MODEL = os.getenv("COMPRESS_MODEL")
 
@@ -147,6 +158,7 @@ SUMMARY_API_TYPE = os.getenv("SUMMARY_API_TYPE")
 if SUMMARY_API_TYPE:
     SUMMARY_API_TYPE = SUMMARY_API_TYPE.upper()
 SUMMARY_API_KEY = get_random_api_key(os.getenv("SUMMARY_API_KEY", os.getenv("BASE_CHAT_API_KEY", "")))
+SUMMARY_API_KEYS = parse_api_keys(os.getenv("SUMMARY_API_KEY", os.getenv("BASE_CHAT_API_KEY", "")))
 SUMMARY_API_URL = os.getenv("SUMMARY_API_URL", BASE_CHAT_API_URL)
 SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", BASE_CHAT_MODEL)
 
@@ -170,27 +182,37 @@ if ALL_IN_GEMINI_KEY:
     # --- 为每个模型组按需应用默认值 ---
     
     # 基础与关键词模型 (Pro)
-    if not BASE_CHAT_API_KEY: BASE_CHAT_API_KEY = get_random_api_key(gemini_key_str)
+    if not BASE_CHAT_API_KEY:
+        BASE_CHAT_API_KEY = get_random_api_key(gemini_key_str)
+        BASE_CHAT_API_KEYS = parse_api_keys(gemini_key_str)
     if not BASE_CHAT_API_URL: BASE_CHAT_API_URL = openai_compatible_url
     if not BASE_CHAT_MODEL: BASE_CHAT_MODEL = model_pro_openai
     # 由于关键词模型默认跟随基础模型，只需确保基础模型有值即可
-    if not SEARCH_KEYWORD_API_KEY: SEARCH_KEYWORD_API_KEY = BASE_CHAT_API_KEY
+    if not SEARCH_KEYWORD_API_KEY:
+        SEARCH_KEYWORD_API_KEY = BASE_CHAT_API_KEY
+        SEARCH_KEYWORD_API_KEYS = BASE_CHAT_API_KEYS
     if not SEARCH_KEYWORD_API_URL: SEARCH_KEYWORD_API_URL = BASE_CHAT_API_URL
     if not SEARCH_KEYWORD_MODEL: SEARCH_KEYWORD_MODEL = BASE_CHAT_MODEL
 
     # 评估模型 (Flash, OpenAI兼容接口)
-    if not EVALUATE_API_KEY: EVALUATE_API_KEY = get_random_api_key(gemini_key_str)
+    if not EVALUATE_API_KEY:
+        EVALUATE_API_KEY = get_random_api_key(gemini_key_str)
+        EVALUATE_API_KEYS = parse_api_keys(gemini_key_str)
     if not EVALUATE_API_URL: EVALUATE_API_URL = openai_compatible_url
     if not EVALUATE_MODEL: EVALUATE_MODEL = model_flash_openai
 
     # 压缩模型 (Flash, 原生接口)
-    if not COMPRESS_API_KEY: COMPRESS_API_KEY = get_random_api_key(gemini_key_str)
+    if not COMPRESS_API_KEY:
+        COMPRESS_API_KEY = get_random_api_key(gemini_key_str)
+        COMPRESS_API_KEYS = parse_api_keys(gemini_key_str)
     if not COMPRESS_API_URL: COMPRESS_API_URL = native_gemini_url
     if not COMPRESS_MODEL: COMPRESS_MODEL = model_flash_native
     if not COMPRESS_API_TYPE: COMPRESS_API_TYPE = "GEMINI"
 
     # 总结模型 (Pro)
-    if not SUMMARY_API_KEY: SUMMARY_API_KEY = get_random_api_key(gemini_key_str)
+    if not SUMMARY_API_KEY:
+        SUMMARY_API_KEY = get_random_api_key(gemini_key_str)
+        SUMMARY_API_KEYS = parse_api_keys(gemini_key_str)
     if not SUMMARY_API_URL: SUMMARY_API_URL = openai_compatible_url
     if not SUMMARY_MODEL: SUMMARY_MODEL = model_pro_openai
     if not SUMMARY_API_TYPE: SUMMARY_API_TYPE = "OPENAI" # OpenAI兼容接口的类型
@@ -202,6 +224,95 @@ if ALL_IN_GEMINI_KEY:
 AVAILABLE_EXTENSIONS = ['.pdf', '.docx', '.doc', '.xlsx', '.xls']
 HEARTBEAT_TIMEOUT = int(os.getenv("HEARTBEAT_TIMEOUT",25))
 
+# 准入控制: 普通搜索与深度研究分别限制并发数和排队长度(并发数为0表示不限制),队列满时返回429
+SEARCH_MAX_CONCURRENCY = int(os.getenv("SEARCH_MAX_CONCURRENCY", "16"))
+SEARCH_MAX_QUEUE = int(os.getenv("SEARCH_MAX_QUEUE", "32"))
+DEEPRESEARCH_MAX_CONCURRENCY = int(os.getenv("DEEPRESEARCH_MAX_CONCURRENCY", "4"))
+DEEPRESEARCH_MAX_QUEUE = int(os.getenv("DEEPRESEARCH_MAX_QUEUE", "8"))
+# 排队等待的最长时间(秒),超时同样返回429
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+
+# 深度研究流式请求作为后台任务运行,客户端断开后任务继续,可通过 Last-Event-ID 断点续传
+DETACHED_RESEARCH_JOBS = os.getenv("DETACHED_RESEARCH_JOBS", "true").lower() == "true"
+# 后台任务结束后保留事件日志的时间(秒)
+JOB_TTL = int(os.getenv("JOB_TTL", "1800"))
+
+# 所有流式响应共享的线程池大小,只有正在阻塞等待的流水线步骤才会占用线程;不少于两种模式的并发上限之和
+STREAM_WORKER_NUM = int(os.getenv("STREAM_WORKER_NUM", "64"))
+# 每条流最多预先缓存的数据条数,读者过慢时暂停生产,避免内存无限增长
+STREAM_BUFFER_SIZE = int(os.getenv("STREAM_BUFFER_SIZE", "64"))
+
+# 响应缓存: 消息、模型与搜索模式都相同的请求在有效期内直接回放上次的结果,有效期为0表示关闭(秒)
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "0"))
+# 响应缓存最多保存的条数,超出后淘汰最久未使用的
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+
+# 开启 /metrics 接口,输出 Prometheus 格式的各阶段耗时、调用次数与排队情况(无需 API key)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# 在流式响应结束前(data: [DONE] 之前)额外发送一条 event: trace 事件,内容为本次请求的 span 时间线
+TRACE_SSE = os.getenv("TRACE_SSE", "false").lower() == "true"
+# 保留最近多少个请求的 span 时间线,可通过 /v1/traces/<request_id> 查询,0 表示不保留
+TRACE_HISTORY_SIZE = int(os.getenv("TRACE_HISTORY_SIZE", "200"))
+
+# 对外 HTTP 请求共用的连接池: 每个主机保留的长连接数,为 true 时超出后等待空闲连接而不是新建
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))
+HTTP_POOL_BLOCK = os.getenv("HTTP_POOL_BLOCK", "false").lower() == "true"
+# 单独限制部分主机的最大连接数,格式为 主机名[:端口]=连接数,多个用逗号分隔,如 r.jina.ai=8,localhost:8080=16
+HTTP_HOST_LIMITS = os.getenv("HTTP_HOST_LIMITS", "")
+
+# 多个API密钥按调用轮换,遇到429或配额错误的密钥暂停使用的时间(秒),接口返回 Retry-After 时以其为准
+KEY_COOLDOWN_SECONDS = float(os.getenv("KEY_COOLDOWN_SECONDS", "60"))
+
+# 按模型名或搜索后端(searxng/tavily)限制每分钟请求数与token数,所有并发请求共享,格式为 名称=RPM[/TPM],多个用逗号分隔
+# 如 gemini-2.5-flash=1000/1000000,searxng=120,未列出的不限制
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+
+# 熔断: 搜索后端、抓取后端或模型连续失败多少次后暂停调用,以及暂停多久后放行一次试探调用(秒)
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+# 重试等待: 第n次重试前随机等待 0 ~ min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2^n) 秒
+RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", "0.5"))
+RETRY_BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX", "8"))
+# 搜索与研究阶段的总时间预算(秒),到期后不再发起新的搜索、抓取与评估,用已有结果生成回答;0 表示不限制
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "600"))
+# 各阶段单次执行的时间预算(秒),格式为 阶段=秒数: search 为一轮关键词搜索,evaluate 为相关性评估,crawl 为一轮网页抓取与压缩
+STAGE_BUDGETS = os.getenv("STAGE_BUDGETS", "search=60,evaluate=60,crawl=180")
+# 异步扇出: 搜索、抓取压缩、相关性评估在同一个事件循环上并发,不再为每个请求创建线程池
+ASYNC_FANOUT = os.getenv("ASYNC_FANOUT", "false").lower() == "true"
+# 异步扇出时单个阶段同时进行的调用数上限
+ASYNC_FANOUT_LIMIT = int(os.getenv("ASYNC_FANOUT_LIMIT", "32"))
+# 启动预热: 启动时解析各依赖服务的域名并提前建立连接,完成前 /ready 返回 503
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "true").lower() == "true"
+# 预热时每个服务提前建立的连接数,以及单次预热请求的超时(秒)
+WARMUP_CONNECTIONS = max(1, int(os.getenv("WARMUP_CONNECTIONS", "2")))
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "10"))
+# 搜索结果缓存的有效期(秒),按搜索的时间范围区分: day/month/year 为限定最近几天/几个月/几年,any 为不限时间;0 或未列出表示不缓存
+SEARCH_CACHE_TTLS = os.getenv("SEARCH_CACHE_TTLS", "day=1800,month=21600,year=86400,any=604800")
+# 内存中最多保存的搜索结果条数,超出后淘汰最久未使用的
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+# 磁盘缓存所在目录(相对路径基于项目根目录),重启后仍可用;留空表示只使用内存缓存
+SEARCH_CACHE_DIR = os.getenv("SEARCH_CACHE_DIR", "cache")
+# 同时配置了多个搜索后端时的用法: fallback 只用优先级最高的可用后端(SearXNG 优先);
+# all 同时查询全部后端并合并去重;race 同时查询,不重复结果达到 SEARCH_RACE_MIN_RESULTS 条时立即返回,不再等待较慢的后端
+SEARCH_PROVIDER_MODE = os.getenv("SEARCH_PROVIDER_MODE", "fallback").lower()
+SEARCH_RACE_MIN_RESULTS = int(os.getenv("SEARCH_RACE_MIN_RESULTS", "10"))
+# 配置了多个 SearXNG 实例时,首个实例超过其近期 p90 延迟仍未返回,则向另一个实例发出相同的搜索,取先返回的结果
+SEARXNG_HEDGE = os.getenv("SEARXNG_HEDGE", "false").lower() == "true"
+# 实例的延迟样本不足时,发出对冲请求前的等待时间(秒)
+SEARXNG_HEDGE_DELAY = float(os.getenv("SEARXNG_HEDGE_DELAY", "3"))
+# 搜索扇出(对冲请求、多后端同时查询、SearXNG 多页并行)共用的线程池大小,每一层各一个线程池,修改后需重启生效
+SEARCH_FANOUT_THREADS = int(os.getenv("SEARCH_FANOUT_THREADS", "16"))
+# 搜索关键词去重: 忽略大小写、标点与词序后,与同一请求中已搜索过的关键词的词集合相似度(Jaccard)达到该值时直接使用已有结果;1 表示只合并规范化后完全相同的,0 表示关闭
+QUERY_DEDUP_SIMILARITY = float(os.getenv("QUERY_DEDUP_SIMILARITY", "0.8"))
+# 在具备所需能力(时间范围过滤、语言)的搜索后端中如何选择: priority 按注册顺序,cheapest 选调用成本最低的,fastest 选近期延迟最低的
+SEARCH_ROUTING = os.getenv("SEARCH_ROUTING", "priority").lower()
+# 从本地 JSON 文件返回固定结果的搜索后端,用于离线压测或调试,格式为 名称=文件路径,多个用逗号分隔
+SEARCH_FILE_BACKENDS = os.getenv("SEARCH_FILE_BACKENDS", "")
+# SearXNG 第一页去重后的结果少于 SEARXNG_MIN_RESULTS 条时,并行请求后续页(最多到第 SEARXNG_MAX_PAGES 页),结果足够即停止
+SEARXNG_MIN_RESULTS = int(os.getenv("SEARXNG_MIN_RESULTS", "10"))
+SEARXNG_MAX_PAGES = int(os.getenv("SEARXNG_MAX_PAGES", "3"))
+
 #############################################
 # 配置校验
 #############################################
@@ -5,8 +5,10 @@ from waitress import serve
 from app.utils.test_api import run_tests
 from config.logging_config import logger
 from config import base_config as config
+from app.api.admission import server_threads
 from app.api.routes import register_routes
 from webui.setting import env_editor_bp
+from app.utils.warmup import start_warmup
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'https://github.com/cat3399/deepreseach'
@@ -14,9 +16,33 @@ app.config['SECRET_KEY'] = 'https://github.com/cat3399/deepreseach'
 register_routes(app)
 app.register_blueprint(env_editor_bp)
 
+
+_ASGI_APP = None
+
+
+def get_asgi_app():
+    """ASGI 应用,首次调用时创建;只用 waitress 启动时不需要安装 asgi 可选依赖(uvicorn、a2wsgi)"""
+    global _ASGI_APP
+    if _ASGI_APP is None:
+        from app.api.asgi_app import create_asgi_app
+        _ASGI_APP = create_asgi_app(app)
+    return _ASGI_APP
+
+
+def __getattr__(name):
+    # ASGI 入口,可用 uvicorn main:asgi_app 启动
+    if name == "asgi_app":
+        return get_asgi_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 # 打印初始信息
 logger.info(f"基础对话使用的模型: {config.BASE_CHAT_MODEL}")
 
+# 后台预热依赖服务的连接,完成前 /ready 返回 503;--test 时不需要
+if "--test" not in (arg.lower() for arg in sys.argv[1:]):
+    start_warmup()
+
 if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1].lower() == '--test':
         logger.info("开始执行测试...")
@@ -24,9 +50,18 @@ if __name__ == "__main__":
         test_to_run = sys.argv[2] if len(sys.argv) > 2 else None
         exit_code = run_tests(specific_test_name=test_to_run)
         sys.exit(exit_code)
+    elif len(sys.argv) > 1 and sys.argv[1].lower() == '--asgi':
+        # 异步模式: 流式响应运行在事件循环上,不再为每个连接占用一个线程
+        import uvicorn
+        logger.info("以 ASGI 模式启动服务中.....")
+        logger.info("可进入 http://127.0.0.1:5000/setting 配置环境变量文件")
+        uvicorn.run(get_asgi_app(), host="0.0.0.0", port=5000)
     else:
         # 如果没有 'test' 参数，正常启动服务
         logger.info("如果你不知道API是否填写正确,可执行 python main.py --test进行测试")
         logger.info("启动服务中.....")
         logger.info("可进入 http://127.0.0.1:5000/setting 配置环境变量文件")
-        serve(app, host="0.0.0.0", port=5000, threads=8)
\ No newline at end of file
+        # 线程数覆盖准入控制的并发上限与队列长度,超出的请求由准入控制返回 429 而不是在 waitress 中排队
+        threads = server_threads()
+        logger.info(f"waitress 工作线程数: {threads}")
+        serve(app, host="0.0.0.0", port=5000, threads=threads)
\ No newline at end of file
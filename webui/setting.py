@@ -13,6 +13,7 @@ env_path = ROOT_DIR.joinpath(".env")
 
 from config import base_config as config
 from config.logging_config import logger
+from app.utils.llm_client import clear_openai_clients
 from app.utils.test_api import get_available_tests, run_single_test
 
 env_editor_bp = Blueprint('setting', __name__, template_folder='templates')
@@ -64,7 +65,7 @@ def get_structured_config(env_path):
         {
             "title": "搜索引擎配置", "icon": "fa-search", "test_name": "search_api_worker_test",
             "vars": [
-                {"key": "SEARXNG_URL", "type": "text", "placeholder": "例如: https://sousuo.emoe.top/search"},
+                {"key": "SEARXNG_URL", "type": "text", "placeholder": "例如: https://sousuo.emoe.top/search,多个实例用逗号分隔"},
                 {"key": "TAVILY_KEY", "type": "password", "placeholder": "Tavily API Key (可选, SearXNG优先)"},
                 {"key": "TAVILY_MAX_NUM", "type": "number", "min": 5, "max": 50, "placeholder": "默认 20"},
                 {"key": "SEARCH_API_LIMIT", "type": "number", "min": 1, "max": 10, "placeholder": "并发限制 默认 5"},
@@ -128,6 +129,48 @@ def get_structured_config(env_path):
             "title": "杂项", "icon": "fa-sliders-h",
             "vars": [
                 {"key": "HEARTBEAT_TIMEOUT", "type": "number", "min": 10, "placeholder": "单位:秒"},
+                {"key": "STREAM_WORKER_NUM", "type": "number", "min": 1, "placeholder": "流式响应共享线程数 默认 64"},
+                {"key": "STREAM_BUFFER_SIZE", "type": "number", "min": 1, "placeholder": "每条流缓冲上限 默认 64"},
+                {"key": "SEARCH_MAX_CONCURRENCY", "type": "number", "min": 0, "placeholder": "普通搜索最大并发 默认 16"},
+                {"key": "SEARCH_MAX_QUEUE", "type": "number", "min": 0, "placeholder": "普通搜索排队上限 默认 32"},
+                {"key": "DEEPRESEARCH_MAX_CONCURRENCY", "type": "number", "min": 0, "placeholder": "深度研究最大并发 默认 4"},
+                {"key": "DEEPRESEARCH_MAX_QUEUE", "type": "number", "min": 0, "placeholder": "深度研究排队上限 默认 8"},
+                {"key": "ADMISSION_QUEUE_TIMEOUT", "type": "number", "min": 1, "placeholder": "排队超时 单位:秒"},
+                {"key": "DETACHED_RESEARCH_JOBS", "type": "select", "options": ["", "true", "false"], "placeholder": "默认 true"},
+                {"key": "JOB_TTL", "type": "number", "min": 60, "placeholder": "任务保留时间 单位:秒"},
+                {"key": "RESPONSE_CACHE_TTL", "type": "number", "min": 0, "placeholder": "响应缓存有效期 单位:秒 0为关闭"},
+                {"key": "RESPONSE_CACHE_SIZE", "type": "number", "min": 1, "placeholder": "响应缓存条数 默认 256"},
+                {"key": "METRICS_ENABLED", "type": "select", "options": ["", "true", "false"], "placeholder": "/metrics 接口 默认 true"},
+                {"key": "TRACE_SSE", "type": "select", "options": ["", "true", "false"], "placeholder": "流式响应附带 trace 事件 默认 false"},
+                {"key": "TRACE_HISTORY_SIZE", "type": "number", "min": 0, "placeholder": "保留的 trace 数量 默认 200"},
+                {"key": "HTTP_POOL_MAXSIZE", "type": "number", "min": 1, "placeholder": "每个主机的长连接数 默认 32"},
+                {"key": "HTTP_POOL_BLOCK", "type": "select", "options": ["", "true", "false"], "placeholder": "连接池满时等待 默认 false"},
+                {"key": "HTTP_HOST_LIMITS", "type": "text", "placeholder": "如 r.jina.ai=8,localhost:8080=16"},
+                {"key": "KEY_COOLDOWN_SECONDS", "type": "number", "min": 0, "placeholder": "被限流的密钥暂停秒数 默认 60"},
+                {"key": "RATE_LIMITS", "type": "text", "placeholder": "如 gemini-2.5-flash=1000/1000000,searxng=120"},
+                {"key": "CIRCUIT_FAILURE_THRESHOLD", "type": "number", "min": 1, "placeholder": "连续失败多少次后熔断 默认 5"},
+                {"key": "CIRCUIT_RESET_SECONDS", "type": "number", "min": 0, "placeholder": "熔断后多久试探恢复 默认 30"},
+                {"key": "RETRY_BACKOFF_BASE", "type": "text", "placeholder": "重试等待基数(秒) 默认 0.5"},
+                {"key": "RETRY_BACKOFF_MAX", "type": "number", "min": 0, "placeholder": "重试最长等待(秒) 默认 8"},
+                {"key": "REQUEST_DEADLINE_SECONDS", "type": "number", "min": 0, "placeholder": "搜索与研究总时间预算(秒) 默认 600"},
+                {"key": "STAGE_BUDGETS", "type": "text", "placeholder": "search=60,evaluate=60,crawl=180"},
+                {"key": "ASYNC_FANOUT", "type": "select", "options": ["", "true", "false"], "placeholder": "异步扇出 默认 false"},
+                {"key": "ASYNC_FANOUT_LIMIT", "type": "number", "min": 1, "placeholder": "异步扇出并发上限 默认 32"},
+                {"key": "WARMUP_ON_START", "type": "select", "options": ["", "true", "false"], "placeholder": "启动预热 默认 true"},
+                {"key": "WARMUP_CONNECTIONS", "type": "number", "min": 1, "placeholder": "每个服务预热的连接数 默认 2"},
+                {"key": "WARMUP_TIMEOUT", "type": "text", "placeholder": "预热请求超时(秒) 默认 10"},
+                {"key": "SEARCH_CACHE_TTLS", "type": "text", "placeholder": "day=1800,month=21600,year=86400,any=604800"},
+                {"key": "SEARCH_CACHE_SIZE", "type": "number", "min": 1, "placeholder": "内存中缓存的搜索结果条数 默认 1024"},
+                {"key": "SEARCH_CACHE_DIR", "type": "text", "placeholder": "磁盘缓存目录 默认 cache,留空只用内存"},
+                {"key": "SEARCH_PROVIDER_MODE", "type": "select", "options": ["", "fallback", "all", "race"], "placeholder": "多个搜索后端的用法 默认 fallback"},
+                {"key": "SEARCH_RACE_MIN_RESULTS", "type": "number", "min": 1, "placeholder": "race 模式下足够的结果数 默认 10"},
+                {"key": "SEARXNG_HEDGE", "type": "select", "options": ["", "true", "false"], "placeholder": "多个 SearXNG 实例时对冲请求 默认 false"},
+                {"key": "SEARXNG_HEDGE_DELAY", "type": "text", "placeholder": "样本不足时的对冲等待(秒) 默认 3"},
+                {"key": "QUERY_DEDUP_SIMILARITY", "type": "text", "placeholder": "关键词去重相似度 默认 0.8,0 表示关闭"},
+                {"key": "SEARCH_ROUTING", "type": "select", "options": ["", "priority", "cheapest", "fastest"], "placeholder": "搜索后端的选择方式 默认 priority"},
+                {"key": "SEARCH_FILE_BACKENDS", "type": "text", "placeholder": "本地文件搜索后端 名称=路径,逗号分隔"},
+                {"key": "SEARXNG_MIN_RESULTS", "type": "number", "min": 0, "placeholder": "SearXNG 结果少于该数时翻页 默认 10"},
+                {"key": "SEARXNG_MAX_PAGES", "type": "number", "min": 1, "placeholder": "SearXNG 最多请求到第几页 默认 3"},
             ]
         }
     ]
@@ -216,6 +259,7 @@ def save_config():
             set_key(env_path, key, value, quote_mode="always")
             
         config.reload_config()
+        clear_openai_clients()
         logger.info('配置已成功保存并重新加载！')
         flash('配置已成功保存并重新加载！', 'success')
     except Exception as e: